@@ -1,5 +1,21 @@
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
 from query_rewrite import QueryRewriter
+from utils import timing
+
+# threads do modo especulativo do FusionAgent (compartilhadas: o main.py cria um agent por query)
+FUSION_WORKERS = 32
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _fusion_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=FUSION_WORKERS, thread_name_prefix="fusion")
+        return _pool
 
 
 class StandardAgent:
@@ -12,26 +28,116 @@ class StandardAgent:
     
     def retrieve(self, query: str):
         return self.retriever.retrieve(query)[:self.top_k]
+
+    def retrieve_many(self, queries: list[str]):
+        return [results[:self.top_k] for results in self.retriever.retrieve_many(queries)]
     
 
 class FusionAgent:
     """
     RAG-Fusion: gera variações de query, roda retrieval por query gerada e funde com RRF.
+
+    speculative=True (padrão): o retrieval da query original começa junto com a
+    reescrita (LLM), e as variações vão ao retriever em um único retrieve_many assim
+    que chegam; a latência fica perto de max(reescrita, retrieval) + um lote.
+    speculative=False: reescreve e depois manda original + variações em um lote só.
+
+    rewrite_budget_ms (opcional, só no modo especulativo): se a reescrita não chegar
+    no prazo, devolve o ranking da query original, marcado como degradado
+    (metadata["degraded"] e timing.mark_degraded("rewrite")). A reescrita continua
+    em segundo plano e fica no cache do rewriter para a próxima vez.
+
+    rewriter: QueryRewriter (LLM) ou qualquer objeto com rewrite(query) -> list[str],
+    como o PRFRewriter (expansão local por pseudo-relevance feedback).
+
+    Se o retriever tem match(query) (CodeMatchRetriever), as queries que ele resolve
+    sozinho (código da BNCC) não passam pela reescrita nem pelo RRF.
     """
-    def __init__(self, retriever, rewriter: QueryRewriter = QueryRewriter(), top_k: int = 5, rrf_k: int = 10):
+    def __init__(
+        self,
+        retriever,
+        rewriter: QueryRewriter = QueryRewriter(),
+        top_k: int = 5,
+        rrf_k: int = 10,
+        speculative: bool = True,
+        rewrite_budget_ms: float | None = None,
+        name: str | None = None,
+    ):
         self.retriever = retriever
         self.rewriter = rewriter
         self.top_k = top_k
         self.rrf_k = rrf_k
+        self.speculative = speculative
+        self.rewrite_budget_ms = rewrite_budget_ms
+        # nome usado nos relatórios (ex.: FusionAgentPRF para distinguir o rewriter)
+        self.name = name or self.__class__.__name__
 
     def retrieve(self, query: str):
-        # generating queries from original query
-        queries = self.rewriter.rewrite(query)
-        # adiciona a query original
-        queries = [query] + queries
+        return self.retrieve_many([query])[0]
+
+    def retrieve_many(self, queries: list[str]):
+        """retrieve para várias queries, com as variações de todas em um único lote."""
+        match = getattr(self.retriever, "match", None)
+        exact = [match(query) if match is not None else None for query in queries]
+        rest = [query for query, e in zip(queries, exact) if e is None]
+        fused = iter(self._retrieve_many(rest) if rest else [])
+        return [e[: self.top_k] if e is not None else next(fused) for e in exact]
+
+    def _retrieve_many(self, queries: list[str]):
+        if not self.speculative:
+            # generating queries from original query (+ a query original)
+            groups = [[query] + self.rewriter.rewrite(query) for query in queries]
+            rankings = self.retriever.retrieve_many([q for group in groups for q in group])
+            return self._fuse_groups(groups, rankings)
+
+        pool = _fusion_pool()
+        # especulativo: originais e reescritas ao mesmo tempo
+        # ramos do coletor (timing.submit/join): a latência segue o caminho crítico,
+        # max(original, reescrita + lote das variações)
+        original = timing.submit(pool, self.retriever.retrieve_many, queries)
+        rewrites = [timing.submit(pool, self.rewriter.rewrite, query) for query in queries]
+        timeout = self.rewrite_budget_ms / 1000 if self.rewrite_budget_ms is not None else None
+        done, _ = wait(rewrites, timeout=timeout)
+        for f in done:
+            timing.join(f)
+
+        variations = [f.result() if f in done else None for f in rewrites]
+        # variações de todas as queries que chegaram no prazo, em um lote
+        pending = [q for v in variations if v is not None for q in v]
+        variant_rankings = iter(self.retriever.retrieve_many(pending) if pending else [])
+        original_rankings = original.result()
+        timing.join(original)
+
+        fused = []
+        for query, variation, ranking in zip(queries, variations, original_rankings):
+            if variation is None:
+                fused.append(self._fallback(ranking))
+                continue
+            rankings = [ranking] + [next(variant_rankings) for _ in variation]
+            fused.append(self._fuse(rankings))
+        return fused
+
+    def _fuse_groups(self, groups: list[list[str]], rankings: list):
+        fused = []
+        start = 0
+        for group in groups:
+            fused.append(self._fuse(rankings[start : start + len(group)]))
+            start += len(group)
+        return fused
+
+    def _fallback(self, ranking: list):
+        """Ranking da query original quando a reescrita perdeu o prazo."""
+        timing.mark_degraded("rewrite")
+        for item in ranking:
+            item.node.metadata = item.node.metadata or {}
+            item.node.metadata["degraded"] = True
+        return ranking[: self.top_k]
 
-        rankings = [self.retriever.retrieve(q) for q in queries]
+    def _fuse(self, rankings: list):
+        with timing.stage("rrf"):
+            return self._rrf(rankings)
 
+    def _rrf(self, rankings: list):
         scores = defaultdict(float)
         by_id = {}
         for rank_list in rankings:
@@ -0,0 +1,125 @@
+"""
+Benchmark dos engines do BM25Retriever (native x llama).
+
+Replica o corpus (1x, 10x, 100x, com chunk_ids sufixados) e, para cada escala,
+mede tempo de build, tamanho em disco, latência por query, vazão (queries/s)
+de retrieve e de retrieve_many (só native) e sobreposição do top-k entre os
+dois engines, usando as queries de bench/queries_judged.json.
+
+    cd src && python bench_bm25.py
+
+Os índices são construídos em diretórios temporários; nada em indexes/ é alterado.
+"""
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from llama_index.core.schema import TextNode
+
+from chunk_store import ChunkStore
+from retrievers.bm25 import BM25Retriever
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+CHUNKS_PATH = ROOT_DIR / "data" / "processed" / "chunks.jsonl"
+BENCH_PATH = ROOT_DIR / "bench" / "queries_judged.json"
+OUT_PATH = ROOT_DIR / "data" / "results" / "bm25_bench.json"
+
+TOP_K = 10
+SCALES = [1, 10, 100]
+# o engine llama fica lento demais acima disso
+LLAMA_MAX_SCALE = 10
+
+
+def replicate(nodes: list[TextNode], scale: int) -> list[TextNode]:
+    """scale cópias de cada nó; a cópia r > 0 ganha o sufixo __rN no node_id."""
+    if scale == 1:
+        return nodes
+    out = []
+    for r in range(scale):
+        for n in nodes:
+            node = TextNode(text=n.text, metadata=n.metadata)
+            node.node_id = n.node_id if r == 0 else f"{n.node_id}__r{r}"
+            node.excluded_embed_metadata_keys = n.excluded_embed_metadata_keys
+            out.append(node)
+    return out
+
+
+def dir_nbytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def bench_engine(engine: str, nodes: list[TextNode], queries: list[str], k: int) -> tuple[dict, list[list[str]]]:
+    with tempfile.TemporaryDirectory() as tmp:
+        persist_dir = Path(tmp)
+        retriever = BM25Retriever(nodes=nodes, persist_dir=persist_dir, top_k=k, engine=engine)
+        build_seconds = retriever.startup_seconds
+        disk_bytes = dir_nbytes(persist_dir)
+
+    # latência de uma query por vez (como no main.py)
+    latencies = []
+    found = []
+    for q in queries:
+        t0 = time.perf_counter()
+        results = retriever.retrieve(q)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found.append([r.node.node_id for r in results])
+    latencies = np.array(latencies)
+
+    result = {
+        "engine": engine,
+        "build_seconds": build_seconds,
+        "disk_bytes": disk_bytes,
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+        "qps": float(len(queries) / (latencies.sum() / 1000)),
+    }
+    if engine == "native":
+        t0 = time.perf_counter()
+        batch = retriever.retrieve_many(queries)
+        seconds = time.perf_counter() - t0
+        result["batch_qps"] = float(len(queries) / seconds)
+        result["batch_matches_single"] = [[r.node.node_id for r in rs] for rs in batch] == found
+    return result, found
+
+
+def overlap(a: list[list[str]], b: list[list[str]]) -> float:
+    return float(np.mean([len(set(x) & set(y)) / max(len(y), 1) for x, y in zip(a, b)]))
+
+
+def main():
+    with BENCH_PATH.open("r", encoding="utf-8") as f:
+        queries = [item["query"] for item in json.load(f)]
+    base = ChunkStore.load(CHUNKS_PATH).nodes("text_lex")
+
+    results = []
+    for scale in SCALES:
+        nodes = replicate(base, scale)
+        row = {"scale": scale, "n_docs": len(nodes), "engines": []}
+        native, native_found = bench_engine("native", nodes, queries, TOP_K)
+        row["engines"].append(native)
+        if scale <= LLAMA_MAX_SCALE:
+            llama, llama_found = bench_engine("llama", nodes, queries, TOP_K)
+            row["engines"].append(llama)
+            row[f"overlap@{TOP_K}"] = overlap(native_found, llama_found)
+        results.append(row)
+
+        for r in row["engines"]:
+            batch = f"  batch={r['batch_qps']:8.1f} q/s" if "batch_qps" in r else ""
+            print(
+                f"{scale:4d}x {len(nodes):7d} docs  {r['engine']:6s}  build={r['build_seconds'] * 1000:9.1f} ms  "
+                f"disco={r['disk_bytes'] / 2**20:7.2f} MiB  p50={r['latency_ms_p50']:7.3f} ms  "
+                f"p95={r['latency_ms_p95']:7.3f} ms  {r['qps']:8.1f} q/s{batch}"
+            )
+        if f"overlap@{TOP_K}" in row:
+            print(f"      overlap@{TOP_K} native x llama: {row[f'overlap@{TOP_K}']:.3f}")
+
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with OUT_PATH.open("w", encoding="utf-8") as f:
+        json.dump({"n_queries": len(queries), "top_k": TOP_K, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\nresultados em {OUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark dos tipos de índice FAISS do DenseRetriever.
+
+Para cada configuração mede tempo de build, memória (tamanho serializado),
+latência por query e perda de recall em relação ao índice exato, usando as
+queries de bench/queries_judged.json. Também reporta nDCG@k no gold.
+
+    cd src && python bench_faiss.py
+
+Requer o índice denso já persistido em indexes/dense (criado pelo main.py/judge.py);
+os embeddings das queries vêm do cache em indexes/cache/embeddings.sqlite.
+"""
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+from metrics import Qrels
+from nodes_from_chunks import load_nodes_from_chunks
+from retrievers.dense import DenseRetriever
+from retrievers.faiss_index import build_faiss_index, index_nbytes, reconstruct_all, set_search_params
+from utils.cache import DiskCache
+
+load_dotenv()
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+CHUNKS_PATH = ROOT_DIR / "data" / "processed" / "chunks.jsonl"
+BENCH_PATH = ROOT_DIR / "bench" / "queries_judged.json"
+OUT_PATH = ROOT_DIR / "data" / "results" / "faiss_bench.json"
+
+TOP_K = 10
+
+# (index_type, parâmetros de build, parâmetros de busca)
+CONFIGS = [
+    ("flat_l2", {}, {}),
+    ("flat_ip", {}, {}),
+    ("hnsw", {"hnsw_m": 32}, {"ef_search": 16}),
+    ("hnsw", {"hnsw_m": 32}, {"ef_search": 64}),
+    ("hnsw", {"hnsw_m": 32}, {"ef_search": 256}),
+    ("ivf_flat", {}, {"nprobe": 1}),
+    ("ivf_flat", {}, {"nprobe": 8}),
+    ("ivf_flat", {}, {"nprobe": 32}),
+    ("ivf_pq", {"pq_m": 16}, {"nprobe": 8}),
+    ("ivf_pq", {"pq_m": 16}, {"nprobe": 32}),
+]
+
+
+def bench_config(index_type, build_params, search_params, vectors, queries, exact_ids, node_ids, qrels, query_ids, k):
+    t0 = time.perf_counter()
+    index = build_faiss_index(index_type, vectors.shape[1], vectors, **build_params)
+    build_seconds = time.perf_counter() - t0
+    set_search_params(index, **search_params)
+
+    # latência de uma query por vez (como no retrieve)
+    latencies = []
+    found = []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, idx = index.search(q[np.newaxis, :], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found.append(idx[0])
+    latencies = np.array(latencies)
+
+    recall_vs_exact = np.mean(
+        [len(set(f[f >= 0]) & set(e)) / len(e) for f, e in zip(found, exact_ids)]
+    )
+    run = {qid: [node_ids[i] for i in f if i >= 0] for qid, f in zip(query_ids, found)}
+    ndcg = qrels.evaluate_batch({"run": run}, k=k, query_ids=query_ids)["ndcg"].mean()
+
+    return {
+        "index_type": index_type,
+        "build_params": build_params,
+        "search_params": search_params,
+        "build_seconds": build_seconds,
+        "memory_bytes": index_nbytes(index),
+        "latency_ms_mean": float(latencies.mean()),
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+        f"recall@{k}_vs_exact": float(recall_vs_exact),
+        f"ndcg@{k}": float(ndcg),
+    }
+
+
+def main():
+    with BENCH_PATH.open("r", encoding="utf-8") as f:
+        benchmark = json.load(f)
+    qrels = Qrels.from_benchmark(benchmark)
+    query_ids = [item["id"] for item in benchmark]
+
+    dense = DenseRetriever(
+        nodes=load_nodes_from_chunks(CHUNKS_PATH, text_field="text_raw"),
+        persist_dir=ROOT_DIR / "indexes" / "dense",
+        top_k=TOP_K,
+        cache=DiskCache(ROOT_DIR / "indexes" / "cache" / "embeddings.sqlite"),
+    )
+    vectors = np.ascontiguousarray(reconstruct_all(dense.faiss_index), dtype="float32")
+    node_ids = dense.node_ids
+    queries = np.array([dense.embed_query(item["query"]) for item in benchmark], dtype="float32")
+
+    # referência: busca exata no índice persistido
+    _, exact = dense.faiss_index.search(queries, TOP_K)
+
+    results = []
+    for index_type, build_params, search_params in CONFIGS:
+        r = bench_config(
+            index_type, build_params, search_params, vectors, queries, exact, node_ids, qrels, query_ids, TOP_K
+        )
+        results.append(r)
+        params = ", ".join(f"{k}={v}" for k, v in {**build_params, **search_params}.items()) or "-"
+        print(
+            f"{index_type:9s} {params:22s} build={r['build_seconds'] * 1000:8.1f} ms  "
+            f"mem={r['memory_bytes'] / 2**20:7.2f} MiB  p50={r['latency_ms_p50']:.3f} ms  "
+            f"p95={r['latency_ms_p95']:.3f} ms  recall@{TOP_K}={r[f'recall@{TOP_K}_vs_exact']:.3f}  "
+            f"ndcg@{TOP_K}={r[f'ndcg@{TOP_K}']:.3f}"
+        )
+
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with OUT_PATH.open("w", encoding="utf-8") as f:
+        json.dump(
+            {"n_vectors": int(vectors.shape[0]), "dim": int(vectors.shape[1]), "n_queries": len(queries), "results": results},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    print(f"\nresultados em {OUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Benchmark do RouterAgent: qualidade x latência x custo contra os pipelines fixos.
+
+Roda cada query de bench/queries_judged.json em três pipelines fixos (Standard
+sobre BM25, Standard sobre Hybrid, Fusion sobre Hybrid) e no RouterAgent, e
+compara nDCG/MRR/Recall, latência p50/p95 e custo por query (chamadas ao LLM e
+textos embeddados sem cache, ver router.ROUTE_COST). Também reporta:
+- oracle: o pipeline mais barato que atinge o melhor nDCG de cada query (teto do
+  roteamento);
+- uma varredura dos limiares do roteador, simulada a partir dos resultados dos
+  pipelines fixos (a rota de uma query só depende dos sinais do BM25).
+
+Grava data/results/router_bench.json.
+
+    cd src && python bench_router.py
+
+O memo de buscas é zerado antes de cada query: cada pipeline paga as suas buscas,
+e só dentro da mesma query o Hybrid reaproveita o BM25 que o roteador já rodou
+para os sinais (BM25 e Hybrid passam pelo mesmo RetrievalMemo). Com as reescritas
+e os embeddings das queries em cache (indexes/cache), a latência de Fusion e Hybrid
+mede a leitura do cache; o custo de API aparece nas colunas de chamadas.
+"""
+import itertools
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+from agents import FusionAgent, StandardAgent
+from chunk_store import ChunkStore
+from corpus_diff import ChunkDiff
+from metrics import Qrels
+from query_rewrite import QueryRewriter
+from retrievers.bm25 import BM25Retriever, bm25_fingerprint
+from retrievers.dense import DenseRetriever
+from retrievers.hybrid import Hybrid
+from retrievers.memo import RetrievalMemo
+from router import ROUTES, RouterAgent
+from utils.cache import DiskCache
+
+load_dotenv()
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+CHUNKS_PATH = ROOT_DIR / "data" / "processed" / "chunks.jsonl"
+DIFF_PATH = ROOT_DIR / "data" / "processed" / "chunks_diff.json"
+BENCH_PATH = ROOT_DIR / "bench" / "queries_judged.json"
+CACHE_DIR = ROOT_DIR / "indexes" / "cache"
+OUT_PATH = ROOT_DIR / "data" / "results" / "router_bench.json"
+
+# métricas em cada cutoff; o roteamento é avaliado pelo nDCG no cutoff principal
+CUTOFFS = [5, 10]
+REPORT_K = 5
+TOP_K = max(CUTOFFS)
+# limiares varridos (min_margin x fusion_overlap); inf = nunca manda ao BM25 sem código
+SWEEP_MIN_MARGIN = [0.05, 0.10, 0.20, float("inf")]
+SWEEP_FUSION_OVERLAP = [0.0, 0.6, 0.8, 1.01]
+
+
+def run_pipeline(
+    agent, benchmark: list[dict], memo: RetrievalMemo | None = None
+) -> tuple[dict[str, list[str]], list[float]]:
+    # aquecimento (carga preguiçosa de índices e caches)
+    agent.retrieve(benchmark[0]["query"])
+    if isinstance(agent, RouterAgent):
+        # a query do aquecimento não entra na contagem de rotas
+        agent.reset_routes()
+    ranked, latencies = {}, []
+    for item in benchmark:
+        if memo is not None:
+            # reaproveitamento só dentro da query (ex.: BM25 do roteador no Hybrid)
+            memo.clear()
+        t0 = time.perf_counter()
+        results = agent.retrieve(item["query"])
+        latencies.append((time.perf_counter() - t0) * 1000)
+        ranked[item["id"]] = [r.node.node_id for r in results]
+    return ranked, latencies
+
+
+def summarize(name: str, qrels: Qrels, ranked: dict, latencies: list[float], costs: list[dict]) -> dict:
+    row = {"pipeline": name}
+    for k in CUTOFFS:
+        row[f"ndcg@{k}"] = float(np.mean([qrels.ndcg(qid, ids, k) for qid, ids in ranked.items()]))
+        row[f"mrr@{k}"] = float(np.mean([qrels.mrr(qid, ids, k) for qid, ids in ranked.items()]))
+        row[f"recall@{k}"] = float(np.mean([qrels.recall(qid, ids, k) for qid, ids in ranked.items()]))
+    row["latency_ms_p50"] = float(np.percentile(latencies, 50))
+    row["latency_ms_p95"] = float(np.percentile(latencies, 95))
+    row["llm_calls"] = float(np.mean([c["llm_calls"] for c in costs]))
+    row["embedded_queries"] = float(np.mean([c["embedded_queries"] for c in costs]))
+    return row
+
+
+def simulate(router: RouterAgent, features: dict, fixed: dict, bm25_ms: dict, qrels: Qrels, benchmark: list[dict]) -> dict:
+    """Roteador com os limiares atuais, montado dos resultados dos pipelines fixos."""
+    ranked, latencies, costs = {}, [], []
+    for i, item in enumerate(benchmark):
+        qid = item["id"]
+        route = router.route(features[qid])
+        ranked[qid] = fixed[route][0][qid]
+        # o BM25 dos sinais roda sempre; nas outras rotas soma o pipeline escolhido
+        # (limite superior: no roteador de verdade o Hybrid pega esse BM25 do memo)
+        latencies.append(bm25_ms[qid] + (fixed[route][1][i] if route != "bm25" else 0.0))
+        costs.append(router.cost(route))
+    row = summarize("router", qrels, ranked, latencies, costs)
+    row["routes"] = {route: sum(router.route(features[item["id"]]) == route for item in benchmark) for route in ROUTES}
+    return row
+
+
+def main():
+    with BENCH_PATH.open("r", encoding="utf-8") as f:
+        benchmark = json.load(f)
+    qrels = Qrels.from_benchmark(benchmark)
+    store = ChunkStore.load(CHUNKS_PATH)
+    chunks_diff = ChunkDiff.load(DIFF_PATH)
+
+    bm25 = BM25Retriever(
+        nodes=store.nodes("text_lex"),
+        persist_dir=ROOT_DIR / "indexes" / "bm25",
+        top_k=TOP_K,
+        cache_key=bm25_fingerprint(CHUNKS_PATH, text_field="text_lex"),
+        diff=chunks_diff,
+    )
+    dense = DenseRetriever(
+        nodes=store.nodes("text_raw"),
+        persist_dir=ROOT_DIR / "indexes" / "dense",
+        top_k=TOP_K,
+        cache=DiskCache(CACHE_DIR / "embeddings.sqlite"),
+        use_mmap=True,
+        diff=chunks_diff,
+    )
+    # o roteador roda o BM25 para os sinais; o memo evita que o Hybrid o rode de novo
+    memo = RetrievalMemo()
+    bm25 = memo.wrap(bm25)
+    hybrid = Hybrid(retrievers=[bm25, dense], top_k=TOP_K)
+    # mesmas reescritas fixadas do main.py
+    rewriter = QueryRewriter(n=3, cache=DiskCache(CACHE_DIR / "rewrites.sqlite"), pin=True)
+    router = RouterAgent(bm25=bm25, hybrid=hybrid, rewriter=rewriter, top_k=TOP_K)
+    thresholds = {
+        "min_margin": router.min_margin,
+        "min_overlap": router.min_overlap,
+        "fusion_overlap": router.fusion_overlap,
+        "short_terms": router.short_terms,
+    }
+
+    # pipelines fixos: as rotas do roteador, sempre ligadas
+    fixed = {
+        "bm25": run_pipeline(StandardAgent(retriever=bm25, top_k=TOP_K), benchmark, memo),
+        "hybrid": run_pipeline(StandardAgent(retriever=hybrid, top_k=TOP_K), benchmark, memo),
+        "fusion": run_pipeline(FusionAgent(retriever=hybrid, rewriter=rewriter, top_k=TOP_K), benchmark, memo),
+    }
+    results = [
+        summarize(route, qrels, ranked, latencies, [router.cost(route)] * len(benchmark))
+        for route, (ranked, latencies) in fixed.items()
+    ]
+
+    # roteador de verdade, com os limiares padrão
+    ranked, latencies = run_pipeline(router, benchmark, memo)
+    # contagem da passada medida (run_pipeline zera depois do aquecimento)
+    routes = dict(router.routes)
+    # sinais por query, sem route_query (que contaria as rotas de novo)
+    features, per_query = {}, []
+    for item in benchmark:
+        feats = router.features(item["query"], bm25.retrieve(item["query"]))
+        features[item["id"]] = feats
+        per_query.append({"query_id": item["id"], "route": router.route(feats), **feats})
+    row = summarize("router", qrels, ranked, latencies, [router.cost(q["route"]) for q in per_query])
+    row["routes"] = routes
+    results.append(row)
+
+    # oracle: rota mais barata com o melhor nDCG da query
+    oracle_routes = {}
+    for i, item in enumerate(benchmark):
+        ndcgs = [qrels.ndcg(item["id"], fixed[route][0][item["id"]], REPORT_K) for route in ROUTES]
+        oracle_routes[item["id"]] = ROUTES[int(np.argmax(ndcgs))]
+    oracle = summarize(
+        "oracle",
+        qrels,
+        {qid: fixed[route][0][qid] for qid, route in oracle_routes.items()},
+        [fixed[oracle_routes[item["id"]]][1][i] for i, item in enumerate(benchmark)],
+        [router.cost(route) for route in oracle_routes.values()],
+    )
+    oracle["routes"] = {route: list(oracle_routes.values()).count(route) for route in ROUTES}
+    results.append(oracle)
+
+    for r in results:
+        routes = "  " + " ".join(f"{k}={v}" for k, v in r["routes"].items()) if "routes" in r else ""
+        print(
+            f"{r['pipeline']:7s} ndcg@{REPORT_K}={r[f'ndcg@{REPORT_K}']:.3f}  mrr@{REPORT_K}={r[f'mrr@{REPORT_K}']:.3f}  "
+            f"recall@{TOP_K}={r[f'recall@{TOP_K}']:.3f}  p50={r['latency_ms_p50']:8.2f} ms  p95={r['latency_ms_p95']:8.2f} ms  "
+            f"llm={r['llm_calls']:.2f}  emb={r['embedded_queries']:.2f}{routes}"
+        )
+
+    # varredura dos limiares (sem rodar de novo: cada rota já tem o resultado nos fixos)
+    bm25_ms = {item["id"]: fixed["bm25"][1][i] for i, item in enumerate(benchmark)}
+    sweep = []
+    print()
+    for min_margin, fusion_overlap in itertools.product(SWEEP_MIN_MARGIN, SWEEP_FUSION_OVERLAP):
+        router.min_margin, router.fusion_overlap = min_margin, fusion_overlap
+        r = simulate(router, features, fixed, bm25_ms, qrels, benchmark)
+        r["min_margin"], r["fusion_overlap"] = min_margin, fusion_overlap
+        sweep.append(r)
+        print(
+            f"min_margin={min_margin:<5} fusion_overlap={fusion_overlap:<5} ndcg@{REPORT_K}={r[f'ndcg@{REPORT_K}']:.3f}  "
+            f"p95={r['latency_ms_p95']:8.2f} ms  llm={r['llm_calls']:.2f}  emb={r['embedded_queries']:.2f}  "
+            + " ".join(f"{k}={v}" for k, v in r["routes"].items())
+        )
+
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "n_queries": len(benchmark),
+        "top_k": TOP_K,
+        "report_k": REPORT_K,
+        "thresholds": thresholds,
+        "results": results,
+        "per_query": per_query,
+        "sweep": sweep,
+    }
+    with OUT_PATH.open("w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2, default=str)
+    print(f"\nresultados em {OUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Benchmark de escala (vazão e custo) de BM25, Dense e Hybrid em corpus sintético.
+
+O corpus cresce a partir de data/processed/chunks.jsonl: os chunks originais entram
+como estão e o resto são cópias perturbadas do text_lex (tokens removidos e tokens
+do vocabulário inseridos, com semente fixa). O embedder da OpenAI é trocado por
+HashEmbedding (feature hashing dos tokens, local e determinístico), então o
+benchmark não chama nenhuma API e mede só o custo dos índices.
+
+Para cada tamanho mede, por retriever: tempo de build, memória do índice (bytes
+das estruturas, tamanho em disco e quanto o RSS do processo cresceu durante o build),
+latência de uma query por vez (p50/p95/p99) e vazão de retrieve_many em lote
+(queries/s). A matriz do Dense é aberta com mmap, então as páginas dela só entram
+no RSS quando as buscas as tocam. O pico de RSS do processo (acumulado desde o
+início, então inclui os tamanhos anteriores) vai uma vez por tamanho, em
+process_rss_peak_mb. Grava
+data/results/scale_bench.json com a revisão do git, para comparar versões.
+
+    cd src && python bench_scale.py                 # 10k, 100k e 1M chunks
+    cd src && python bench_scale.py 10000 100000    # tamanhos escolhidos
+
+O 1M precisa de alguns GB de RAM (nós da llama-index + matriz de embeddings).
+"""
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import TextNode
+from pydantic import PrivateAttr
+
+from chunk_store import ChunkStore
+from retrievers.bm25 import BM25Retriever
+from retrievers.dense import DenseRetriever
+from retrievers.embedding_matrix import EmbeddingMatrix, nodes_fingerprint
+from retrievers.hybrid import Hybrid
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+CHUNKS_PATH = ROOT_DIR / "data" / "processed" / "chunks.jsonl"
+BENCH_PATH = ROOT_DIR / "bench" / "queries_judged.json"
+OUT_PATH = ROOT_DIR / "data" / "results" / "scale_bench.json"
+
+SCALES = [10_000, 100_000, 1_000_000]
+TOP_K = 10
+# queries por chamada de retrieve_many (as do benchmark, repetidas)
+BATCH_SIZE = 64
+# dimensão do HashEmbedding (1M x 128 float32 = 512 MB)
+EMBED_DIM = 128
+# perturbação das cópias: fração de tokens removidos e de tokens inseridos
+DROP_RATE = 0.1
+INSERT_RATE = 0.1
+SEED = 13
+
+
+class HashEmbedding(BaseEmbedding):
+    """
+    Embedder local determinístico: contagem dos tokens (lowercase, separados por
+    espaço) em dim buckets via crc32, normalizada. Mesma interface do OpenAIEmbedding.
+    """
+
+    dim: int = EMBED_DIM
+    _buckets: dict = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashEmbedding"
+
+    def embed_array(self, texts: list[str]) -> np.ndarray:
+        """Matriz (len(texts), dim) float32 de uma vez, sem passar pela llama-index."""
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        buckets = self._buckets
+        for i, text in enumerate(texts):
+            tokens = text.lower().split()
+            for t in tokens:
+                if t not in buckets:
+                    buckets[t] = zlib.crc32(t.encode("utf-8")) % self.dim
+            out[i] = np.bincount([buckets[t] for t in tokens], minlength=self.dim)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        # texto vazio vira vetor nulo (score 0 com qualquer query)
+        return out / np.where(norms == 0, 1.0, norms)
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self.embed_array([query])[0].tolist()
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self.embed_array([text])[0].tolist()
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_array(texts).tolist()
+
+
+def synthetic_nodes(store: ChunkStore, n: int, seed: int = SEED) -> list[TextNode]:
+    """
+    n nós: os chunks originais (text_lex) e, depois deles, cópias perturbadas em ciclo.
+    A cópia i de um chunk tem node_id <chunk_id>__s<i>.
+    """
+    rng = np.random.default_rng(seed)
+    docs = [text.split() for text in store.text_lex]
+    vocab = np.array(sorted({t for tokens in docs for t in tokens}))
+    nodes = []
+    for i in range(n):
+        j = i % len(store)
+        tokens = docs[j]
+        if i >= len(store):
+            kept = [t for t, keep in zip(tokens, rng.random(len(tokens)) >= DROP_RATE) if keep]
+            extra = vocab[rng.integers(0, len(vocab), size=int(len(tokens) * INSERT_RATE))].tolist()
+            tokens = kept + extra
+        node = TextNode(text=" ".join(tokens))
+        node.node_id = store.ids[j] if i < len(store) else f"{store.ids[j]}__s{i}"
+        nodes.append(node)
+    return nodes
+
+
+def rss_mb() -> float | None:
+    """RSS atual do processo (MiB), de /proc/self/statm; None fora do Linux."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return resident_pages * resource.getpagesize() / 2**20
+
+
+def rss_delta_mb(before: float | None) -> float | None:
+    after = rss_mb()
+    return None if before is None or after is None else after - before
+
+
+def process_rss_peak_mb() -> float:
+    # ru_maxrss: KiB no Linux, bytes no macOS; é do processo todo e só cresce
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def dir_nbytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def git_revision() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_queries(retriever, queries: list[str], batch_size: int) -> dict:
+    # aquecimento (caches de stems, páginas do mmap)
+    retriever.retrieve(queries[0])
+
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        retriever.retrieve(q)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    batch = (queries * (batch_size // len(queries) + 1))[:batch_size]
+    t0 = time.perf_counter()
+    retriever.retrieve_many(batch)
+    batch_seconds = time.perf_counter() - t0
+
+    return {
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+        "latency_ms_p99": float(np.percentile(latencies, 99)),
+        "single_qps": float(len(latencies) / (sum(latencies) / 1000)),
+        "batch_size": len(batch),
+        "batch_qps": float(len(batch) / batch_seconds),
+    }
+
+
+def bench_scale(store: ChunkStore, n: int, queries: list[str], work_dir: Path) -> dict:
+    t0 = time.perf_counter()
+    nodes = synthetic_nodes(store, n)
+    corpus_seconds = time.perf_counter() - t0
+    row = {"n_chunks": n, "corpus_seconds": corpus_seconds, "retrievers": {}}
+
+    # BM25 (engine native, sem cache: sempre constrói)
+    bm25_dir = work_dir / "bm25"
+    rss_before = rss_mb()
+    bm25 = BM25Retriever(nodes=nodes, persist_dir=bm25_dir, top_k=TOP_K)
+    bm25_rss = rss_delta_mb(rss_before)
+    index = bm25._index
+    row["retrievers"]["bm25"] = {
+        "build_seconds": bm25.startup_seconds,
+        "index_bytes": int(
+            sum(a.nbytes for a in (index.doc_indptr, index.doc_terms, index.doc_tf, index.term_indptr, index.post_docs, index.post_weights))
+        ),
+        "disk_bytes": dir_nbytes(bm25_dir),
+        "rss_build_delta_mb": bm25_rss,
+        **measure_queries(bm25, queries, BATCH_SIZE),
+    }
+
+    # Dense: embeddings do corpus em lote, gravados como a EmbeddingMatrix que o DenseRetriever abre
+    dense_dir = work_dir / "dense"
+    embed_model = HashEmbedding()
+    model_name = f"hash-{EMBED_DIM}"
+    rss_before = rss_mb()
+    t0 = time.perf_counter()
+    vectors = embed_model.embed_array([node.text for node in nodes])
+    meta = {"model": model_name, "dimensions": None, "corpus": nodes_fingerprint(nodes)}
+    EmbeddingMatrix.save(dense_dir / "matrix_float32", vectors, [node.node_id for node in nodes], meta)
+    del vectors
+    embed_seconds = time.perf_counter() - t0
+    dense = DenseRetriever(
+        nodes=nodes,
+        persist_dir=dense_dir,
+        top_k=TOP_K,
+        embedding_model=model_name,
+        use_mmap=True,
+        embed_model=embed_model,
+    )
+    dense_rss = rss_delta_mb(rss_before)
+    row["retrievers"]["dense"] = {
+        "build_seconds": embed_seconds + dense.startup_seconds,
+        "embed_seconds": embed_seconds,
+        "index_bytes": int(dense._matrix.vectors.nbytes),
+        "disk_bytes": dir_nbytes(dense_dir),
+        "rss_build_delta_mb": dense_rss,
+        **measure_queries(dense, queries, BATCH_SIZE),
+    }
+
+    # Hybrid: RRF dos dois acima (nada a construir)
+    hybrid = Hybrid(retrievers=[bm25, dense], top_k=TOP_K)
+    row["retrievers"]["hybrid"] = measure_queries(hybrid, queries, BATCH_SIZE)
+    row["process_rss_peak_mb"] = process_rss_peak_mb()
+    return row
+
+
+def main(scales: list[int]):
+    with BENCH_PATH.open("r", encoding="utf-8") as f:
+        queries = [item["query"] for item in json.load(f)]
+    store = ChunkStore.load(CHUNKS_PATH)
+
+    results = []
+    for n in scales:
+        with tempfile.TemporaryDirectory() as tmp:
+            row = bench_scale(store, n, queries, Path(tmp))
+        results.append(row)
+        for name, r in row["retrievers"].items():
+            build = f"build={r['build_seconds']:8.2f} s  mem={r['index_bytes'] / 2**20:8.1f} MiB  " if "build_seconds" in r else " " * 38
+            rss = r.get("rss_build_delta_mb")
+            print(
+                f"{n:9d} {name:6s}  {build}p50={r['latency_ms_p50']:8.3f} ms  p95={r['latency_ms_p95']:8.3f} ms  "
+                f"p99={r['latency_ms_p99']:8.3f} ms  lote={r['batch_qps']:9.1f} q/s"
+                + (f"  rss do build={rss:+7.0f} MiB" if rss is not None else "")
+            )
+        print(f"{n:9d} pico de RSS do processo: {row['process_rss_peak_mb']:.0f} MiB")
+
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "git_revision": git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "platform": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine()},
+        "config": {
+            "top_k": TOP_K,
+            "batch_size": BATCH_SIZE,
+            "embed_dim": EMBED_DIM,
+            "drop_rate": DROP_RATE,
+            "insert_rate": INSERT_RATE,
+            "seed": SEED,
+            "n_queries": len(queries),
+        },
+        "results": results,
+    }
+    with OUT_PATH.open("w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    print(f"\nresultados em {OUT_PATH}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or SCALES)
@@ -1,26 +1,70 @@
 
+import hashlib
 import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import unicodedata
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.node_parser import SentenceSplitter
 import json
 from nltk.corpus import stopwords
+from chunk_store import ChunkStore
+from corpus_diff import diff_stores
+from code_index import CodeIndex
+from utils.cache import sha256_file
 
 # definindo os paths
 data_dir = Path(__file__).parent.parent / "data"
 
+# processos que normalizam o texto (None = um por CPU)
+MAX_WORKERS = None
+# textos enviados por vez a cada processo
+CHUNKSIZE = 64
+# caracteres do sha256 do text_raw usados no chunk_id
+CHUNK_HASH_CHARS = 12
+
 # preparando o conjunto de stopwords
 with data_dir.joinpath("stopwords.json").open("r", encoding="utf-8") as f:
     sw_payload = json.load(f)
 stop_set = set(sw_payload.get("stopwords", []))
 
+# regexes compiladas uma vez por processo
+HYPHEN_RE = re.compile(r"(\w)-\s*\n\s*(\w)")
+SPECIAL_RE = re.compile(r"[^a-z0-9\s]+")
+SPACES_RE = re.compile(r"\s+")
+BNCC_CODE_RE = re.compile(r"\b(e[mif])\s*(\d{1,2})\s*([a-z]{1,4})\s*(\d{1,4})\b")
+SAFE_ID_RE = re.compile(r"[^a-z0-9]+")
+UNDERSCORES_RE = re.compile(r"_+")
+
+
+class _StripCombining(dict):
+    """Tabela para str.translate que remove marcas combinantes (acentos após NFKD), com cache por caractere."""
+
+    def __missing__(self, codepoint: int):
+        value = None if unicodedata.combining(chr(codepoint)) else codepoint
+        self[codepoint] = value
+        return value
+
+
+STRIP_COMBINING = _StripCombining()
+
 
 # faz com que os ids fiquem com nomes seguros
 def make_safe_id(s: str) -> str:
     s = s.strip().lower()
-    s = re.sub(r"[^a-z0-9]+", "_", s)
-    return re.sub(r"_+", "_", s).strip("_")
+    s = SAFE_ID_RE.sub("_", s)
+    return UNDERSCORES_RE.sub("_", s).strip("_")
+
+# id estável: arquivo + página + hash do texto (não depende da posição do chunk no corpus)
+def make_chunk_id(file_name: str, page: str, text: str, seen: dict[str, int]) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:CHUNK_HASH_CHARS]
+    base = f"{make_safe_id(file_name)}__p{make_safe_id(str(page))}__h{digest}"
+    # mesmo texto repetido na mesma página ganha sufixo pela ordem de ocorrência
+    n = seen.get(base, 0)
+    seen[base] = n + 1
+    return base if n == 0 else f"{base}_{n + 1}"
 
 # função pra salvar os jsonl, tanto chunks quanto pages
 def write_jsonl(path: Path, rows):
@@ -32,23 +76,23 @@ def write_jsonl(path: Path, rows):
 # limpando o texto para abordagem lexical
 def clean_text(text: str) -> str:
     # desfaz hifenização no fim de linha
-    text = re.sub(r"(\w)-\s*\n\s*(\w)", r"\1\2", text)
+    text = HYPHEN_RE.sub(r"\1\2", text)
     # quebra de linha vira espaço
     text = text.replace("\n", " ")
     # lowercase
     text = text.lower()
     # remove acentos
     text = unicodedata.normalize("NFKD", text)
-    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.translate(STRIP_COMBINING)
 
     # remove caracteres especiais (mantém a-z, 0-9 e espaço)
-    text = re.sub(r"[^a-z0-9\s]+", " ", text)
+    text = SPECIAL_RE.sub(" ", text)
     # normaliza espaços
-    text = re.sub(r"\s+", " ", text).strip()
+    text = SPACES_RE.sub(" ", text).strip()
     # removing stopwords
     text = remove_stopwords(text)
     # juntando códigos da BNCC
-    text = re.sub(r"\b(e[mif])\s*(\d{1,2})\s*([a-z]{1,4})\s*(\d{1,4})\b", r"\1\2\3\4", text)
+    text = BNCC_CODE_RE.sub(r"\1\2\3\4", text)
 
     return text
 
@@ -62,35 +106,32 @@ def remove_stopwords(text: str) -> str:
     text = " ".join(tokens)
     return text
 
+
+class StageTimer:
+    """Acumula o tempo de cada etapa do build (somado entre os arquivos)."""
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+        self._t0 = time.perf_counter()
+
+    def add(self, stage: str, t0: float):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - t0
+
+    def report(self) -> str:
+        total = time.perf_counter() - self._t0
+        parts = [f"{stage}={s:.2f}s" for stage, s in self.seconds.items()]
+        return " | ".join(parts + [f"total={total:.2f}s"])
+
+
 if __name__ == "__main__":
-    
-    
 
-    # load bnc pdf -> Documents
+
+
+    # load bnc pdf -> Documents (um arquivo por vez, sem manter o corpus inteiro em memória)
     loader = SimpleDirectoryReader(
         input_dir = data_dir / "raw",
         required_exts = [".pdf"]
     )
-    documents = loader.load_data()
-
-    # saving raw raw docs - (raw and lexical version)
-    pages = []
-    for i, d in enumerate(documents):
-        raw = (d.get_content() or "").strip()
-        lex = clean_text(raw)
-        lex = remove_stopwords(lex)
-
-        pages.append(
-            {
-                "doc_id": i,
-                "text_raw": raw,
-                "text_lex": lex,
-                "metadata": dict(d.metadata or {}),
-            }
-        )
-
-    # salvando no jsonl as pages
-    write_jsonl(path=data_dir / "processed" / "pages.jsonl", rows=pages)
 
     # splitando, agora ao invés de páginas vão ser em chunks
     # criando o splitter
@@ -101,29 +142,94 @@ if __name__ == "__main__":
         chunk_overlap = 100,
     )
 
-    # nodes são partes identificaveis dos chunks
-    nodes = splitter.get_nodes_from_documents(documents=documents)
-
-    chunks = []
-    for i, n in enumerate(nodes):
-        meta = dict(n.metadata or {})
-        file_name = meta.get("file_name") or "unknown_file"
-        page = meta.get("page_label") or "na"
-        # vamos colocar um id rastreavel
-        chunk_id = f"{make_safe_id(file_name)}__p{make_safe_id(str(page))}__c{i:05d}"
-
-        raw = (n.get_content() or "").strip()
-        lex = clean_text(raw)
-        lex = remove_stopwords(lex)
-    
-        chunks.append(
-            {
-                "chunk_id": chunk_id,
-                "text_raw": raw,
-                "text_lex": lex,
-                "metadata": meta,
-            }
-        )
-    write_jsonl(data_dir / "processed" / "chunks.jsonl", rows=chunks)
-
-
+    pages_path = data_dir / "processed" / "pages.jsonl"
+    chunks_path = data_dir / "processed" / "chunks.jsonl"
+    diff_path = data_dir / "processed" / "chunks_diff.json"
+    pages_path.parent.mkdir(parents=True, exist_ok=True)
+    # grava em .tmp e troca no fim: um build interrompido não deixa jsonl pela metade
+    pages_tmp = pages_path.with_suffix(".jsonl.tmp")
+    chunks_tmp = chunks_path.with_suffix(".jsonl.tmp")
+
+    timer = StageTimer()
+    n_pages = 0
+    n_chunks = 0
+    seen_ids: dict[str, int] = {}
+    with (
+        ProcessPoolExecutor(max_workers=MAX_WORKERS) as pool,
+        pages_tmp.open("w", encoding="utf-8") as pages_f,
+        chunks_tmp.open("w", encoding="utf-8") as chunks_f,
+    ):
+        documents_iter = loader.iter_data()
+        while True:
+            t0 = time.perf_counter()
+            documents = next(documents_iter, None)
+            timer.add("load", t0)
+            if documents is None:
+                break
+
+            # saving raw raw docs - (raw and lexical version)
+            t0 = time.perf_counter()
+            raws = [(d.get_content() or "").strip() for d in documents]
+            lexes = list(pool.map(clean_text, raws, chunksize=CHUNKSIZE))
+            timer.add("clean_pages", t0)
+
+            t0 = time.perf_counter()
+            for d, raw, lex in zip(documents, raws, lexes):
+                page = {
+                    "doc_id": n_pages,
+                    "text_raw": raw,
+                    "text_lex": lex,
+                    "metadata": dict(d.metadata or {}),
+                }
+                pages_f.write(json.dumps(page, ensure_ascii=False) + "\n")
+                n_pages += 1
+            timer.add("write", t0)
+
+            # nodes são partes identificaveis dos chunks
+            t0 = time.perf_counter()
+            nodes = splitter.get_nodes_from_documents(documents=documents)
+            timer.add("split", t0)
+
+            t0 = time.perf_counter()
+            raws = [(n.get_content() or "").strip() for n in nodes]
+            lexes = list(pool.map(clean_text, raws, chunksize=CHUNKSIZE))
+            timer.add("clean_chunks", t0)
+
+            t0 = time.perf_counter()
+            for n, raw, lex in zip(nodes, raws, lexes):
+                meta = dict(n.metadata or {})
+                file_name = meta.get("file_name") or "unknown_file"
+                page = meta.get("page_label") or "na"
+                # vamos colocar um id rastreavel e estável entre builds
+                chunk_id = make_chunk_id(file_name, page, raw, seen_ids)
+
+                chunk = {
+                    "chunk_id": chunk_id,
+                    "text_raw": raw,
+                    "text_lex": lex,
+                    "metadata": meta,
+                }
+                chunks_f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                n_chunks += 1
+            timer.add("write", t0)
+
+    # diff com o chunks.jsonl anterior: os retrievers aplicam só as mudanças
+    t0 = time.perf_counter()
+    if chunks_path.exists():
+        diff = diff_stores(ChunkStore.load(chunks_path), ChunkStore.load(chunks_tmp))
+        diff.save(diff_path)
+        print(f"[build_corpus] diff com o corpus anterior: {diff.summary()}", file=sys.stderr)
+    else:
+        diff_path.unlink(missing_ok=True)
+    timer.add("diff", t0)
+
+    pages_tmp.replace(pages_path)
+    chunks_tmp.replace(chunks_path)
+
+    # índice código da BNCC -> chunks (caminho rápido das queries que citam um código)
+    t0 = time.perf_counter()
+    codes = CodeIndex.build(ChunkStore.load(chunks_path), corpus=sha256_file(chunks_path))
+    codes.save(data_dir / "processed" / "codes.json")
+    timer.add("codes", t0)
+    print(f"[build_corpus] {len(codes)} códigos da BNCC indexados", file=sys.stderr)
+    print(f"[build_corpus] {n_pages} páginas, {n_chunks} chunks | {timer.report()}", file=sys.stderr)
@@ -0,0 +1,120 @@
+import json
+from collections.abc import Mapping
+from pathlib import Path
+
+from llama_index.core.schema import TextNode
+
+TEXT_FIELDS = ("text_raw", "text_lex", "text_exp")
+
+
+class ChunkStore:
+    """
+    Chunks de data/processed/chunks.jsonl lidos uma única vez, em colunas paralelas
+    (ids, text_raw, text_lex, metadata): a linha i de cada coluna é o chunk i.
+
+    O texto de cada campo é guardado uma vez só; os TextNode e as visões por campo
+    apontam para as mesmas strings, em vez de copiá-las para o metadata.
+
+    text_exp (opcional, ver attach_expansions) é o text_lex seguido das queries e
+    palavras-chave geradas por expand_corpus.py para o chunk.
+    """
+
+    __slots__ = ("ids", "text_raw", "text_lex", "metadata", "text_exp", "_index")
+
+    def __init__(self, ids: list[str], text_raw: list[str], text_lex: list[str], metadata: list[dict]):
+        self.ids = ids
+        self.text_raw = text_raw
+        self.text_lex = text_lex
+        self.metadata = metadata
+        self.text_exp: list[str] | None = None
+        self._index = {cid: i for i, cid in enumerate(ids)}
+
+    @classmethod
+    def load(cls, path: Path) -> "ChunkStore":
+        ids, text_raw, text_lex, metadata = [], [], [], []
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                cid = chunk.get("chunk_id")
+                if not cid:
+                    continue
+                ids.append(cid)
+                text_raw.append(chunk.get("text_raw") or chunk.get("text") or "")
+                text_lex.append(chunk.get("text_lex") or "")
+                metadata.append(chunk.get("metadata") or {})
+        return cls(ids, text_raw, text_lex, metadata)
+
+    def attach_expansions(self, path: Path) -> int:
+        """
+        Monta a coluna text_exp a partir de data/processed/expansions.jsonl (campo text_lex
+        de cada linha, já limpo). Chunks sem expansão ficam só com o text_lex.
+        Retorna quantos chunks foram expandidos.
+        """
+        extra: dict[str, str] = {}
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    row = json.loads(line)
+                    extra[row["chunk_id"]] = row.get("text_lex") or ""
+        self.text_exp = [f"{lex} {extra[cid]}" if extra.get(cid) else lex for cid, lex in zip(self.ids, self.text_lex)]
+        return sum(1 for cid in self.ids if extra.get(cid))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._index
+
+    def index_of(self, chunk_id: str) -> int | None:
+        return self._index.get(chunk_id)
+
+    def column(self, text_field: str) -> list[str]:
+        if text_field not in TEXT_FIELDS:
+            raise ValueError(f"text_field inválido: {text_field!r} (use um de {TEXT_FIELDS})")
+        column = getattr(self, text_field)
+        if column is None:
+            raise ValueError(f"{text_field} não foi carregado (ver ChunkStore.attach_expansions)")
+        return column
+
+    def texts(self, text_field: str = "text_raw") -> "TextView":
+        """Visão chunk_id -> texto do campo, sem copiar nada."""
+        return TextView(self, self.column(text_field))
+
+    def nodes(self, text_field: str = "text_raw") -> list[TextNode]:
+        """
+        Um TextNode por chunk (node_id = chunk_id) com o texto do campo pedido.
+        O metadata traz só os metadados do PDF, todos excluídos do embedding.
+        """
+        nodes: list[TextNode] = []
+        for cid, text, meta in zip(self.ids, self.column(text_field), self.metadata):
+            node = TextNode(text=text, metadata=meta)
+            node.node_id = cid
+            node.excluded_embed_metadata_keys = list(meta.keys())
+            nodes.append(node)
+        return nodes
+
+
+class TextView(Mapping):
+    """Mapping somente leitura chunk_id -> texto de um campo do ChunkStore."""
+
+    __slots__ = ("_store", "_column")
+
+    def __init__(self, store: ChunkStore, column: list[str]):
+        self._store = store
+        self._column = column
+
+    def __getitem__(self, chunk_id: str) -> str:
+        i = self._store.index_of(chunk_id)
+        if i is None:
+            raise KeyError(chunk_id)
+        return self._column[i]
+
+    def __iter__(self):
+        return iter(self._store.ids)
+
+    def __len__(self) -> int:
+        return len(self._store)
@@ -0,0 +1,118 @@
+"""
+Índice código da BNCC -> chunks (ex.: EM13MAT303, EF01MA01, EI03EO01).
+
+Montado a partir do ChunkStore no build_corpus.py e gravado em
+data/processed/codes.json. Para cada código guarda:
+- defines: chunks que trazem a definição, "(EM13MAT303) Interpretar ...", do
+  chunk em que ela aparece mais cedo para o mais tarde (o último geralmente só a
+  pega no overlap);
+- mentions: os demais chunks em que o código aparece (listas, tabelas).
+
+Na consulta, codes_in(query) acha os códigos com qualquer espaçamento ou caixa
+("EM 13 MAT 303", "em13mat303", "EM13-MAT-303").
+
+    cd src && python code_index.py EM13MAT303    # chunks de um código
+"""
+import re
+import sys
+import unicodedata
+from pathlib import Path
+
+from chunk_store import ChunkStore
+from utils.cache import read_manifest, sha256_file, write_manifest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+CHUNKS_PATH = ROOT_DIR / "data" / "processed" / "chunks.jsonl"
+CODES_PATH = ROOT_DIR / "data" / "processed" / "codes.json"
+
+# etapa (EI/EF/EM) + ano(s) + área + número, com separadores opcionais entre as partes
+CODE_RE = re.compile(r"(?<![a-z0-9])(e[ifm])[\s._-]*(\d{2})[\s._-]*([a-z]{2,4})[\s._-]*(\d{2,3})(?![a-z0-9])")
+# definição no texto do PDF: o código entre parênteses, no começo do item
+DEFINITION_RE = re.compile(r"\(\s*(E[IFM]\s*\d{2}\s*[A-Z]{2,4}\s*\d{2,3})\s*\)")
+
+
+def normalize_code(text: str) -> str:
+    """Forma canônica (maiúsculas, sem separadores): 'em 13 mat 303' -> 'EM13MAT303'."""
+    return re.sub(r"[^A-Za-z0-9]", "", text).upper()
+
+
+def codes_in(text: str) -> list[str]:
+    """Códigos da BNCC no texto, na ordem em que aparecem e sem repetição."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    codes = ["".join(m.groups()).upper() for m in CODE_RE.finditer(text)]
+    return list(dict.fromkeys(codes))
+
+
+class CodeIndex:
+    """
+    codes: código canônico -> {"defines": [chunk_id, ...], "mentions": [chunk_id, ...]}.
+    corpus: sha256 do chunks.jsonl de onde o índice saiu (None se montado em memória).
+    """
+
+    def __init__(self, codes: dict[str, dict[str, list[str]]], corpus: str | None = None):
+        self.codes = codes
+        self.corpus = corpus
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, store: ChunkStore, corpus: str | None = None) -> "CodeIndex":
+        defines: dict[str, list[tuple[int, str]]] = {}
+        mentions: dict[str, list[str]] = {}
+        for cid, raw, lex in zip(store.ids, store.text_raw, store.text_lex):
+            defined = set()
+            for m in DEFINITION_RE.finditer(raw):
+                code = normalize_code(m.group(1))
+                if code not in defined:
+                    defined.add(code)
+                    defines.setdefault(code, []).append((m.start(), cid))
+            for code in codes_in(raw + " " + lex):
+                if code not in defined:
+                    mentions.setdefault(code, []).append(cid)
+
+        codes = {}
+        for code in sorted(set(defines) | set(mentions)):
+            codes[code] = {
+                # sort estável: empates ficam na ordem do corpus
+                "defines": [cid for _, cid in sorted(defines.get(code, []), key=lambda t: t[0])],
+                "mentions": mentions.get(code, []),
+            }
+        return cls(codes, corpus=corpus)
+
+    @classmethod
+    def load_or_build(cls, path: Path, store: ChunkStore, chunks_path: Path) -> "CodeIndex":
+        """codes.json se ele veio do chunks.jsonl atual; senão monta em memória."""
+        corpus = sha256_file(chunks_path)
+        payload = read_manifest(path)
+        if payload is not None and payload.get("corpus") == corpus:
+            return cls(payload["codes"], corpus=corpus)
+        print(f"[CodeIndex] {path.name} ausente ou de outro corpus, montando em memória", file=sys.stderr)
+        return cls.build(store, corpus=corpus)
+
+    def save(self, path: Path):
+        write_manifest(path, {"corpus": self.corpus, "codes": self.codes})
+
+    def lookup(self, query: str) -> list[tuple[str, str, bool]]:
+        """
+        (chunk_id, código, define?) dos códigos citados na query: primeiro as
+        definições de todos os códigos, depois as menções, sem repetir chunks.
+        Vazio se a query não cita nenhum código conhecido.
+        """
+        entries = [(code, self.codes[code]) for code in codes_in(query) if code in self.codes]
+        found: dict[str, tuple[str, str, bool]] = {}
+        for field in ("defines", "mentions"):
+            for code, entry in entries:
+                for cid in entry[field]:
+                    if cid not in found:
+                        found[cid] = (cid, code, field == "defines")
+        return list(found.values())
+
+
+if __name__ == "__main__":
+    store = ChunkStore.load(CHUNKS_PATH)
+    index = CodeIndex.load_or_build(CODES_PATH, store, CHUNKS_PATH)
+    n_defined = sum(1 for entry in index.codes.values() if entry["defines"])
+    print(f"[CodeIndex] {len(index)} códigos ({n_defined} com definição)", file=sys.stderr)
+    for cid, code, is_definition in index.lookup(" ".join(sys.argv[1:])):
+        print(f"{code}  {'define ' if is_definition else 'menciona'}  {cid}")
@@ -0,0 +1,153 @@
+"""
+Diff entre duas versões de data/processed/chunks.jsonl.
+
+O build_corpus.py grava data/processed/chunks_diff.json comparando o chunks.jsonl
+anterior com o novo. Rodar este arquivo aplica os ids renomeados ao gold em bench/:
+
+    cd src && python corpus_diff.py
+"""
+import json
+from pathlib import Path
+
+from chunk_store import ChunkStore
+from utils.cache import write_manifest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DIFF_PATH = ROOT_DIR / "data" / "processed" / "chunks_diff.json"
+GOLD_PATHS = [ROOT_DIR / "bench" / "queries.json", ROOT_DIR / "bench" / "queries_judged.json"]
+
+# campos comparados entre as versões de um chunk
+DIFF_FIELDS = ("text_raw", "text_lex", "metadata")
+
+
+class ChunkDiff:
+    """
+    added/removed: chunk_ids que só existem na versão nova/antiga.
+    changed: chunk_id (novo) -> campos que mudaram (ex.: só text_lex após trocar as stopwords).
+    renamed: id antigo -> id novo de um chunk com o mesmo text_raw, arquivo e página
+    (ex.: migração dos ids posicionais __cNNNNN para os ids por conteúdo).
+    """
+
+    def __init__(
+        self,
+        added: list[str],
+        removed: list[str],
+        changed: dict[str, list[str]],
+        renamed: dict[str, str],
+    ):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.renamed = renamed
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed or self.renamed)
+
+    def summary(self) -> dict:
+        return {
+            "added": len(self.added),
+            "removed": len(self.removed),
+            "changed": len(self.changed),
+            "renamed": len(self.renamed),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "added": self.added,
+            "removed": self.removed,
+            "changed": self.changed,
+            "renamed": self.renamed,
+        }
+
+    def save(self, path: Path):
+        write_manifest(path, self.to_dict())
+
+    @classmethod
+    def load(cls, path: Path) -> "ChunkDiff | None":
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as f:
+            d = json.load(f)
+        return cls(d["added"], d["removed"], d["changed"], d["renamed"])
+
+
+def _changed_fields(old: ChunkStore, i: int, new: ChunkStore, j: int) -> list[str]:
+    return [f for f in DIFF_FIELDS if getattr(old, f)[i] != getattr(new, f)[j]]
+
+
+def _content_key(store: ChunkStore, i: int) -> tuple:
+    meta = store.metadata[i]
+    return store.text_raw[i], meta.get("file_name"), meta.get("page_label")
+
+
+def diff_stores(old: ChunkStore, new: ChunkStore) -> ChunkDiff:
+    added = [cid for cid in new.ids if cid not in old]
+    removed = [cid for cid in old.ids if cid not in new]
+
+    changed: dict[str, list[str]] = {}
+    for j, cid in enumerate(new.ids):
+        i = old.index_of(cid)
+        if i is not None:
+            fields = _changed_fields(old, i, new, j)
+            if fields:
+                changed[cid] = fields
+
+    # pareia removidos e adicionados com o mesmo conteúdo, na ordem do arquivo
+    by_content: dict[tuple, list[str]] = {}
+    for cid in added:
+        by_content.setdefault(_content_key(new, new.index_of(cid)), []).append(cid)
+    renamed: dict[str, str] = {}
+    for old_id in removed:
+        i = old.index_of(old_id)
+        candidates = by_content.get(_content_key(old, i))
+        if not candidates:
+            continue
+        new_id = candidates.pop(0)
+        renamed[old_id] = new_id
+        fields = _changed_fields(old, i, new, new.index_of(new_id))
+        if fields:
+            changed[new_id] = fields
+
+    new_ids = set(renamed.values())
+    added = [cid for cid in added if cid not in new_ids]
+    removed = [cid for cid in removed if cid not in renamed]
+    return ChunkDiff(added=added, removed=removed, changed=changed, renamed=renamed)
+
+
+def remap_gold(items: list[dict], renamed: dict[str, str]) -> int:
+    """Troca ids renomeados no campo relevant (dict ou lista de {chunk_id, ...}). Retorna quantos trocou."""
+    n = 0
+    for item in items:
+        relevant = item.get("relevant")
+        if isinstance(relevant, dict):
+            new_relevant = {}
+            for cid, nota in relevant.items():
+                n += cid in renamed
+                new_relevant[renamed.get(cid, cid)] = nota
+            item["relevant"] = new_relevant
+        elif isinstance(relevant, list):
+            for e in relevant:
+                cid = e.get("chunk_id")
+                if cid in renamed:
+                    e["chunk_id"] = renamed[cid]
+                    n += 1
+    return n
+
+
+if __name__ == "__main__":
+    diff = ChunkDiff.load(DIFF_PATH)
+    if diff is None:
+        raise SystemExit(f"{DIFF_PATH} não existe (rode build_corpus.py)")
+    print(f"[corpus_diff] {diff.summary()}")
+
+    for path in GOLD_PATHS:
+        if not path.exists():
+            continue
+        text = path.read_text(encoding="utf-8")
+        items = json.loads(text)
+        n = remap_gold(items, diff.renamed)
+        # mesmo formato do arquivo original (indent=2, quebra de linha final se houver)
+        out = json.dumps(items, ensure_ascii=False, indent=2)
+        path.write_text(out + "\n" if text.endswith("\n") else out, encoding="utf-8")
+        print(f"[corpus_diff] {path.name}: {n} ids renomeados")
@@ -0,0 +1,331 @@
+"""
+Expansão dos chunks no índice (doc2query): etapa opcional depois do build_corpus.py.
+
+Para cada chunk, um LLM gera perguntas que o trecho responde e palavras-chave; o
+texto delas, limpo como o text_lex, vai para data/processed/expansions.jsonl. O
+main.py monta com ele o campo text_exp (text_lex + expansão) e indexa um segundo
+BM25 (BM25ExpRetriever). O custo de LLM sai da consulta e vai para a indexação.
+
+Os chunks vão em lotes por request (BATCH_TOKEN_BUDGET, BATCH_MAX_ITEMS), com
+concorrência limitada, rate limit e retries. Cada expansão é gravada assim que chega
+em indexes/cache/expansions.sqlite, chaveada por (hash do texto, hash do prompt,
+modelo): uma execução interrompida retoma de onde parou e, depois de um novo
+build_corpus.py, só os chunks novos ou alterados vão ao LLM.
+
+    cd src && python expand_corpus.py           # gera/atualiza expansions.jsonl
+    cd src && python expand_corpus.py --eval    # Standard + BM25 expandido x Fusion
+
+--eval grava data/results/expansion_bench.json com qualidade, latência e chamadas
+de API por query de cada pipeline, nas queries de bench/queries_judged.json.
+"""
+import hashlib
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field
+
+from build_corpus import clean_text
+from chunk_store import ChunkStore
+from utils.cache import DiskCache, fingerprint
+from utils.ratelimit import RateLimiter, call_with_retries, estimate_tokens, pack_batches
+
+load_dotenv()
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+CHUNKS_PATH = ROOT_DIR / "data" / "processed" / "chunks.jsonl"
+EXPANSIONS_PATH = ROOT_DIR / "data" / "processed" / "expansions.jsonl"
+CACHE_DIR = ROOT_DIR / "indexes" / "cache"
+OUT_PATH = ROOT_DIR / "data" / "results" / "expansion_bench.json"
+
+MODEL = "gpt-4o-mini"
+# por chunk
+N_QUERIES = 5
+N_KEYWORDS = 8
+
+# throttling (mesmos limites do judge.py)
+MAX_CONCURRENCY = 8
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
+MAX_RETRIES = 5
+# lotes: vários chunks por request
+BATCH_TOKEN_BUDGET = 6_000
+BATCH_MAX_ITEMS = 8
+PROMPT_OVERHEAD_TOKENS = 400
+OUTPUT_TOKENS_PER_ITEM = 150
+PREVIEW_CHARS = 1500
+
+
+class ChunkExpansion(BaseModel):
+    chunk_id: str = Field(..., description="chunk_id do trecho, exatamente como recebido")
+    queries: list[str] = Field(..., description="Perguntas que o trecho responde")
+    keywords: list[str] = Field(..., description="Palavras-chave e sinônimos do trecho")
+
+
+class ExpansionBatch(BaseModel):
+    expansions: list[ChunkExpansion]
+
+
+EXPAND_SYSTEM = (
+    "Você ajuda a indexar a BNCC (Base Nacional Comum Curricular) para busca. "
+    "Para cada trecho, escreva perguntas que um professor ou gestor faria e que o trecho responde, "
+    "e palavras-chave (incluindo sinônimos e termos que não aparecem no texto). "
+    "Baseie-se somente no trecho e use português. Mantenha códigos de habilidade (ex.: EF01MA01) como estão."
+)
+
+EXPAND_HUMAN = (
+    "Trechos ({n_chunks}), cada um identificado por chunk_id:\n\n{chunks}\n\n"
+    "---\n\n"
+    "Para cada trecho, gere exatamente {n_queries} perguntas curtas e {n_keywords} palavras-chave. "
+    "Responda com exatamente uma expansão por trecho (mesmo chunk_id).\n\n"
+    "{format_instructions}"
+)
+
+# qualquer mudança no prompt ou nos tamanhos invalida as expansões salvas
+PROMPT_HASH = fingerprint(
+    {
+        "system": EXPAND_SYSTEM,
+        "human": EXPAND_HUMAN,
+        "n_queries": N_QUERIES,
+        "n_keywords": N_KEYWORDS,
+        "preview_chars": PREVIEW_CHARS,
+    }
+)
+
+
+def build_chain():
+    llm = ChatOpenAI(model=MODEL, temperature=0.2)
+    parser = PydanticOutputParser(pydantic_object=ExpansionBatch)
+    prompt = ChatPromptTemplate.from_messages([("system", EXPAND_SYSTEM), ("human", EXPAND_HUMAN)])
+    return prompt | llm | parser, parser
+
+
+def expansion_key(text: str) -> str:
+    """Chave da expansão: (hash do texto, hash do prompt, modelo); não depende do chunk_id."""
+    return fingerprint(
+        {"text": hashlib.sha256(text.encode("utf-8")).hexdigest(), "prompt": PROMPT_HASH, "model": MODEL}
+    )
+
+
+def item_tokens(text: str) -> int:
+    return estimate_tokens(text[:PREVIEW_CHARS]) + OUTPUT_TOKENS_PER_ITEM
+
+
+def expand_batch(chain, parser, batch: list[tuple[str, str]]) -> dict[str, ChunkExpansion]:
+    """Expande vários chunks em um request. Ignora chunk_ids que não foram enviados."""
+    chunks = "\n\n".join(
+        f"[{i}] chunk_id: {cid}\n{text[:PREVIEW_CHARS]}" for i, (cid, text) in enumerate(batch, start=1)
+    )
+    result: ExpansionBatch = chain.invoke(
+        {
+            "n_chunks": len(batch),
+            "chunks": chunks,
+            "n_queries": N_QUERIES,
+            "n_keywords": N_KEYWORDS,
+            "format_instructions": parser.get_format_instructions(),
+        }
+    )
+    expected = {cid for cid, _ in batch}
+    return {e.chunk_id: e for e in result.expansions if e.chunk_id in expected}
+
+
+def expand_chunks(
+    chain,
+    parser,
+    items: list[tuple[str, str]],
+    limiter: RateLimiter,
+    store: DiskCache,
+    max_workers: int = MAX_CONCURRENCY,
+) -> dict[str, dict]:
+    """
+    chunk_id -> {"queries", "keywords"} para os (chunk_id, text_raw) pedidos.
+    Os que já estão no store não vão ao LLM; os outros são gravados lote a lote.
+    Lotes que falham (parse ou API) ou voltam incompletos são refeitos um chunk por
+    request; o que ainda faltar fica para a próxima execução.
+    """
+    texts = dict(items)
+    found: dict[str, dict] = {}
+    pending: list[tuple[str, str]] = []
+    for cid, text in items:
+        saved = store.get(expansion_key(text))
+        if saved is not None:
+            found[cid] = saved
+        else:
+            pending.append((cid, text))
+    print(f"[expand] {len(found)} chunks no cache, {len(pending)} para o LLM", file=sys.stderr)
+
+    def run(batch: list[tuple[str, str]]) -> dict[str, ChunkExpansion]:
+        tokens = PROMPT_OVERHEAD_TOKENS + sum(item_tokens(text) for _, text in batch)
+
+        def call():
+            limiter.acquire(tokens)
+            return expand_batch(chain, parser, batch)
+
+        try:
+            # lote com poucas tentativas: o que falhar é refeito um chunk por request
+            retries = MAX_RETRIES if len(batch) == 1 else 2
+            expanded = call_with_retries(call, max_retries=retries, label=f"expand ({len(batch)} chunks)")
+        except Exception:
+            return {}
+        for cid, e in expanded.items():
+            # checkpoint: fixado para não ser despejado do cache
+            store.set(expansion_key(texts[cid]), {"queries": e.queries, "keywords": e.keywords}, pinned=True)
+        return expanded
+
+    batches = pack_batches(
+        pending, lambda item: item_tokens(item[1]), PROMPT_OVERHEAD_TOKENS, BATCH_TOKEN_BUDGET, BATCH_MAX_ITEMS
+    )
+    for round_batches in (batches, None):
+        if round_batches is None:
+            # segunda rodada: o que faltou, um chunk por request
+            round_batches = [[(cid, texts[cid])] for cid, _ in pending if cid not in found]
+            if not round_batches:
+                break
+            print(f"[expand] refazendo {len(round_batches)} chunks um a um", file=sys.stderr)
+        t0 = time.perf_counter()
+        done = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for expanded in pool.map(run, round_batches):
+                for cid, e in expanded.items():
+                    found[cid] = {"queries": e.queries, "keywords": e.keywords}
+                done += 1
+                if done % 20 == 0 or done == len(round_batches):
+                    print(
+                        f"[expand] {done}/{len(round_batches)} requests, {len(found)}/{len(items)} chunks "
+                        f"({time.perf_counter() - t0:.1f}s)",
+                        file=sys.stderr,
+                    )
+
+    missing = len(items) - len(found)
+    if missing:
+        print(f"[expand] aviso: {missing} chunks sem expansão (rode de novo para retomar)", file=sys.stderr)
+    return found
+
+
+def write_expansions(path: Path, store: ChunkStore, expansions: dict[str, dict]):
+    """Uma linha por chunk expandido, na ordem do corpus; text_lex = perguntas + palavras-chave limpas."""
+    tmp = path.with_suffix(".jsonl.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        for cid in store.ids:
+            e = expansions.get(cid)
+            if e is None:
+                continue
+            row = {
+                "chunk_id": cid,
+                "queries": e["queries"],
+                "keywords": e["keywords"],
+                "text_lex": clean_text(" \n".join(e["queries"] + e["keywords"])),
+            }
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    # troca atômica, como no build_corpus.py
+    tmp.replace(path)
+
+
+def evaluate():
+    """Standard + BM25 expandido contra Standard + BM25 e Fusion (BM25 e Hybrid)."""
+    from agents import FusionAgent, StandardAgent
+    from bench_router import run_pipeline, summarize
+    from corpus_diff import ChunkDiff
+    from metrics import Qrels
+    from query_rewrite import QueryRewriter
+    from retrievers.bm25 import BM25Retriever, bm25_fingerprint
+    from retrievers.dense import DenseRetriever
+    from retrievers.hybrid import Hybrid
+
+    top_k = 10
+    with (ROOT_DIR / "bench" / "queries_judged.json").open("r", encoding="utf-8") as f:
+        benchmark = json.load(f)
+    qrels = Qrels.from_benchmark(benchmark)
+    store = ChunkStore.load(CHUNKS_PATH)
+    n_expanded = store.attach_expansions(EXPANSIONS_PATH)
+    chunks_diff = ChunkDiff.load(ROOT_DIR / "data" / "processed" / "chunks_diff.json")
+
+    bm25 = BM25Retriever(
+        nodes=store.nodes("text_lex"),
+        persist_dir=ROOT_DIR / "indexes" / "bm25",
+        top_k=top_k,
+        cache_key=bm25_fingerprint(CHUNKS_PATH, text_field="text_lex"),
+        diff=chunks_diff,
+    )
+    bm25_exp = BM25Retriever(
+        nodes=store.nodes("text_exp"),
+        persist_dir=ROOT_DIR / "indexes" / "bm25_exp",
+        top_k=top_k,
+        cache_key=bm25_fingerprint(CHUNKS_PATH, text_field="text_exp", expansions_path=EXPANSIONS_PATH),
+        name="BM25ExpRetriever",
+    )
+    dense = DenseRetriever(
+        nodes=store.nodes("text_raw"),
+        persist_dir=ROOT_DIR / "indexes" / "dense",
+        top_k=top_k,
+        cache=DiskCache(CACHE_DIR / "embeddings.sqlite"),
+        use_mmap=True,
+        diff=chunks_diff,
+    )
+    hybrid = Hybrid(retrievers=[bm25, dense], top_k=top_k)
+    # mesmas reescritas fixadas do main.py
+    rewriter = QueryRewriter(n=3, cache=DiskCache(CACHE_DIR / "rewrites.sqlite"), pin=True)
+
+    # (nome, agent, chamadas por query: reescritas no LLM e textos embeddados)
+    pipelines = [
+        ("standard_bm25", StandardAgent(retriever=bm25, top_k=top_k), (0, 0)),
+        ("standard_bm25_exp", StandardAgent(retriever=bm25_exp, top_k=top_k), (0, 0)),
+        ("fusion_bm25", FusionAgent(retriever=bm25, rewriter=rewriter, top_k=top_k), (1, 0)),
+        ("fusion_hybrid", FusionAgent(retriever=hybrid, rewriter=rewriter, top_k=top_k), (1, 1 + rewriter.n)),
+    ]
+    results = []
+    for name, agent, (llm_calls, embedded) in pipelines:
+        ranked, latencies = run_pipeline(agent, benchmark)
+        cost = {"llm_calls": llm_calls, "embedded_queries": embedded}
+        results.append(summarize(name, qrels, ranked, latencies, [cost] * len(benchmark)))
+
+    k = 5
+    for r in results:
+        print(
+            f"{r['pipeline']:18s} ndcg@{k}={r[f'ndcg@{k}']:.3f}  mrr@{k}={r[f'mrr@{k}']:.3f}  "
+            f"recall@{top_k}={r[f'recall@{top_k}']:.3f}  p50={r['latency_ms_p50']:8.2f} ms  "
+            f"p95={r['latency_ms_p95']:8.2f} ms  llm={r['llm_calls']:.0f}  emb={r['embedded_queries']:.0f}"
+        )
+    by_name = {r["pipeline"]: r for r in results}
+    expanded = by_name["standard_bm25_exp"]
+    for name in ("fusion_bm25", "fusion_hybrid"):
+        fusion = by_name[name]
+        print(
+            f"standard_bm25_exp / {name}: ndcg@{k} {expanded[f'ndcg@{k}'] / max(fusion[f'ndcg@{k}'], 1e-9):.0%}, "
+            f"latência p50 {expanded['latency_ms_p50'] / max(fusion['latency_ms_p50'], 1e-9):.1%}"
+        )
+
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    payload = {"n_queries": len(benchmark), "top_k": top_k, "n_expanded_chunks": n_expanded, "model": MODEL, "results": results}
+    with OUT_PATH.open("w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2, default=str)
+    print(f"\nresultados em {OUT_PATH}")
+
+
+def main():
+    store = ChunkStore.load(CHUNKS_PATH)
+    chain, parser = build_chain()
+    limiter = RateLimiter(requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE)
+    cache = DiskCache(CACHE_DIR / "expansions.sqlite", max_entries=None)
+
+    t0 = time.perf_counter()
+    expansions = expand_chunks(chain, parser, list(zip(store.ids, store.text_raw)), limiter, cache)
+    write_expansions(EXPANSIONS_PATH, store, expansions)
+    print(
+        f"[expand] {len(expansions)}/{len(store)} chunks expandidos em {time.perf_counter() - t0:.1f}s "
+        f"-> {EXPANSIONS_PATH} | cache: {cache.stats()}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    if "--eval" in sys.argv[1:]:
+        evaluate()
+    else:
+        main()
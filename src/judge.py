@@ -1,6 +1,10 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Literal, Optional
 
@@ -11,11 +15,15 @@ from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 
-from nodes_from_chunks import load_nodes_from_chunks
+from chunk_store import ChunkStore
+from corpus_diff import DIFF_PATH, ChunkDiff
+from utils.cache import DiskCache, fingerprint, normalize_text
+from utils.ratelimit import RateLimiter, call_with_retries, estimate_tokens, pack_batches
 
-from retrievers.bm25 import BM25Retriever
+from retrievers.bm25 import BM25Retriever, bm25_fingerprint
 from retrievers.dense import DenseRetriever
 from retrievers.hybrid import Hybrid
+from retrievers.memo import RetrievalMemo
 
 from agents import StandardAgent, FusionAgent
 from query_rewrite import QueryRewriter
@@ -26,12 +34,33 @@ load_dotenv()
 ROOT_DIR = Path(__file__).resolve().parents[1]
 CHUNKS_PATH = ROOT_DIR / "data" / "processed" / "chunks.jsonl"
 QUERIES_PATH = ROOT_DIR / "bench" / "queries.json"
+CACHE_DIR = ROOT_DIR / "indexes" / "cache"
 
 MODEL = "gpt-4o-mini"
 
 TOP_K_PER_SYSTEM = 15
 TOP_SAVE = 15
 
+# fixa as reescritas em cache para que o gold seja reprodutível
+PIN_REWRITES = True
+
+# julgamento concorrente: limites da conta OpenAI e tentativas extras por par
+MAX_CONCURRENCY = 8
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
+MAX_RETRIES = 5
+# tokens fixos de cada request (sistema + rubrica + regra de códigos + format_instructions)
+JUDGE_PROMPT_OVERHEAD_TOKENS = 900
+
+# "pointwise": um par (query, trecho) por request; "batch": vários trechos da mesma query por request
+JUDGE_MODE = "pointwise"
+BATCH_TOKEN_BUDGET = 8_000
+BATCH_MAX_ITEMS = 12
+# tokens de saída estimados por trecho (chunk_id + score + rationale)
+BATCH_OUTPUT_TOKENS_PER_ITEM = 60
+# no modo batch, quantos pares também julgar pointwise para o relatório de concordância
+AGREEMENT_SAMPLE = 0
+
 Score = Literal[0, 1, 2, 3]
 
 
@@ -41,6 +70,10 @@ class ChunkJudge(BaseModel):
     rationale: Optional[str] = Field(None, description="Justificativa em uma frase, com base apenas no texto.")
 
 
+class ChunkJudgeBatch(BaseModel):
+    judgments: list[ChunkJudge] = Field(..., description="Um julgamento por trecho, com o mesmo chunk_id recebido.")
+
+
 def one_line(text: str) -> str:
     text = (text or "").strip().replace("\n", " ")
     return " ".join(text.split())
@@ -51,43 +84,41 @@ def preview(text: str, max_chars: int = 900) -> str:
     return (t[:max_chars] + "…") if len(t) > max_chars else t
 
 
-def load_chunk_text_map(path: Path) -> dict[str, str]:
-    m: dict[str, str] = {}
-    with path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            c = json.loads(line)
-            cid = c.get("chunk_id")
-            if not cid:
-                continue
-            m[cid] = c.get("text_raw") or c.get("text") or ""
-    return m
-
-
-def build_retrievers(top_k: int):
-    nodes_lex = load_nodes_from_chunks(CHUNKS_PATH, text_field="text_lex")
-    nodes_raw = load_nodes_from_chunks(CHUNKS_PATH, text_field="text_raw")
+def build_retrievers(
+    top_k: int, store: ChunkStore, embedding_cache: DiskCache | None = None, memo: RetrievalMemo | None = None
+):
+    nodes_lex = store.nodes("text_lex")
+    nodes_raw = store.nodes("text_raw")
+    chunks_diff = ChunkDiff.load(DIFF_PATH)
 
     bm25 = BM25Retriever(
         nodes=nodes_lex,
         persist_dir=ROOT_DIR / "indexes" / "bm25",
         top_k=top_k,
         top_n=50,
+        cache_key=bm25_fingerprint(CHUNKS_PATH, text_field="text_lex"),
+        diff=chunks_diff,
     )
 
     dense = DenseRetriever(
         nodes=nodes_raw,
         persist_dir=ROOT_DIR / "indexes" / "dense",
         top_k=top_k,
+        cache=embedding_cache,
+        use_mmap=True,
+        diff=chunks_diff,
     )
 
+    if memo is not None:
+        bm25, dense = memo.wrap(bm25), memo.wrap(dense)
+
     hybrid = Hybrid(
         retrievers=[bm25, dense],
         top_k=top_k,
         rrf_k=60,
     )
+    if memo is not None:
+        hybrid = memo.wrap(hybrid)
 
     return [bm25, dense, hybrid]
 
@@ -112,35 +143,75 @@ RELEVANCE_RUBRIC = """Escala de relevância (use apenas inteiros 0, 1, 2 ou 3):
 BNCC_CODE_RULE = """Regra para códigos BNCC: Se a consulta mencionar um código específico (ex.: EM13MAT303, EF01MA01), só atribua 3 se o trecho contiver esse mesmo código ou a descrição textual exata dessa habilidade/objetivo. Trechos que só explicam o sistema de códigos ou listam outros códigos sem o solicitado devem receber no máximo 2."""
 
 
+JUDGE_SYSTEM = (
+    "Você é um avaliador de relevância para benchmark de recuperação de informação sobre a BNCC (Base Nacional Comum Curricular). "
+    "Sua tarefa é classificar se um trecho do documento ajuda a responder a uma consulta do usuário.\n\n"
+    "Regras de conduta:\n"
+    "- Baseie-se somente no conteúdo do trecho. Não use conhecimento externo.\n"
+    "- Não invente ou interprete além do que está escrito no trecho.\n"
+    "- Seja consistente: o mesmo tipo de relação consulta-trecho deve receber o mesmo score.\n"
+    "- Sempre preencha o campo rationale em uma frase, citando o que no trecho justifica o score."
+)
+
+JUDGE_HUMAN = (
+    "Consulta do usuário:\n{query}\n\n"
+    "Trecho a avaliar:\nchunk_id: {chunk_id}\n\n{chunk_text}\n\n"
+    "---\n\n"
+    + RELEVANCE_RUBRIC
+    + "\n\n"
+    + BNCC_CODE_RULE
+    + "\n\n"
+    "Responda com score (0, 1, 2 ou 3) e rationale.\n\n"
+    "{format_instructions}"
+)
+
+PREVIEW_CHARS = 900
+
+# qualquer mudança no prompt/rubrica invalida os vereditos salvos
+JUDGE_PROMPT_HASH = fingerprint({"system": JUDGE_SYSTEM, "human": JUDGE_HUMAN, "preview_chars": PREVIEW_CHARS})
+
+
 def build_chunk_judge_chain():
     llm = ChatOpenAI(model=MODEL, temperature=0.0)
     parser = PydanticOutputParser(pydantic_object=ChunkJudge)
 
-    system = (
-        "Você é um avaliador de relevância para benchmark de recuperação de informação sobre a BNCC (Base Nacional Comum Curricular). "
-        "Sua tarefa é classificar se um trecho do documento ajuda a responder a uma consulta do usuário.\n\n"
-        "Regras de conduta:\n"
-        "- Baseie-se somente no conteúdo do trecho. Não use conhecimento externo.\n"
-        "- Não invente ou interprete além do que está escrito no trecho.\n"
-        "- Seja consistente: o mesmo tipo de relação consulta-trecho deve receber o mesmo score.\n"
-        "- Sempre preencha o campo rationale em uma frase, citando o que no trecho justifica o score."
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", JUDGE_SYSTEM),
+            ("human", JUDGE_HUMAN),
+        ]
     )
 
+    chain = prompt | llm | parser
+    return chain, parser
+
+
+JUDGE_BATCH_HUMAN = (
+    "Consulta do usuário:\n{query}\n\n"
+    "Trechos a avaliar ({n_chunks}), cada um identificado por chunk_id:\n\n{chunks}\n\n"
+    "---\n\n"
+    + RELEVANCE_RUBRIC
+    + "\n\n"
+    + BNCC_CODE_RULE
+    + "\n\n"
+    "Avalie cada trecho de forma independente. Responda com exatamente um julgamento por trecho "
+    "(mesmo chunk_id), cada um com score (0, 1, 2 ou 3) e rationale.\n\n"
+    "{format_instructions}"
+)
+
+JUDGE_BATCH_PROMPT_HASH = fingerprint(
+    {"system": JUDGE_SYSTEM, "human": JUDGE_BATCH_HUMAN, "preview_chars": PREVIEW_CHARS}
+)
+
+
+def build_batch_judge_chain():
+    llm = ChatOpenAI(model=MODEL, temperature=0.0)
+    parser = PydanticOutputParser(pydantic_object=ChunkJudgeBatch)
+
     prompt = ChatPromptTemplate.from_messages(
         [
-            ("system", system),
-            (
-                "human",
-                "Consulta do usuário:\n{query}\n\n"
-                "Trecho a avaliar:\nchunk_id: {chunk_id}\n\n{chunk_text}\n\n"
-                "---\n\n"
-                + RELEVANCE_RUBRIC
-                + "\n\n"
-                + BNCC_CODE_RULE
-                + "\n\n"
-                "Responda com score (0, 1, 2 ou 3) e rationale.\n\n"
-                "{format_instructions}",
-            ),
+            ("system", JUDGE_SYSTEM),
+            ("human", JUDGE_BATCH_HUMAN),
         ]
     )
 
@@ -148,8 +219,21 @@ def build_chunk_judge_chain():
     return chain, parser
 
 
+def verdict_key(query: str, chunk_id: str, chunk_text: str, prompt_hash: str = JUDGE_PROMPT_HASH) -> str:
+    """Chave do veredito: (hash da query, chunk_id, hash do texto, hash do prompt, modelo)."""
+    return fingerprint(
+        {
+            "query": hashlib.sha256(normalize_text(query).encode("utf-8")).hexdigest(),
+            "chunk_id": chunk_id,
+            "chunk_text": hashlib.sha256(chunk_text.encode("utf-8")).hexdigest(),
+            "prompt": prompt_hash,
+            "model": MODEL,
+        }
+    )
+
+
 def judge_one(chain, parser, query: str, chunk_id: str, chunk_text: str) -> ChunkJudge:
-    chunk_text = preview(chunk_text, max_chars=900)
+    chunk_text = preview(chunk_text, max_chars=PREVIEW_CHARS)
     return chain.invoke(
         {
             "query": query,
@@ -160,19 +244,272 @@ def judge_one(chain, parser, query: str, chunk_id: str, chunk_text: str) -> Chun
     )
 
 
+def parse_relevant(raw_relevant) -> dict[str, int]:
+    if isinstance(raw_relevant, list):
+        return {e["chunk_id"]: int(e["nota"]) for e in raw_relevant if e.get("nota") is not None}
+    return {str(k): int(v) for k, v in (raw_relevant or {}).items()}
+
+
+def collect_candidates(query: str, retrievers, rewriter: QueryRewriter) -> list[str]:
+    """Pool deduplicado de chunk_ids da query, na ordem em que os sistemas os retornam."""
+    pool: list[str] = []
+    seen: set[str] = set()
+    for retriever in retrievers:
+        for agent in build_agents(retriever, rewriter, top_k=TOP_K_PER_SYSTEM):
+            for r in agent.retrieve(query)[:TOP_K_PER_SYSTEM]:
+                cid = r.node.node_id
+                if cid not in seen:
+                    seen.add(cid)
+                    pool.append(cid)
+    return pool
+
+
+def judge_pairs(
+    chain,
+    parser,
+    pairs: list[tuple[str, str, str]],
+    limiter: RateLimiter,
+    max_workers: int = MAX_CONCURRENCY,
+    store: DiskCache | None = None,
+) -> list[ChunkJudge | None]:
+    """
+    Julga pares (query, chunk_id, texto) com concorrência limitada, rate limit e retries.
+    A saída segue a ordem de pairs, independente da ordem em que as respostas chegam.
+
+    Com store, cada veredito é gravado assim que chega (checkpoint) e pares já
+    julgados são lidos de lá: uma execução interrompida retoma de onde parou.
+    Um par que falha (erro não transitório ou retries esgotados) vira None, sem
+    derrubar os outros; ele é julgado de novo na próxima execução.
+    """
+
+    def run(pair: tuple[str, str, str]) -> ChunkJudge | None:
+        query, cid, text = pair
+        key = verdict_key(query, cid, text)
+        if store is not None:
+            saved = store.get(key)
+            if saved is not None:
+                return ChunkJudge(**saved)
+
+        tokens = estimate_tokens(query) + estimate_tokens(preview(text)) + JUDGE_PROMPT_OVERHEAD_TOKENS
+
+        def call():
+            limiter.acquire(tokens)
+            return judge_one(chain, parser, query=query, chunk_id=cid, chunk_text=text)
+
+        try:
+            judged = call_with_retries(call, max_retries=MAX_RETRIES, label=f"judge {cid}")
+        except Exception as e:
+            print(f"[JUDGE] aviso: par ({cid}) sem veredito ({type(e).__name__}: {e})", file=sys.stderr)
+            return None
+        if store is not None:
+            store.set(key, judged.model_dump())
+        return judged
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(run, pairs))
+
+
+def judge_batch(chain, parser, query: str, batch: list[tuple[str, str]]) -> dict[str, ChunkJudge]:
+    """Julga vários trechos da mesma query em um request. Ignora chunk_ids que não foram enviados."""
+    chunks = "\n\n".join(
+        f"[{i}] chunk_id: {cid}\n{preview(text, max_chars=PREVIEW_CHARS)}" for i, (cid, text) in enumerate(batch, start=1)
+    )
+    result: ChunkJudgeBatch = chain.invoke(
+        {
+            "query": query,
+            "n_chunks": len(batch),
+            "chunks": chunks,
+            "format_instructions": parser.get_format_instructions(),
+        }
+    )
+    expected = {cid for cid, _ in batch}
+    return {j.chunk_id: j for j in result.judgments if j.chunk_id in expected}
+
+
+def batch_item_tokens(item: tuple[str, str]) -> int:
+    """Tokens estimados de um (chunk_id, texto) no lote: prévia enviada + veredito."""
+    return estimate_tokens(preview(item[1], max_chars=PREVIEW_CHARS)) + BATCH_OUTPUT_TOKENS_PER_ITEM
+
+
+def query_batches(query: str, items: list[tuple[str, str]]) -> list[list[tuple[str, str]]]:
+    """Lotes de (chunk_id, texto) de uma query que cabem em BATCH_TOKEN_BUDGET e BATCH_MAX_ITEMS."""
+    base = JUDGE_PROMPT_OVERHEAD_TOKENS + estimate_tokens(query)
+    return pack_batches(items, batch_item_tokens, base, BATCH_TOKEN_BUDGET, BATCH_MAX_ITEMS)
+
+
+def judge_pairs_batched(
+    batch_chain,
+    batch_parser,
+    chain,
+    parser,
+    pairs: list[tuple[str, str, str]],
+    limiter: RateLimiter,
+    max_workers: int = MAX_CONCURRENCY,
+    store: DiskCache | None = None,
+) -> tuple[list[ChunkJudge | None], list[bool]]:
+    """
+    Modo listwise: empacota os trechos de cada query em lotes e julga um lote por request.
+    Se o lote falhar (parse ou API) ou vier sem algum chunk_id, esses pares caem no
+    julgamento pointwise (judge_pairs). A saída segue a ordem de pairs: os vereditos
+    e, por par, se ele foi julgado em lote (False = fallback pointwise).
+    """
+    found: dict[tuple[str, str], ChunkJudge] = {}
+    resumed = 0
+
+    # pares já no store (modo batch) não entram nos lotes
+    by_query: dict[str, list[tuple[str, str]]] = {}
+    for query, cid, text in pairs:
+        saved = store.get(verdict_key(query, cid, text, JUDGE_BATCH_PROMPT_HASH)) if store is not None else None
+        if saved is not None:
+            found[(query, cid)] = ChunkJudge(**saved)
+            resumed += 1
+        else:
+            by_query.setdefault(query, []).append((cid, text))
+
+    tasks = [(query, batch) for query, items in by_query.items() for batch in query_batches(query, items)]
+
+    def run(task: tuple[str, list[tuple[str, str]]]) -> dict[str, ChunkJudge]:
+        query, batch = task
+        tokens = JUDGE_PROMPT_OVERHEAD_TOKENS + estimate_tokens(query) + sum(
+            estimate_tokens(preview(text, max_chars=PREVIEW_CHARS)) + BATCH_OUTPUT_TOKENS_PER_ITEM for _, text in batch
+        )
+
+        def call():
+            limiter.acquire(tokens)
+            return judge_batch(batch_chain, batch_parser, query=query, batch=batch)
+
+        try:
+            judged = call_with_retries(call, max_retries=2, label=f"judge batch ({len(batch)} trechos)")
+        except Exception:
+            return {}
+        if store is not None:
+            texts = dict(batch)
+            for cid, j in judged.items():
+                store.set(verdict_key(query, cid, texts[cid], JUDGE_BATCH_PROMPT_HASH), j.model_dump())
+        return judged
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for (query, _), judged in zip(tasks, pool.map(run, tasks)):
+            for cid, j in judged.items():
+                found[(query, cid)] = j
+
+    missing = [(q, cid, text) for q, cid, text in pairs if (q, cid) not in found]
+    in_batch = set(found)
+    # store compartilhado: o fallback é contado pela diferença dos contadores
+    hits0, misses0 = (store.hits, store.misses) if store is not None else (0, 0)
+    if missing:
+        print(f"[JUDGE] fallback pointwise para {len(missing)} pares", file=sys.stderr)
+        for (q, cid, _), j in zip(missing, judge_pairs(chain, parser, missing, limiter, max_workers, store)):
+            found[(q, cid)] = j
+
+    print(
+        f"[JUDGE] modo batch: {len(tasks)} requests; lote: {resumed} retomados do store, "
+        f"{len(in_batch) - resumed} julgados agora"
+    )
+    if missing and store is not None:
+        print(
+            f"[JUDGE] fallback pointwise: {store.hits - hits0} retomados do store, "
+            f"{store.misses - misses0} julgados agora"
+        )
+    return [found[(q, cid)] for q, cid, _ in pairs], [(q, cid) in in_batch for q, cid, _ in pairs]
+
+
+def agreement_report(reference: list[ChunkJudge], other: list[ChunkJudge]) -> dict:
+    """
+    Concordância entre dois julgamentos dos mesmos pares (ex.: pointwise x batch).
+    Inclui kappa com pesos quadráticos, adequado para a escala ordinal 0-3.
+    Pares sem veredito (None) em qualquer um dos lados ficam de fora.
+    """
+    both = [(x, y) for x, y in zip(reference, other) if x is not None and y is not None]
+    a = [int(x.score) for x, _ in both]
+    b = [int(y.score) for _, y in both]
+    n = len(a)
+    if n == 0:
+        return {"n": 0}
+
+    levels = range(4)
+    observed = sum((x - y) ** 2 for x, y in zip(a, b)) / n
+    expected = sum(
+        (x - y) ** 2 * (a.count(x) / n) * (b.count(y) / n) for x in levels for y in levels
+    )
+    kappa = 1.0 - observed / expected if expected > 0 else 1.0
+
+    return {
+        "n": n,
+        "exact": sum(x == y for x, y in zip(a, b)) / n,
+        "within_1": sum(abs(x - y) <= 1 for x, y in zip(a, b)) / n,
+        "mean_abs_diff": sum(abs(x - y) for x, y in zip(a, b)) / n,
+        "quadratic_kappa": kappa,
+    }
+
+
 def main():
     with QUERIES_PATH.open("r", encoding="utf-8") as f:
         bench = json.load(f)
 
-    chunk_text_map = load_chunk_text_map(CHUNKS_PATH)
+    # chunks lidos uma vez: retrievers e textos para o judge vêm do mesmo store
+    store = ChunkStore.load(CHUNKS_PATH)
+    chunk_text_map = store.texts("text_raw")
 
-    retrievers = build_retrievers(top_k=TOP_K_PER_SYSTEM)
-    rewriter = QueryRewriter(model=MODEL, n=3)
+    embedding_cache = DiskCache(CACHE_DIR / "embeddings.sqlite")
+    memo = RetrievalMemo()
+    retrievers = build_retrievers(top_k=TOP_K_PER_SYSTEM, store=store, embedding_cache=embedding_cache, memo=memo)
+    rewrite_cache = DiskCache(CACHE_DIR / "rewrites.sqlite")
+    rewriter = QueryRewriter(model=MODEL, n=3, cache=rewrite_cache, pin=PIN_REWRITES)
 
     chain, parser = build_chunk_judge_chain()
+    # vereditos persistidos por par; nunca despejados
+    verdict_store = DiskCache(CACHE_DIR / "verdicts.sqlite", max_entries=None)
 
-    updated = []
+    # 1) pool de candidatos por query (retrieval) e lista única de pares a julgar
+    plan = []
+    pairs: list[tuple[str, str, str]] = []
+    pending: set[tuple[str, str]] = set()
     for item in bench:
+        query = item.get("query", "")
+        existing_relevant = parse_relevant(item.get("relevant"))
+        candidates = collect_candidates(query, retrievers, rewriter)
+        plan.append((item, existing_relevant, candidates))
+
+        for cid in candidates:
+            if cid in existing_relevant or (query, cid) in pending:
+                continue
+            text = chunk_text_map.get(cid, "")
+            if text.strip():
+                pending.add((query, cid))
+                pairs.append((query, cid, text))
+
+    # 2) julgamento concorrente de todos os pares
+    limiter = RateLimiter(requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE)
+    t0 = time.perf_counter()
+    if JUDGE_MODE == "batch":
+        batch_chain, batch_parser = build_batch_judge_chain()
+        judged_pairs, in_batch = judge_pairs_batched(
+            batch_chain, batch_parser, chain, parser, pairs, limiter=limiter, store=verdict_store
+        )
+        print(f"[JUDGE] {len(pairs)} pares em {time.perf_counter() - t0:.1f}s")
+        if AGREEMENT_SAMPLE > 0:
+            # amostra determinística espalhada pelos pares julgados em lote (nos do fallback
+            # os dois vereditos seriam a mesma chamada pointwise)
+            batched = [i for i, ok in enumerate(in_batch) if ok]
+            step = max(1, len(batched) // AGREEMENT_SAMPLE)
+            idx = batched[::step][:AGREEMENT_SAMPLE]
+            pointwise = judge_pairs(chain, parser, [pairs[i] for i in idx], limiter=limiter, store=verdict_store)
+            print(f"[JUDGE] concordância pointwise x batch: {agreement_report(pointwise, [judged_pairs[i] for i in idx])}")
+    else:
+        judged_pairs = judge_pairs(chain, parser, pairs, limiter=limiter, store=verdict_store)
+        print(
+            f"[JUDGE] {len(pairs)} pares em {time.perf_counter() - t0:.1f}s "
+            f"({verdict_store.hits} retomados do store, {verdict_store.misses} julgados agora)"
+        )
+    verdicts = {(query, cid): judged for (query, cid, _), judged in zip(pairs, judged_pairs)}
+    failed = sum(judged is None for judged in judged_pairs)
+    if failed:
+        print(f"[JUDGE] aviso: {failed} pares sem veredito; rode de novo para julgá-los", file=sys.stderr)
+
+    # 3) monta o gold na mesma ordem do processamento sequencial
+    updated = []
+    for item, existing_relevant, candidates in plan:
         qid = item.get("id", "")
         query = item.get("query", "")
 
@@ -180,43 +517,26 @@ def main():
         print(f"[JUDGE] id={qid}")
         print(query)
 
-        raw_relevant = item.get("relevant")
-        if isinstance(raw_relevant, list):
-            existing_relevant = {e["chunk_id"]: int(e["nota"]) for e in raw_relevant if e.get("nota") is not None}
-        else:
-            existing_relevant = {str(k): int(v) for k, v in (raw_relevant or {}).items()}
-
         scored: dict[str, int] = dict(existing_relevant)
         rationale_by_cid: dict[str, str | None] = {}
 
-        seen: set[str] = set()
-
-        for retriever in retrievers:
-            agents = build_agents(retriever, rewriter, top_k=TOP_K_PER_SYSTEM)
-
-            for agent in agents:
-                results = agent.retrieve(query)[:TOP_K_PER_SYSTEM]
-
-                for r in results:
-                    cid = r.node.node_id
-
-                    if cid in seen:
-                        continue
-                    seen.add(cid)
-
-                    if cid in existing_relevant:
-                        continue
+        for cid in candidates:
+            if cid in existing_relevant:
+                continue
 
-                    text = chunk_text_map.get(cid, "")
-                    if not text.strip():
-                        scored[cid] = 0
-                        continue
+            text = chunk_text_map.get(cid, "")
+            if not text.strip():
+                scored[cid] = 0
+                continue
 
-                    judged = judge_one(chain, parser, query=query, chunk_id=cid, chunk_text=text)
-                    scored[cid] = int(judged.score)
-                    rationale_by_cid[cid] = judged.rationale
+            judged = verdicts[(query, cid)]
+            if judged is None:
+                # sem veredito nesta execução (ver judge_pairs); fica para a próxima
+                continue
+            scored[cid] = int(judged.score)
+            rationale_by_cid[cid] = judged.rationale
 
-                    print(f"  chunk={cid} | score={judged.score}")
+            print(f"  chunk={cid} | score={judged.score}")
 
         ranked = sorted(scored.items(), key=lambda x: x[1], reverse=True)
         top = ranked[:TOP_SAVE]
@@ -241,6 +561,10 @@ def main():
     with out_path.open("w", encoding="utf-8") as f:
         json.dump(updated, f, ensure_ascii=False, indent=2)
 
+    print(f"[cache] embeddings: {embedding_cache.stats()}")
+    print(f"[cache] rewrites: {rewrite_cache.stats()}")
+    print(f"[memo] retrieval: {memo.stats()}")
+
 
 if __name__ == "__main__":
     main()
@@ -1,113 +1,286 @@
 from pathlib import Path
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from nodes_from_chunks import load_nodes_from_chunks
+from chunk_store import ChunkStore
+from corpus_diff import ChunkDiff
 
 # importing retrievers
 from retrievers.hybrid import Hybrid
-from retrievers.bm25 import BM25Retriever
+from retrievers.bm25 import BM25Retriever, bm25_fingerprint
 from retrievers.dense import DenseRetriever
+from retrievers.memo import RetrievalMemo
+from retrievers.code_match import CodeMatchRetriever
+from code_index import CodeIndex
 # importing agents
 from agents import StandardAgent, FusionAgent
-from query_rewrite import QueryRewriter
+from query_rewrite import PRFRewriter, QueryRewriter
 import json
 
-from metrics import recall, mean_reciprocal_rank, normalized_discounted_cumulative_gain
+from metrics import Qrels
 from utils.reporting import generate_results
+from utils import timing
+from utils.cache import DiskCache
 
 root_dir = Path(__file__).resolve().parents[1]
 
 load_dotenv()
 
 
+def format_results(top_k_results, raw_text: Mapping[str, str]) -> list[str]:
+    """Linhas de log com os top k resultados (metadata, id, score e preview do text_raw)."""
+    lines = []
+    for i, item in enumerate(top_k_results, start=1):
+        # metadata
+        meta = item.node.metadata or {}
+        page = meta.get("page_label") or meta.get("page") or "na"
+        file_name = meta.get("file_name") or meta.get("filename") or "unknown"
+
+        # id e score
+        chunk_id = item.node.node_id
+        score = float(item.score) if item.score is not None else 0.0
+
+        # texto
+        raw = raw_text.get(chunk_id) or item.node.text or ""
+        text = raw.strip().replace("\n", " ")
+        text = " ".join(text.split())
+        preview = (text[:220] + "…") if len(text) > 220 else text
+
+        lines.append(f"\n[{i}/{len(top_k_results)}] score={score:.4f} | page={page} | file={file_name}")
+        lines.append(f"chunk_id: {chunk_id}")
+        lines.append(f"preview : {preview}")
+    return lines
+
+
+def evaluate_query(
+    item: dict,
+    retrievers: list,
+    rewriter: QueryRewriter,
+    qrels: Qrels,
+    top_k: int,
+    cutoffs: list[int],
+    log_k: int,
+    raw_text: Mapping[str, str],
+    rewrite_budget_ms: float | None = None,
+    prf_rewriter: PRFRewriter | None = None,
+) -> tuple[list[dict], list[str]]:
+    """
+    Roda uma query em todos os (retriever, agent) uma única vez, na profundidade top_k,
+    e calcula as métricas em cada cutoff a partir desse mesmo ranking.
+    latency_ms é o tempo do agent.retrieve somado ao custo das buscas reaproveitadas
+    do memo e das reescritas/embeddings lidos de cache (o custo gravado quando foram
+    feitos); <etapa>_ms é o tempo em cada etapa (ver utils/timing.py). Só é o custo
+    do sistema sozinho se a query rodou sem outras em paralelo (ver serial_latency).
+    Retorna as linhas do per_query.csv e o log, para serem impressos na ordem do benchmark.
+    """
+    query_id = item['id']
+    query = item['query']
+
+    rows = []
+    log_lines = []
+    for retriever in retrievers:
+        # escolhendo o agent - RAG Standard or RAG-f (Fusion)
+        # Standard RAG
+        standard_rag = StandardAgent(retriever=retriever, top_k=top_k)
+        # RAG-Fusion
+        fusion_rag = FusionAgent(retriever=retriever, top_k=top_k, rewriter=rewriter, rewrite_budget_ms=rewrite_budget_ms)
+
+        agents = [standard_rag, fusion_rag]
+        if prf_rewriter is not None:
+            # RAG-Fusion com expansão local (PRF) no lugar do LLM
+            agents.append(
+                FusionAgent(retriever=retriever, top_k=top_k, rewriter=prf_rewriter, name="FusionAgentPRF")
+            )
+        for agent in agents:
+
+            # recuperando as informações
+
+            # Framework
+            with timing.collect() as times:
+                t0 = time.perf_counter()
+                top_k_results = agent.retrieve(query=query)
+                wall_ms = (time.perf_counter() - t0) * 1000
+            ranked_ids = [r.node.node_id for r in top_k_results]
+
+            row = {
+                "query_id": query_id,
+                "query": query,
+                "agent": getattr(agent, "name", agent.__class__.__name__),
+                "retriever": retriever.name,
+            }
+            for k in cutoffs:
+                row[f"recall@{k}"] = qrels.recall(query_id, ranked_ids, k)
+                row[f"mrr@{k}"] = qrels.mrr(query_id, ranked_ids, k)
+                row[f"ndcg@{k}"] = qrels.ndcg(query_id, ranked_ids, k)
+            row["latency_ms"] = wall_ms + times.replayed_ms
+            row.update(times.row())
+            # 1 se algo ficou de fora (deadline do Hybrid ou prazo da reescrita)
+            row["degraded"] = int(bool(times.degraded))
+            rows.append(row)
+
+            # apenas guardando os primeiros resultados para o log
+            log_lines.extend(format_results(top_k_results[:log_k], raw_text))
+
+    return rows, log_lines
+
+
 def main():
 
     root_dir = Path(__file__).resolve().parents[1]
     chunks_path = root_dir / "data" / "processed" / "chunks.jsonl"
     bench_path = root_dir / "bench" / "queries_judged.json"
-    top_k = 5
+    # métricas em vários cutoffs, todas derivadas de um único retrieval na profundidade máxima
+    cutoffs = [1, 3, 5, 10, 20]
+    top_k = max(cutoffs)
+    # cutoff principal (ordenação da tabela, gráficos de barras e log)
+    report_k = 5
+    # queries avaliadas em paralelo (1 = execução serial)
+    max_workers = 8
+    # com max_workers > 1, latência, tempos por etapa e degraded saem de uma segunda passada
+    # serial (memo zerado, caches já aquecidos), sem a disputa entre queries por threads e API;
+    # essa passada roda todas as avaliações de novo, uma por vez, então o tempo total dobra
+    # (ou mais: ela não tem o paralelismo da primeira). False = só a passada paralela
+    serial_latency = True
+    # prazo por query para o Hybrid (ms); None = espera BM25 e Dense (sem resultados degradados)
+    hybrid_deadline_ms = None
+    # prazo da reescrita no FusionAgent (ms); estourou = ranking da query original (degradado)
+    fusion_rewrite_budget_ms = None
+    # caminho rápido para queries com código da BNCC, reportado como sistemas à parte
+    # (CodeMatch<retriever>) ao lado dos originais: "shortcut" responde pelo índice de
+    # códigos (sem embedding, reescrita nem RRF), "boost" põe os chunks do código no
+    # topo, None desliga
+    code_match_mode = None
+    # FusionAgent também com o PRFRewriter (RM3 sobre o BM25, sem LLM), reportado como
+    # FusionAgentPRF; prf_dense_feedback = variação extra do centróide no índice denso
+    prf_fusion = True
+    prf_dense_feedback = True
+    # BM25 também sobre o text_exp (text_lex + queries/palavras-chave do expand_corpus.py),
+    # reportado como BM25ExpRetriever; só entra se data/processed/expansions.jsonl existir
+    expanded_bm25 = True
+    expansions_path = root_dir / "data" / "processed" / "expansions.jsonl"
 
     with bench_path.open("r", encoding="utf-8") as f:
         benchmark = json.load(f)
+    # gold pré-processado uma vez (relevantes, ganhos e IDCG por query)
+    qrels = Qrels.from_benchmark(benchmark)
+
+    # chunks lidos uma vez; BM25 e Dense usam visões do mesmo store
+    store = ChunkStore.load(chunks_path)
+    # mudanças desde o último build_corpus.py (o Dense só embedda chunks novos, o BM25 só tokeniza eles)
+    chunks_diff = ChunkDiff.load(root_dir / "data" / "processed" / "chunks_diff.json")
 
-    rewriter = QueryRewriter(n=3)
+    cache_dir = root_dir / "indexes" / "cache"
+    # reescritas ficam em cache e fixadas (pin) para o benchmark ser reprodutível
+    rewrite_cache = DiskCache(cache_dir / "rewrites.sqlite")
+    rewriter = QueryRewriter(n=3, cache=rewrite_cache, pin=True)
+    # cache em disco dos embeddings das queries (reexecuções não chamam a API)
+    embedding_cache = DiskCache(cache_dir / "embeddings.sqlite")
+    raw_nodes = store.nodes("text_raw")
     # escolhendo um retriever
     # bm25 é um retriever baseado em palavras-chave(lexical)
     bm25 = BM25Retriever(
-        nodes=load_nodes_from_chunks(path= chunks_path, text_field="text_lex"),
+        nodes=store.nodes("text_lex"),
         persist_dir = root_dir / "indexes" / "bm25", # indices salvos
         top_k = top_k,
+        cache_key = bm25_fingerprint(chunks_path, text_field="text_lex"), # recarrega o índice se o corpus não mudou
+        diff = chunks_diff, # se mudou, atualiza o índice salvo em vez de reconstruir
     )
     # dense é um retriever baseado em embeddings (vetorial)
     dense = DenseRetriever(
-        nodes=load_nodes_from_chunks(path= chunks_path, text_field="text_raw"),
+        nodes=raw_nodes,
         persist_dir = root_dir / "indexes" / "dense", # indices salvos
         top_k = top_k,
+        cache = embedding_cache,
+        use_mmap = True, # matriz de embeddings com mmap (inicialização rápida)
+        diff = chunks_diff,
     )
+    # memo da execução: Hybrid e FusionAgent reaproveitam buscas já feitas
+    memo = RetrievalMemo()
+    bm25, dense = memo.wrap(bm25), memo.wrap(dense)
     # hybrid combina os dois retrievers acima
-    hybrid = Hybrid(retrievers = [bm25, dense], top_k=top_k)
+    hybrid = memo.wrap(Hybrid(retrievers = [bm25, dense], top_k=top_k, deadline_ms=hybrid_deadline_ms))
     retrievers = [dense, bm25, hybrid]
-    
-
-    def relevant_as_dict(relevant):
-        """Aceita relevant como dict (queries.json) ou lista de {chunk_id, nota, ...} (queries_judged / queries_with_text)."""
-        if isinstance(relevant, list):
-            return {e["chunk_id"]: int(e["nota"]) for e in relevant if e.get("nota") is not None}
-        return {str(k): int(v) for k, v in (relevant or {}).items()}
+    if expanded_bm25 and expansions_path.exists():
+        n_expanded = store.attach_expansions(expansions_path)
+        print(f"[expand] {n_expanded}/{len(store)} chunks com expansão")
+        bm25_exp = BM25Retriever(
+            nodes=store.nodes("text_exp"),
+            persist_dir = root_dir / "indexes" / "bm25_exp",
+            top_k = top_k,
+            cache_key = bm25_fingerprint(chunks_path, text_field="text_exp", expansions_path=expansions_path),
+            name = "BM25ExpRetriever",
+        )
+        retrievers.append(memo.wrap(bm25_exp))
+    prf_rewriter = None
+    if prf_fusion:
+        prf_rewriter = PRFRewriter(
+            bm25, store.texts("text_lex"), n=rewriter.n, dense=dense if prf_dense_feedback else None
+        )
+    if code_match_mode is not None:
+        # índice código -> chunks gravado pelo build_corpus.py
+        codes = CodeIndex.load_or_build(root_dir / "data" / "processed" / "codes.json", store, chunks_path)
+        retrievers += [
+            CodeMatchRetriever(r, codes, raw_nodes, mode=code_match_mode, name=f"CodeMatch{r.name}") for r in retrievers
+        ]
 
+    # queries rodam em paralelo (quase todo o tempo é espera da OpenAI);
+    # map preserva a ordem, então per_query.csv sai igual ao da execução serial
+    raw_text = store.texts("text_raw")
+    t0 = time.perf_counter()
     results = []
-    for item in benchmark:
-        query_id = item['id']
-        query = item['query']
-        relevant = relevant_as_dict(item['relevant'])
-        for retriever in retrievers:
-            # escolhendo o agent - RAG Standard or RAG-f (Fusion)
-            # Standard RAG
-            standard_rag = StandardAgent(retriever=retriever, top_k=top_k)
-            # RAG-Fusion
-            fusion_rag = FusionAgent(retriever=retriever, top_k=top_k, rewriter=rewriter)
-
-            agents = [standard_rag, fusion_rag]
-            for agent in agents:
-
-                # recuperando as informações
-
-                # Framework
-                top_k_results = agent.retrieve(query=query)
-                ranked_ids = [r.node.node_id for r in top_k_results]
-
-                results.append({
-                    "query_id": query_id,
-                    "query": query,
-                    "agent": agent.__class__.__name__,
-                    "retriever": retriever.__class__.__name__,
-                    f"recall@{top_k}": recall(ranked_ids, relevant, top_k),
-                    f"mrr@{top_k}": mean_reciprocal_rank(ranked_ids, relevant, top_k),
-                    f"ndcg@{top_k}": normalized_discounted_cumulative_gain(ranked_ids, relevant, top_k),
-                })
-
-                # apenas printando os top k resultados
-                for i, item in enumerate(top_k_results, start=1):
-                    # metadata
-                    meta = item.node.metadata or {}
-                    page = meta.get("page_label") or meta.get("page") or "na"
-                    file_name = meta.get("file_name") or meta.get("filename") or "unknown"
-
-                    # id e score
-                    chunk_id = item.node.node_id
-                    score = float(item.score) if item.score is not None else 0.0
-
-                    # texto
-                    raw = meta.get("text_raw") or item.node.text or ""
-                    text = raw.strip().replace("\n", " ")
-                    text = " ".join(text.split())
-                    preview = (text[:220] + "…") if len(text) > 220 else text
-
-                    print(f"\n[{i}/{len(top_k_results)}] score={score:.4f} | page={page} | file={file_name}")
-                    print(f"chunk_id: {chunk_id}")
-                    print(f"preview : {preview}")
-
-    
-    summary_rows, paths = generate_results(root_dir / "data" / "results", results, k=top_k)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for rows, log_lines in pool.map(
+            lambda item: evaluate_query(
+                item, retrievers, rewriter, qrels, top_k, cutoffs, log_k=report_k, raw_text=raw_text,
+                rewrite_budget_ms=fusion_rewrite_budget_ms, prf_rewriter=prf_rewriter,
+            ),
+            benchmark,
+        ):
+            results.extend(rows)
+            print("\n".join(log_lines))
+    wall = time.perf_counter() - t0
+
+    print(
+        f"\n[eval] {len(benchmark)} queries, {len(results)} avaliações em {wall:.1f}s "
+        f"({len(benchmark) / wall:.2f} queries/s, {len(results) / wall:.2f} avaliações/s, workers={max_workers})"
+    )
+
+    if serial_latency and max_workers > 1:
+        # mesmas queries, uma por vez: cada sistema paga as suas buscas de novo (ou o
+        # custo delas, se reaproveitadas dentro da query) sem disputar com as outras
+        memo.clear()
+        t0 = time.perf_counter()
+        timed = []
+        for item in benchmark:
+            rows, _ = evaluate_query(
+                item, retrievers, rewriter, qrels, top_k, cutoffs, log_k=report_k, raw_text=raw_text,
+                rewrite_budget_ms=fusion_rewrite_budget_ms, prf_rewriter=prf_rewriter,
+            )
+            timed.extend(rows)
+        n_replaced = 0
+        for i, (row, timed_row) in enumerate(zip(results, timed)):
+            if row["degraded"] != timed_row["degraded"]:
+                # o prazo (Hybrid/rewrite) caiu diferente nas duas passadas: a linha inteira
+                # vem da serial, para métricas, degraded e latência serem da mesma execução
+                results[i] = timed_row
+                n_replaced += 1
+                continue
+            for col in ["latency_ms"] + [f"{s}_ms" for s in timing.STAGES]:
+                row[col] = timed_row[col]
+        print(
+            f"[eval] latência medida em passada serial ({time.perf_counter() - t0:.1f}s, "
+            f"{n_replaced} linhas com degraded diferente vieram inteiras dela)"
+        )
+
+    summary_rows, paths = generate_results(root_dir / "data" / "results", results, k=report_k, cutoffs=cutoffs)
+    print(f"[cache] embeddings: {embedding_cache.stats()}")
+    print(f"[cache] rewrites: {rewrite_cache.stats()}")
+    print(f"[memo] retrieval: {memo.stats()}")
+    if code_match_mode is not None:
+        for r in retrievers:
+            if isinstance(r, CodeMatchRetriever):
+                print(f"[codes] {r.name}: {r.stats()}")
 
 
 if __name__ == "__main__":
@@ -2,6 +2,8 @@ import math
 from pathlib import Path
 import json
 
+import numpy as np
+
 
 def recall(retrieved_chunks: list[str], benchmark: dict[str, int], k: int) -> float:
     """
@@ -56,3 +58,114 @@ def normalized_discounted_cumulative_gain(retrieved_chunks: list[str], benchmark
 
     return dcg_val / idcg_val
 
+
+
+def relevant_as_dict(relevant) -> dict[str, int]:
+    """Aceita relevant como dict (queries.json) ou lista de {chunk_id, nota, ...} (queries_judged / queries_with_text)."""
+    if isinstance(relevant, list):
+        return {e["chunk_id"]: int(e["nota"]) for e in relevant if e.get("nota") is not None}
+    return {str(k): int(v) for k, v in (relevant or {}).items()}
+
+
+class Qrels:
+    """
+    Gold pré-processado uma vez por query: conjunto de relevantes (nota > 0),
+    ganhos graduados (2^nota - 1) e IDCG acumulado por profundidade.
+
+    Os métodos recall/mrr/ndcg dão os mesmos valores das funções acima;
+    evaluate_batch avalia uma matriz (sistemas x queries) de rankings com NumPy.
+    """
+
+    def __init__(self, gold: dict[str, dict[str, int]]):
+        self.query_ids = list(gold.keys())
+        self.relevant: dict[str, set[str]] = {}
+        self.gains: dict[str, dict[str, float]] = {}
+        self._idcg: dict[str, list[float]] = {}
+
+        for qid, judgments in gold.items():
+            judgments = {str(cid): int(nota) for cid, nota in judgments.items()}
+            self.relevant[qid] = {cid for cid, nota in judgments.items() if nota > 0}
+            self.gains[qid] = {cid: float(2**nota - 1) for cid, nota in judgments.items()}
+
+            # IDCG acumulado: _idcg[qid][i] = IDCG@(i+1), na mesma ordem de soma da função original
+            ideal = sorted(judgments.values(), reverse=True)
+            acc, cum = 0.0, []
+            for i, nota in enumerate(ideal, start=1):
+                acc += (2**nota - 1) / math.log2(i + 1)
+                cum.append(acc)
+            self._idcg[qid] = cum
+
+    @classmethod
+    def from_benchmark(cls, benchmark: list[dict]) -> "Qrels":
+        return cls({item["id"]: relevant_as_dict(item["relevant"]) for item in benchmark})
+
+    def idcg(self, qid: str, k: int) -> float:
+        cum = self._idcg[qid]
+        if not cum or k <= 0:
+            return 0.0
+        return cum[min(k, len(cum)) - 1]
+
+    def recall(self, qid: str, ranked_ids: list[str], k: int) -> float:
+        rel_ids = self.relevant[qid]
+        if not rel_ids:
+            return 0.0
+        return sum(1 for cid in ranked_ids[:k] if cid in rel_ids) / len(rel_ids)
+
+    def mrr(self, qid: str, ranked_ids: list[str], k: int) -> float:
+        rel_ids = self.relevant[qid]
+        for rank, cid in enumerate(ranked_ids[:k], start=1):
+            if cid in rel_ids:
+                return 1.0 / rank
+        return 0.0
+
+    def ndcg(self, qid: str, ranked_ids: list[str], k: int) -> float:
+        idcg_val = self.idcg(qid, k)
+        if idcg_val == 0.0:
+            return 0.0
+        gains = self.gains[qid]
+        dcg_val = 0.0
+        for i, cid in enumerate(ranked_ids[:k], start=1):
+            dcg_val += gains.get(cid, 0.0) / math.log2(i + 1)
+        return dcg_val / idcg_val
+
+    def evaluate_batch(self, runs: dict[str, dict[str, list[str]]], k: int, query_ids: list[str] | None = None) -> dict:
+        """
+        Avalia todos os sistemas de uma vez.
+        runs: sistema -> (query_id -> ranking de chunk_ids).
+        Retorna {"systems", "query_ids", "recall", "mrr", "ndcg"}, com cada métrica
+        num array (n_sistemas, n_queries). Queries sem ranking contam como ranking vazio.
+        """
+        systems = list(runs.keys())
+        query_ids = list(query_ids or self.query_ids)
+        n_s, n_q = len(systems), len(query_ids)
+
+        gain = np.zeros((n_s, n_q, k))
+        hit = np.zeros((n_s, n_q, k), dtype=bool)
+        for s, system in enumerate(systems):
+            for q, qid in enumerate(query_ids):
+                gains, rel_ids = self.gains[qid], self.relevant[qid]
+                for i, cid in enumerate(runs[system].get(qid, [])[:k]):
+                    gain[s, q, i] = gains.get(cid, 0.0)
+                    hit[s, q, i] = cid in rel_ids
+
+        discounts = 1.0 / np.log2(np.arange(2, k + 2))
+        idcg = np.array([self.idcg(qid, k) for qid in query_ids])
+        n_rel = np.array([len(self.relevant[qid]) for qid in query_ids], dtype=float)
+
+        dcg = (gain * discounts).sum(axis=-1)
+        ndcg = np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg > 0)
+        recall = np.divide(hit.sum(axis=-1), n_rel, out=np.zeros((n_s, n_q)), where=n_rel > 0)
+        first = hit.argmax(axis=-1)
+        mrr = np.where(hit.any(axis=-1), 1.0 / (first + 1), 0.0)
+
+        return {"systems": systems, "query_ids": query_ids, "recall": recall, "mrr": mrr, "ndcg": ndcg}
+
+
+def bootstrap_means(scores: np.ndarray, n_resamples: int = 1000, seed: int = 0) -> np.ndarray:
+    """
+    Bootstrap pareado sobre queries: scores (n_sistemas, n_queries) -> médias
+    reamostradas (n_sistemas, n_resamples). Mesmas queries sorteadas para todos os sistemas.
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, scores.shape[1], size=(n_resamples, scores.shape[1]))
+    return scores[:, idx].mean(axis=-1)
@@ -1,3 +1,10 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from collections.abc import Mapping
+from concurrent.futures import Future
+
+import numpy as np
 from pydantic import BaseModel, Field
 
 from langchain_openai import ChatOpenAI
@@ -5,6 +12,9 @@ from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
 from dotenv import load_dotenv
 
+from utils import timing
+from utils.cache import DiskCache, fingerprint, normalize_text
+
 load_dotenv()
 
 
@@ -18,10 +28,24 @@ class QueryVariations(BaseModel):
 class QueryRewriter:
     """
     Reescrever queries usando LLM.
+
+    Com um DiskCache, as variações ficam salvas em disco chaveadas por
+    (modelo, n, hash do prompt, query) e são compartilhadas entre processos.
+    pin=True fixa as variações gravadas (não são despejadas do cache), para
+    que execuções futuras usem exatamente as mesmas reescritas.
+    Junto com as variações fica o tempo da chamada ao LLM, cobrado na etapa
+    "rewrite" a cada cache hit (utils.timing.charge).
+
+    Single-flight: chamadas simultâneas para a mesma query (threads do main.py e
+    do judge.py) esperam a primeira em vez de repetir a chamada ao LLM, então só
+    uma grava (e fixa) as variações no cache.
     """
 
-    def __init__(self, model: str = "gpt-4o-mini", n: int = 3):
+    def __init__(self, model: str = "gpt-4o-mini", n: int = 3, cache: DiskCache | None = None, pin: bool = False):
+        self.model = model
         self.n = n
+        self.cache = cache
+        self.pin = pin
         self.llm = ChatOpenAI(model=model, temperature=0.2)
         self.parser = PydanticOutputParser(pydantic_object=QueryVariations)
         self.prompt = PromptTemplate(
@@ -42,10 +66,164 @@ class QueryRewriter:
             },
         )
         self.chain = self.prompt | self.llm | self.parser
+        self.prompt_hash = fingerprint(
+            {"template": self.prompt.template, "partial_variables": self.prompt.partial_variables}
+        )
+        # chave -> Future da chamada ao LLM em andamento
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def cache_key(self, query: str) -> str:
+        return fingerprint(
+            {"model": self.model, "n": self.n, "prompt": self.prompt_hash, "query": normalize_text(query)}
+        )
 
     def rewrite(self, query: str) -> list[str]:
-        result: QueryVariations = self.chain.invoke({"query": query})
-        variations = result.variations
+        with timing.stage("rewrite"):
+            return self._rewrite(query)
+
+    def _cached(self, key: str) -> list[str] | None:
+        if self.cache is None:
+            return None
+        cached, cost_ms = self.cache.get_with_cost(key)
+        if cached is None:
+            return None
+        if self.pin:
+            self.cache.pin(key)
+        timing.charge("rewrite", cost_ms)
+        return cached[: self.n]
+
+    def _rewrite(self, query: str) -> list[str]:
+        key = self.cache_key(query)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            # outra thread já está chamando o LLM para esta query
+            return list(future.result())
+
+        try:
+            # a chamada anterior pode ter terminado entre o get e o registro acima
+            variations = self._cached(key)
+            if variations is None:
+                t0 = time.perf_counter()
+                result: QueryVariations = self.chain.invoke({"query": query})
+                variations = result.variations[: self.n]
+                cost_ms = (time.perf_counter() - t0) * 1000
+                if self.cache is not None:
+                    self.cache.set(key, variations, pinned=self.pin, cost_ms=cost_ms)
+            future.set_result(variations)
+            return variations
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+class PRFRewriter:
+    """
+    Reescrita local por pseudo-relevance feedback (RM3), sem LLM. Mesma interface do
+    QueryRewriter: rewrite(query) -> list[str] com até n variações.
 
+    Os fb_docs primeiros resultados do BM25 para a query são tomados como relevantes
+    e os termos do text_lex deles recebem o peso do RM3
+        P(w|R) = sum_d P(d|q) * tf(w, d) / |d|,   P(d|q) proporcional ao score BM25
+    agrupados pelo stem do BM25 (a forma mais frequente no texto representa o stem);
+    termos da query ficam de fora. A variação i é a query original seguida da i-ésima
+    fatia de fb_terms termos desse ranking.
+
+    Com dense (DenseRetriever), a última variação vem do centróide (Rocchio) dos vetores
+    dos documentos de feedback: os vizinhos dele no índice denso formam um segundo
+    conjunto de feedback, com P(d) uniforme. Nada é embeddado nem enviado a APIs.
+    """
+
+    def __init__(
+        self,
+        bm25,
+        texts: Mapping[str, str],
+        n: int = 3,
+        fb_docs: int = 10,
+        fb_terms: int = 5,
+        dense=None,
+    ):
+        self.bm25 = bm25
+        self.texts = texts
+        self.n = n
+        self.fb_docs = fb_docs
+        self.fb_terms = fb_terms
+        self.dense = dense
+        # palavra do text_lex -> stem do BM25 ("" para stopwords)
+        self._stems: dict[str, str] = {}
+
+    def _stem(self, word: str) -> str:
+        stem = self._stems.get(word)
+        if stem is None:
+            tokens = self.bm25.tokenize(word)
+            stem = tokens[0] if len(tokens) == 1 else ""
+            self._stems[word] = stem
+        return stem
+
+    def _expansion_terms(self, docs: list[tuple[str, float]], exclude: set[str]) -> list[str]:
+        """Termos de expansão (forma de superfície), do maior para o menor peso RM3."""
+        total = sum(weight for _, weight in docs)
+        weights: dict[str, float] = defaultdict(float)
+        forms: dict[str, Counter] = defaultdict(Counter)
+        for chunk_id, weight in docs:
+            words = [w for w in self.texts.get(chunk_id, "").split() if len(w) > 2 and not w.isdigit()]
+            if not words or total <= 0:
+                continue
+            for word, tf in Counter(words).items():
+                stem = self._stem(word)
+                if not stem or stem in exclude:
+                    continue
+                weights[stem] += (weight / total) * tf / len(words)
+                forms[stem][word] += tf
+        ranked = sorted(weights, key=lambda stem: (-weights[stem], stem))
+        return [forms[stem].most_common(1)[0][0] for stem in ranked]
+
+    def _centroid_docs(self, chunk_ids: list[str]) -> list[tuple[str, float]]:
+        vectors = self.dense.vectors_of(chunk_ids)
+        if len(vectors) == 0:
+            return []
+        centroid = vectors.mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        if norm > 0:
+            centroid = centroid / norm
+        neighbors = self.dense.search_vector(centroid)[: self.fb_docs]
+        return [(r.node.node_id, 1.0) for r in neighbors]
+
+    def rewrite(self, query: str) -> list[str]:
+        # as buscas de feedback ficam fora da etapa "rewrite": BM25 e Dense já marcam
+        # as suas (bm25, dense_search) e não podem ser contadas duas vezes
+        feedback = self.bm25.retrieve(query)[: self.fb_docs]
+        docs = [(r.node.node_id, max(float(r.score or 0.0), 0.0)) for r in feedback]
+        dense_docs = self._centroid_docs([cid for cid, _ in docs]) if self.dense is not None else None
+        with timing.stage("rewrite"):
+            return self._rewrite(query, docs, dense_docs)
+
+    def _rewrite(
+        self, query: str, docs: list[tuple[str, float]], dense_docs: list[tuple[str, float]] | None
+    ) -> list[str]:
+        exclude = set(self.bm25.tokenize(query))
+
+        n_rm3 = self.n - 1 if dense_docs is not None else self.n
+        terms = self._expansion_terms(docs, exclude)
+        slices = [terms[i * self.fb_terms : (i + 1) * self.fb_terms] for i in range(n_rm3)]
+        if dense_docs is not None:
+            slices.append(self._expansion_terms(dense_docs, exclude)[: self.fb_terms])
+
+        variations = []
+        for expansion in slices:
+            variation = " ".join([query] + expansion)
+            if expansion and variation not in variations:
+                variations.append(variation)
         return variations[: self.n]
-    
+
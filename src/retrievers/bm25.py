@@ -1,38 +1,268 @@
 from pathlib import Path
-from llama_index.core.schema import TextNode
+import sys
+import time
+from llama_index.core.schema import MetadataMode, NodeWithScore, TextNode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
 import Stemmer
 from llama_index.retrievers.bm25 import BM25Retriever as bm25_retriever
-from build_corpus import clean_text
+from build_corpus import clean_text, stop_set
+from corpus_diff import ChunkDiff
+from retrievers.bm25_sparse import NPZ_NAME, SparseBM25, Tokenizer
+from retrievers.bm25_stopwords import stopwords_for
+from retrievers.memo import copy_result
+from utils import timing
+from utils.cache import sha256_file, fingerprint, read_manifest, write_manifest
+
+MANIFEST_NAME = "manifest.json"
+# native: SparseBM25 (CSR + NumPy, em persist_dir/native); llama: BM25Retriever da llama-index (bm25s)
+ENGINES = ("native", "llama")
+
+
+def bm25_fingerprint(
+    chunks_path: Path, text_field: str = "text_lex", language: str = "portuguese", expansions_path: Path | None = None
+) -> str:
+    """
+    Chave do cache do índice BM25: conteúdo do chunks.jsonl + campo de texto
+    + idioma do stemmer + conjuntos de stopwords (limpeza e tokenizador)
+    (+ expansions.jsonl, no campo text_exp).
+    """
+    payload = {
+        "chunks_sha256": sha256_file(chunks_path),
+        "text_field": text_field,
+        "language": language,
+        "stopwords": sorted(stop_set),
+        "tokenizer_stopwords": sorted(stopwords_for(language)),
+    }
+    if expansions_path is not None:
+        payload["expansions_sha256"] = sha256_file(expansions_path)
+    return fingerprint(payload)
+
 
 class BM25Retriever:
+    """
+    Retriever léxico sobre text_lex. Interface: retrieve(query) -> list[NodeWithScore]
+    e retrieve_many(queries) -> list[list[NodeWithScore]].
+
+    engine="native" usa o SparseBM25 deste projeto (mesma tokenização e fórmula do
+    bm25s, busca vetorizada direto no top_k); engine="llama" usa o wrapper da
+    llama-index, que busca top_n candidatos e corta em top_k.
+
+    Se o cache_key não bate com o manifest (corpus mudou) e um ChunkDiff for passado
+    (diff), o índice salvo é carregado e atualizado com apply_delta em vez de
+    reconstruído, desde que tenha sido feito com o mesmo tokenizador; se o diff não
+    descreve a versão do índice, apply_delta reconstrói.
+    """
+
     def __init__(
         self,
         nodes: list[TextNode],
         persist_dir: Path,
         top_k: int,
         top_n: int = 50,
+        language: str = "portuguese",
+        cache_key: str | None = None,
+        engine: str = "native",
+        name: str | None = None,
+        diff: ChunkDiff | None = None,
     ):
+        if engine not in ENGINES:
+            raise ValueError(f"engine inválido: {engine!r} (use um de {ENGINES})")
         self.top_k = top_k
         self.top_n = top_n
+        # nome usado nos relatórios (ex.: BM25ExpRetriever para o índice do text_exp)
+        self.name = name or self.__class__.__name__
+        self.cache_key = cache_key
+        self.engine = engine
+        # cada engine tem o seu diretório (e manifest), então os dois caches convivem
+        self.persist_dir = persist_dir / "native" if engine == "native" else persist_dir
+        self.language = language
 
-        persist_dir.mkdir(parents=True, exist_ok=True)
+        self.persist_dir.mkdir(parents=True, exist_ok=True)
+        stemmer = Stemmer.Stemmer(language)
+        self._stemmer = stemmer
+        self._tokenizer = Tokenizer(stemmer, language)
 
-        # Cria um novo índice BM25
-        stemmer = Stemmer.Stemmer("portuguese")
+        t0 = time.perf_counter()
+        manifest = read_manifest(self.persist_dir / MANIFEST_NAME)
+        self.from_cache = cache_key is not None and manifest is not None and manifest.get("fingerprint") == cache_key
+
+        # índice salvo de outra versão do corpus, mas com o mesmo tokenizador: o diff vale para ele
+        delta = (
+            not self.from_cache
+            and diff is not None
+            and manifest is not None
+            and manifest.get("tokenizer") == self._tokenizer_fingerprint()
+        )
+        origin = "construído"
+        if self.from_cache:
+            # mesmo corpus/config: só carrega o índice salvo
+            self._load()
+            origin = "carregado do cache"
+        elif delta and self._load_or_none():
+            # corpus mudou: aplica o diff no índice salvo
+            rebuilt = self.apply_delta(diff, nodes, cache_key)
+            origin = "construído (diff não corresponde ao índice)" if rebuilt else "atualizado pelo diff"
+        else:
+            self._build(nodes)
+        self._set_nodes(nodes)
 
-        self._retriever = bm25_retriever.from_defaults(
-            nodes=nodes,
-            similarity_top_k=self.top_n,
-            stemmer=stemmer,
-            language="portuguese",
+        self.startup_seconds = time.perf_counter() - t0
+        print(
+            f"[BM25Retriever] índice ({engine}) {origin} em {self.startup_seconds * 1000:.1f} ms",
+            file=sys.stderr,
         )
+
+    def _tokenizer_fingerprint(self) -> str:
+        """Config que muda os termos do índice (idioma e stopwords), gravada no manifest."""
+        return fingerprint(
+            {
+                "language": self.language,
+                "stopwords": sorted(stop_set),
+                "tokenizer_stopwords": sorted(stopwords_for(self.language)),
+            }
+        )
+
+    def _load(self):
+        if self.engine == "native":
+            self._index = SparseBM25.load(self.persist_dir / NPZ_NAME)
+        else:
+            self._retriever = bm25_retriever.from_persist_dir(str(self.persist_dir))
+            # o stemmer não é persistido pela llama-index
+            self._retriever.stemmer = self._stemmer
+            self._retriever.similarity_top_k = min(self.top_n, len(self._retriever.corpus))
+
+    def _load_or_none(self) -> bool:
+        """_load para o caminho do diff: índice ausente ou corrompido só leva a reconstruir."""
+        try:
+            self._load()
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[BM25Retriever] aviso: índice salvo ilegível ({e}); reconstruindo", file=sys.stderr)
+            return False
+
+    def _set_nodes(self, nodes: list[TextNode]):
+        if self.engine == "native":
+            # nó de cada linha do índice
+            nodes_by_id = {n.node_id: n for n in nodes}
+            self._row_nodes = [nodes_by_id.get(cid) for cid in self._index.ids]
+
+    def _tokenize(self, node: TextNode) -> list[str]:
+        return self._tokenizer(node.get_content(metadata_mode=MetadataMode.EMBED))
+
+    def _build(self, nodes: list[TextNode]):
+        # manifest antigo deixa de valer enquanto o índice é reconstruído
+        (self.persist_dir / MANIFEST_NAME).unlink(missing_ok=True)
+        # Cria um novo índice BM25
+        if self.engine == "native":
+            self._index = SparseBM25.build([n.node_id for n in nodes], (self._tokenize(n) for n in nodes))
+        else:
+            self._retriever = bm25_retriever.from_defaults(
+                nodes=nodes,
+                similarity_top_k=self.top_n,
+                stemmer=self._stemmer,
+                language=self.language,
+            )
         # salva o índice para persistência
-        self._retriever.persist(str(persist_dir))
+        self._persist()
+
+    def _persist(self):
+        if self.engine == "native":
+            self._index.save(self.persist_dir / NPZ_NAME)
+            n_nodes = self._index.n_docs
+        else:
+            self._retriever.persist(str(self.persist_dir))
+            n_nodes = len(self._retriever.corpus)
+        if self.cache_key is not None:
+            write_manifest(
+                self.persist_dir / MANIFEST_NAME,
+                {
+                    "fingerprint": self.cache_key,
+                    "engine": self.engine,
+                    "language": self.language,
+                    "tokenizer": self._tokenizer_fingerprint(),
+                    "n_nodes": n_nodes,
+                },
+            )
+
+    def apply_delta(self, diff: ChunkDiff, nodes: list[TextNode], cache_key: str | None = None) -> bool:
+        """
+        Atualiza o índice para a nova versão do corpus (nodes, na ordem final) descrita por diff.
+        Retorna True se o índice foi reconstruído do zero.
+
+        native: reaproveita as frequências dos chunks mantidos/renomeados e tokeniza só
+        os novos ou com text_lex alterado; IDF e tamanho médio são recalculados.
+        llama: o bm25s só guarda scores prontos e IDF/tamanho médio são globais, então
+        adição, remoção ou mudança de text_lex refaz o índice; renomeações e mudanças só
+        em text_raw/metadata trocam a entrada do corpus na mesma posição.
+        """
+        self.cache_key = cache_key
+        (self.persist_dir / MANIFEST_NAME).unlink(missing_ok=True)
+        rebuild = self._apply_native_delta(diff, nodes) if self.engine == "native" else self._apply_llama_delta(diff, nodes)
+        if rebuild:
+            self._build(nodes)
+        else:
+            self._persist()
+        self._set_nodes(nodes)
+        return rebuild
+
+    def _apply_native_delta(self, diff: ChunkDiff, nodes: list[TextNode]) -> bool:
+        index = self._index
+        node_ids = {n.node_id for n in nodes}
+        if any(cid not in node_ids and cid not in diff.renamed and cid not in diff.removed for cid in index.ids):
+            # índice não corresponde ao diff
+            return True
+
+        row_of = {cid: i for i, cid in enumerate(index.ids)}
+        source = {new_id: old_id for old_id, new_id in diff.renamed.items()}
+        rows, token_lists = [], {}
+        for i, node in enumerate(nodes):
+            cid = node.node_id
+            row = row_of.get(source.get(cid, cid))
+            if row is None or "text_lex" in diff.changed.get(cid, ()):
+                row = None
+                token_lists[i] = self._tokenize(node)
+            rows.append(row)
+        self._index = index.update([n.node_id for n in nodes], rows, token_lists)
+        return False
+
+    def _apply_llama_delta(self, diff: ChunkDiff, nodes: list[TextNode]) -> bool:
+        if diff.added or diff.removed or any("text_lex" in fields for fields in diff.changed.values()):
+            return True
+        nodes_by_id = {n.node_id: n for n in nodes}
+        corpus = []
+        for entry in self._retriever.corpus:
+            node = nodes_by_id.get(diff.renamed.get(entry["node_id"], entry["node_id"]))
+            if node is None:
+                # índice não corresponde ao diff
+                return True
+            corpus.append(node_to_metadata_dict(node) | {"node_id": node.node_id})
+        self._retriever.corpus = corpus
+        return False
+
+    def _results(self, scores, rows) -> list[NodeWithScore]:
+        results = []
+        for score, i in zip(scores, rows):
+            node = self._row_nodes[i]
+            if node is not None:
+                # cópia: quem chama (Hybrid/FusionAgent) altera score e metadata
+                results.append(copy_result(NodeWithScore(node=node, score=float(score))))
+        return results
 
+    def tokenize(self, text: str) -> list[str]:
+        """Termos de um texto como o BM25 os vê (clean_text + tokenização do engine native)."""
+        return self._tokenizer(clean_text(text))
 
     def retrieve(self, query: str):
-        query = clean_text(query)
-        candidates = self._retriever.retrieve(query)[: self.top_n]
-        return candidates[: self.top_k]   
+        with timing.stage("bm25"):
+            if self.engine == "native":
+                return self._results(*self._index.search(self.tokenize(query), self.top_k))
+            candidates = self._retriever.retrieve(clean_text(query))[: self.top_n]
+            return candidates[: self.top_k]
 
-    
\ No newline at end of file
+    def retrieve_many(self, queries: list[str]) -> list[list[NodeWithScore]]:
+        """retrieve para várias queries; no engine native os scores saem de uma única passada em lote."""
+        if self.engine != "native":
+            return [self.retrieve(q) for q in queries]
+        with timing.stage("bm25"):
+            token_lists = [self.tokenize(q) for q in queries]
+            return [self._results(scores, rows) for scores, rows in self._index.search_many(token_lists, self.top_k)]
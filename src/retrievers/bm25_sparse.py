@@ -0,0 +1,256 @@
+import re
+from array import array
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+
+from retrievers.bm25_stopwords import stopwords_for
+
+# mesmo tokenizador do bm25s (padrão do CountVectorizer do scikit-learn)
+TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+
+# npz salvo com np.savez; ver SparseBM25.save
+NPZ_NAME = "index.npz"
+# documentos convertidos para CSR por vez no build (limita a memória temporária)
+BUILD_BLOCK_DOCS = 8192
+
+
+class Tokenizer:
+    """
+    Tokenização igual à do bm25s usado pela llama-index: lowercase, regex de tokens,
+    stopwords do idioma e stemming. Os stems ficam em cache por token.
+    """
+
+    def __init__(self, stemmer, language: str = "portuguese"):
+        self.stemmer = stemmer
+        self.stopwords = frozenset(stopwords_for(language))
+        self._stems: dict[str, str] = {}
+
+    def __call__(self, text: str) -> list[str]:
+        tokens = [t for t in TOKEN_RE.findall(text.lower()) if t not in self.stopwords]
+        stems = self._stems
+        missing = [t for t in set(tokens) if t not in stems]
+        if missing:
+            stems.update(zip(missing, self.stemmer.stemWords(missing)))
+        return [stems[t] for t in tokens]
+
+
+class SparseBM25:
+    """
+    BM25 (variante lucene do bm25s: k1=1.5, b=0.75) sobre um índice invertido em CSR.
+
+    Guarda duas visões dos mesmos dados:
+    - por documento (doc_indptr, doc_terms, doc_tf): frequências brutas, usadas para
+      adicionar/remover documentos sem retokenizar o resto do corpus;
+    - por termo (term_indptr, post_docs, post_weights): posting lists com o peso BM25
+      já calculado, usadas na busca.
+
+    O score de uma query é a soma dos pesos das posting lists dos seus termos
+    (termos repetidos contam de novo, como no bm25s); o top-k sai de argpartition,
+    com desempate pelo índice do documento.
+    """
+
+    def __init__(
+        self,
+        ids: list[str],
+        vocab: list[str],
+        doc_indptr: np.ndarray,
+        doc_terms: np.ndarray,
+        doc_tf: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+        postings: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None,
+    ):
+        self.ids = list(ids)
+        self.vocab = list(vocab)
+        self.term_id = {t: i for i, t in enumerate(self.vocab)}
+        self.doc_indptr = doc_indptr
+        self.doc_terms = doc_terms
+        self.doc_tf = doc_tf
+        self.k1 = k1
+        self.b = b
+        if postings is None:
+            postings = self._build_postings()
+        self.term_indptr, self.post_docs, self.post_weights = postings
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids: list[str], token_lists: Iterable[list[str]], k1: float = 1.5, b: float = 0.75) -> "SparseBM25":
+        """
+        token_lists pode ser um gerador: os documentos são consumidos em blocos de
+        BUILD_BLOCK_DOCS, sem manter os tokens do corpus inteiro em memória.
+        """
+        vocab: dict[str, int] = {}
+        blocks = []
+        flat, lengths = array("i"), array("q")
+        for tokens in token_lists:
+            flat.extend(vocab.setdefault(t, len(vocab)) for t in tokens)
+            lengths.append(len(tokens))
+            if len(lengths) == BUILD_BLOCK_DOCS:
+                blocks.append(_doc_csr(flat, lengths, len(vocab)))
+                flat, lengths = array("i"), array("q")
+        if lengths or not blocks:
+            blocks.append(_doc_csr(flat, lengths, len(vocab)))
+        doc_indptr, doc_terms, doc_tf = _concat_csr(blocks)
+        return cls(ids, list(vocab), doc_indptr, doc_terms, doc_tf, k1=k1, b=b)
+
+    def _build_postings(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        n_docs, n_terms = self.n_docs, len(self.vocab)
+        doc_of = np.repeat(np.arange(n_docs, dtype=np.int32), np.diff(self.doc_indptr))
+
+        # tamanho do documento = número de tokens (com repetição)
+        doc_len = np.bincount(doc_of, weights=self.doc_tf, minlength=n_docs)
+        avg_len = doc_len.mean() if n_docs else 1.0
+        df = np.bincount(self.doc_terms, minlength=n_terms)
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+        # pesos calculados em float64 (como no bm25s) e guardados em float32, por blocos de entradas
+        weights = np.empty(len(self.doc_terms), dtype=np.float32)
+        step = BUILD_BLOCK_DOCS * 128
+        for s in range(0, len(weights), step):
+            e = s + step
+            tf = self.doc_tf[s:e].astype(np.float64)
+            norm = self.k1 * ((1 - self.b) + self.b * doc_len[doc_of[s:e]] / avg_len)
+            weights[s:e] = idf[self.doc_terms[s:e]] * (tf / (norm + tf))
+
+        order = np.argsort(self.doc_terms, kind="stable")
+        term_indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=term_indptr[1:])
+        return term_indptr, doc_of[order], weights[order]
+
+    def query_terms(self, tokens: list[str]) -> np.ndarray:
+        return np.array([self.term_id[t] for t in tokens if t in self.term_id], dtype=np.int64)
+
+    def _gather(self, terms: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Posições das posting lists de terms concatenadas: (início, tamanho, índices no post_*)."""
+        starts = self.term_indptr[terms]
+        lengths = self.term_indptr[terms + 1] - starts
+        total = int(lengths.sum())
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return starts, lengths, offsets
+
+    def scores(self, terms: np.ndarray) -> np.ndarray:
+        _, _, pos = self._gather(terms)
+        return np.bincount(self.post_docs[pos], weights=self.post_weights[pos], minlength=self.n_docs)
+
+    def scores_many(self, terms_list: list[np.ndarray]) -> np.ndarray:
+        """Matriz (queries, docs) de scores em uma única passada pelas posting lists."""
+        n = self.n_docs
+        terms = np.concatenate(terms_list) if terms_list else np.empty(0, dtype=np.int64)
+        query_of = np.repeat(np.arange(len(terms_list)), [len(t) for t in terms_list])
+        _, lengths, pos = self._gather(terms)
+        flat = np.repeat(query_of, lengths) * n + self.post_docs[pos]
+        out = np.bincount(flat, weights=self.post_weights[pos], minlength=len(terms_list) * n)
+        return out.reshape(len(terms_list), n)
+
+    def top_k(self, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        k = min(k, scores.shape[-1])
+        if k <= 0:
+            return np.empty(0, dtype=scores.dtype), np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return scores[top], top
+
+    def search(self, tokens: list[str], k: int) -> tuple[np.ndarray, np.ndarray]:
+        return self.top_k(self.scores(self.query_terms(tokens)), k)
+
+    def search_many(self, token_lists: list[list[str]], k: int, block_size: int = 4_000_000) -> list[tuple[np.ndarray, np.ndarray]]:
+        """search para várias queries; a matriz de scores é montada em blocos de ~block_size células."""
+        terms_list = [self.query_terms(tokens) for tokens in token_lists]
+        rows_per_block = max(1, block_size // max(self.n_docs, 1))
+        results = []
+        for start in range(0, len(terms_list), rows_per_block):
+            block = self.scores_many(terms_list[start : start + rows_per_block])
+            results.extend(self.top_k(row, k) for row in block)
+        return results
+
+    def update(self, ids: list[str], rows: list[int | None], token_lists: dict[int, list[str]]) -> "SparseBM25":
+        """
+        Nova versão do índice com os documentos ids, na ordem dada.
+        rows[i] é a linha deste índice reaproveitada para ids[i] (None = documento novo,
+        tokenizado em token_lists[i]). IDF e tamanho médio são recalculados, sem retokenizar
+        os documentos reaproveitados.
+        """
+        vocab = dict(self.term_id)
+        nnz = np.diff(self.doc_indptr)
+        term_parts, tf_parts, new_nnz = [], [], []
+        for i, row in enumerate(rows):
+            if row is not None:
+                s, e = self.doc_indptr[row], self.doc_indptr[row + 1]
+                term_parts.append(self.doc_terms[s:e])
+                tf_parts.append(self.doc_tf[s:e])
+                new_nnz.append(nnz[row])
+            else:
+                term_ids = array("i", [vocab.setdefault(t, len(vocab)) for t in token_lists[i]])
+                _, terms, tf = _doc_csr(term_ids, array("q", [len(term_ids)]), len(vocab))
+                term_parts.append(terms)
+                tf_parts.append(tf)
+                new_nnz.append(len(terms))
+
+        doc_indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(new_nnz, out=doc_indptr[1:])
+        doc_terms = np.concatenate(term_parts).astype(np.int32) if term_parts else np.empty(0, dtype=np.int32)
+        doc_tf = np.concatenate(tf_parts).astype(np.int32) if tf_parts else np.empty(0, dtype=np.int32)
+        return SparseBM25(ids, list(vocab), doc_indptr, doc_terms, doc_tf, k1=self.k1, b=self.b)
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            ids=np.array(self.ids, dtype=str),
+            vocab=np.array(self.vocab, dtype=str),
+            doc_indptr=self.doc_indptr,
+            doc_terms=self.doc_terms,
+            doc_tf=self.doc_tf,
+            term_indptr=self.term_indptr,
+            post_docs=self.post_docs,
+            post_weights=self.post_weights,
+            params=np.array([self.k1, self.b]),
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "SparseBM25":
+        with np.load(path) as z:
+            k1, b = z["params"].tolist()
+            return cls(
+                ids=z["ids"].tolist(),
+                vocab=z["vocab"].tolist(),
+                doc_indptr=z["doc_indptr"],
+                doc_terms=z["doc_terms"],
+                doc_tf=z["doc_tf"],
+                k1=k1,
+                b=b,
+                postings=(z["term_indptr"], z["post_docs"], z["post_weights"]),
+            )
+
+
+def _doc_csr(flat: array, lengths: array, n_terms: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (doc_indptr, termos, tf) dos documentos cujos term ids estão concatenados em flat
+    (lengths[i] ids do documento i), com os termos de cada documento ordenados.
+    """
+    flat = np.frombuffer(flat, dtype=np.int32).astype(np.int64) if len(flat) else np.empty(0, dtype=np.int64)
+    lengths = np.frombuffer(lengths, dtype=np.int64) if len(lengths) else np.empty(0, dtype=np.int64)
+    n_terms = max(n_terms, 1)
+    doc_of = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    keys, tf = np.unique(doc_of * n_terms + flat, return_counts=True)
+    docs = keys // n_terms
+    doc_indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(docs, minlength=len(lengths)), out=doc_indptr[1:])
+    return doc_indptr, (keys % n_terms).astype(np.int32), tf.astype(np.int32)
+
+
+def _concat_csr(blocks: list[tuple[np.ndarray, np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Junta os CSR de blocos consecutivos de documentos em um só."""
+    if len(blocks) == 1:
+        return blocks[0]
+    nnz = np.concatenate([np.diff(indptr) for indptr, _, _ in blocks])
+    doc_indptr = np.zeros(len(nnz) + 1, dtype=np.int64)
+    np.cumsum(nnz, out=doc_indptr[1:])
+    return doc_indptr, np.concatenate([t for _, t, _ in blocks]), np.concatenate([tf for _, _, tf in blocks])
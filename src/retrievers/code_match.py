@@ -0,0 +1,92 @@
+import threading
+
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from code_index import CodeIndex
+from retrievers.memo import copy_result
+
+MODES = ("shortcut", "boost")
+
+
+class CodeMatchRetriever:
+    """
+    Caminho rápido para queries que citam um código da BNCC (ex.: EM13MAT303).
+
+    Envolve um retriever e consulta o CodeIndex antes dele:
+    - mode="shortcut": se a query cita um código conhecido, devolve direto os chunks
+      do índice (definições primeiro, depois menções) e não chama o retriever. O
+      FusionAgent também pula a reescrita dessas queries (ver match).
+    - mode="boost": roda o retriever normalmente e coloca os chunks do código no
+      topo do ranking, sem repetir.
+    Queries sem código (ou com código fora do índice) vão ao retriever como antes.
+
+    Score dos chunks do índice: 1.0 para definição, 0.5 para menção; no máximo top_k
+    (o do retriever original) chunks por query.
+    Os demais atributos (top_k, etc.) são repassados ao retriever original.
+    """
+
+    def __init__(
+        self, retriever, index: CodeIndex, nodes: list[TextNode], mode: str = "shortcut", name: str | None = None
+    ):
+        if mode not in MODES:
+            raise ValueError(f"mode inválido: {mode!r} (use um de {MODES})")
+        self.retriever = retriever
+        self.index = index
+        self.mode = mode
+        self._nodes = {node.node_id: node for node in nodes}
+        # nome usado nos relatórios (padrão: o do retriever original)
+        self.name = name or getattr(retriever, "name", retriever.__class__.__name__)
+        # queries respondidas (shortcut) ou reordenadas (boost) pelo índice
+        self._lock = threading.Lock()
+        self.matched = 0
+
+    def __getattr__(self, attr):
+        return getattr(self.retriever, attr)
+
+    def _code_results(self, query: str) -> list[NodeWithScore]:
+        # cópias: Hybrid, FusionAgent e memo escrevem no metadata dos resultados,
+        # e os nodes são compartilhados entre queries e threads
+        results = [
+            copy_result(NodeWithScore(node=self._nodes[cid], score=1.0 if is_definition else 0.5))
+            for cid, _, is_definition in self.index.lookup(query)
+            if cid in self._nodes
+        ]
+        top_k = getattr(self.retriever, "top_k", None)
+        if top_k:
+            results = results[:top_k]
+        if results:
+            with self._lock:
+                self.matched += 1
+        return results
+
+    def match(self, query: str) -> list[NodeWithScore] | None:
+        """Resultado do caminho rápido (mode="shortcut"); None se a query tem que ir ao retriever."""
+        if self.mode != "shortcut":
+            return None
+        return self._code_results(query) or None
+
+    def _boost(self, code_results: list[NodeWithScore], results: list):
+        if not code_results:
+            return results
+        top_k = getattr(self.retriever, "top_k", None) or len(results)
+        seen = {r.node.node_id for r in code_results}
+        return (code_results + [r for r in results if r.node.node_id not in seen])[:top_k]
+
+    def retrieve(self, query: str):
+        code_results = self._code_results(query)
+        if self.mode == "shortcut" and code_results:
+            return code_results
+        return self._boost(code_results, self.retriever.retrieve(query))
+
+    def retrieve_many(self, queries: list[str]):
+        code_results = [self._code_results(q) for q in queries]
+        if self.mode == "shortcut":
+            # só as queries sem código vão ao retriever, em um lote
+            missing = [q for q, c in zip(queries, code_results) if not c]
+            fetched = iter(self.retriever.retrieve_many(missing) if missing else [])
+            return [c if c else next(fetched) for c in code_results]
+        batch = self.retriever.retrieve_many(queries)
+        return [self._boost(c, results) for c, results in zip(code_results, batch)]
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "matched": self.matched, "codes": len(self.index)}
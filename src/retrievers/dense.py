@@ -1,16 +1,58 @@
 from pathlib import Path
-import faiss
+import time
 from llama_index.core import Settings, StorageContext, VectorStoreIndex, load_index_from_storage
 from llama_index.vector_stores.faiss import FaissVectorStore
 from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.core.schema import TextNode
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import MetadataMode, TextNode, QueryBundle, NodeWithScore
 import sys
+import numpy as np
+from utils import timing
+from utils.cache import DiskCache, fingerprint, normalize_text
+from retrievers.faiss_index import (
+    EXACT_TYPES,
+    INDEX_TYPES,
+    build_faiss_index,
+    index_type_of,
+    reconstruct_all,
+    set_search_params,
+)
+from retrievers.embedding_matrix import EmbeddingMatrix, nodes_fingerprint
+from retrievers.memo import copy_result
+from corpus_diff import ChunkDiff
+
+
+def embeddable_ids(nodes: list[TextNode]) -> list[str]:
+    """ids dos nós que entram no índice (a llama-index ignora nós sem conteúdo)."""
+    return [n.node_id for n in nodes if n.get_content(metadata_mode=MetadataMode.EMBED) != ""]
 
 
 class DenseRetriever:
     """
     Retriever denso (embeddings OpenAI) + índice FAISS com persistência.
-    Interface: retrieve(query) -> list[NodeWithScore]
+    Interface: retrieve(query) -> list[NodeWithScore] e
+    retrieve_many(queries) -> list[list[NodeWithScore]] (uma chamada de embeddings
+    para as queries fora do cache e uma busca FAISS/matriz em lote).
+
+    Se um DiskCache for passado, os embeddings das queries ficam em disco,
+    chaveados por (modelo, dimensions, texto normalizado).
+
+    index_type escolhe o índice FAISS (ver retrievers/faiss_index.py). O índice
+    persistido é sempre exato (flat_l2/flat_ip); HNSW e IVF são construídos em
+    memória a partir dos vetores dele, sem reembeddar o corpus.
+
+    use_mmap=True troca o docstore/índice da llama-index por uma EmbeddingMatrix
+    (vectors.npy com mmap + ids + manifest em persist_dir/matrix_<dtype>): a inicialização
+    não parseia os JSONs do docstore e processos no mesmo host compartilham os vetores.
+    Na primeira vez a matriz é exportada do índice persistido. Se o corpus mudou e
+    um ChunkDiff for passado (diff), a matriz é atualizada com apply_delta: só os
+    textos novos são embeddados. Se o diff não descreve a versão da matriz (ex.:
+    build_corpus.py rodou duas vezes) ou a matriz exportada é de outro corpus, ela
+    é realinhada aos nodes (realign); os ids da matriz sempre batem com os nodes.
+
+    embed_model troca o OpenAIEmbedding por outro BaseEmbedding (ex.: o embedder
+    local determinístico do bench_scale.py); embedding_model continua sendo o nome
+    usado nas chaves do cache e no manifest da matriz.
     """
 
     def __init__(
@@ -20,14 +62,63 @@ class DenseRetriever:
         top_k: int,
         embedding_model: str = "text-embedding-3-small",
         dimensions: int | None = None,
+        cache: DiskCache | None = None,
+        index_type: str = "flat_l2",
+        ef_search: int | None = None,
+        nprobe: int | None = None,
+        index_params: dict | None = None,
+        use_mmap: bool = False,
+        mmap_dtype: str = "float32",
+        diff: ChunkDiff | None = None,
+        embed_model: BaseEmbedding | None = None,
     ):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"index_type inválido: {index_type!r} (use um de {INDEX_TYPES})")
         self.top_k = top_k
+        self.index_type = index_type
+        self.embedding_model = embedding_model
+        self.dimensions = dimensions
+        self.cache = cache
+        self._ann_params = (index_params or {}, ef_search, nprobe)
         persist_dir.mkdir(parents=True, exist_ok=True)
 
         # embeddings OpenAI
-        embed_model = OpenAIEmbedding(model=embedding_model, dimensions=dimensions)
+        if embed_model is None:
+            embed_model = OpenAIEmbedding(model=embedding_model, dimensions=dimensions)
         Settings.embed_model = embed_model
+        self._embed_model = embed_model
+
+        t0 = time.perf_counter()
+        self._matrix = None
+        self._matrix_index = None
+        # (matriz, chunk_id -> linha), refeito quando a matriz muda (ver _rows)
+        self._row_cache = None
+        self.build_seconds = 0.0
+        if use_mmap:
+            self._open_matrix(nodes, persist_dir, mmap_dtype, diff)
+            self._build_matrix_index()
+        else:
+            self._load_index(nodes, persist_dir, index_type)
+
+            # troca o índice exato pelo tipo pedido (mesma ordem de ids, então o docstore continua válido)
+            vector_store = self._vector_store
+            if index_type_of(vector_store.client) != index_type:
+                t1 = time.perf_counter()
+                vectors = reconstruct_all(vector_store.client)
+                vector_store._faiss_index = build_faiss_index(index_type, vectors.shape[1], vectors, **(index_params or {}))
+                self.build_seconds = time.perf_counter() - t1
+            set_search_params(vector_store.client, ef_search=ef_search, nprobe=nprobe)
+
+            self._retriever = self._index.as_retriever(similarity_top_k=top_k)
+
+        self.startup_seconds = time.perf_counter() - t0
+        origin = "matriz mmap" if use_mmap else "llama-index"
+        print(
+            f"[DenseRetriever] índice ({origin}, {index_type}) pronto em {self.startup_seconds * 1000:.1f} ms",
+            file=sys.stderr,
+        )
 
+    def _load_index(self, nodes: list[TextNode], persist_dir: Path, index_type: str):
         # carregando ou criando o índice FAISS
         has_index = (persist_dir / "docstore.json").exists() and (persist_dir / "index_store.json").exists()
         if has_index:
@@ -38,18 +129,297 @@ class DenseRetriever:
             )
             self._index = load_index_from_storage(storage_context)
         else:
-            dim = len(embed_model.get_text_embedding("teste"))
-            faiss_index = faiss.IndexFlatL2(dim)
+            dim = len(self._embed_model.get_text_embedding("teste"))
+            faiss_index = build_faiss_index(index_type if index_type in EXACT_TYPES else "flat_l2", dim)
             vector_store = FaissVectorStore(faiss_index=faiss_index)
             storage_context = StorageContext.from_defaults(vector_store=vector_store)
             self._index = VectorStoreIndex(nodes=nodes, storage_context=storage_context, show_progress=True)
             self._index.storage_context.persist(persist_dir=str(persist_dir))
+        self._vector_store = vector_store
+
+    def _build_matrix_index(self):
+        if self.index_type in EXACT_TYPES:
+            self._matrix_index = None
+            return
+        # índice aproximado construído a partir da matriz (linha i = id FAISS i)
+        index_params, ef_search, nprobe = self._ann_params
+        t1 = time.perf_counter()
+        vectors = np.ascontiguousarray(self._matrix.vectors, dtype=np.float32)
+        self._matrix_index = build_faiss_index(self.index_type, vectors.shape[1], vectors, **index_params)
+        set_search_params(self._matrix_index, ef_search=ef_search, nprobe=nprobe)
+        self.build_seconds = time.perf_counter() - t1
+
+    def _open_matrix(self, nodes: list[TextNode], persist_dir: Path, dtype: str, diff: ChunkDiff | None = None):
+        matrix_dir = persist_dir / f"matrix_{dtype}"
+        self._matrix_dir = matrix_dir
+        expected = {
+            "model": self.embedding_model,
+            "dimensions": self.dimensions,
+            "corpus": nodes_fingerprint(nodes),
+            "dtype": dtype,
+        }
+        matrix = EmbeddingMatrix.load(matrix_dir)
+        same_model = matrix is not None and all(matrix.manifest.get(k) == expected[k] for k in ("model", "dimensions", "dtype"))
+        if same_model and matrix.manifest.get("corpus") != expected["corpus"]:
+            # corpus mudou: aplica o diff na matriz atual em vez de reexportar tudo;
+            # sem diff, ou se ele não descreve essa transição, realinha pelos chunk_ids
+            self._matrix = matrix
+            if diff is None or not self._try_delta(matrix, diff, nodes):
+                self.realign(nodes)
+            return
+        if matrix is None or any(matrix.manifest.get(k) != v for k, v in expected.items()):
+            # exporta do índice da llama-index (criado agora se não existir)
+            self._matrix = None
+            self._load_index(nodes, persist_dir, "flat_l2")
+            vectors = reconstruct_all(self._vector_store.client)
+            ids = self.node_ids
+            meta = {k: v for k, v in expected.items() if k != "dtype"}
+            # índice persistido de uma versão anterior do corpus (ids antigos ou chunks faltando)
+            stale = set(ids) != set(embeddable_ids(nodes))
+            if stale:
+                meta["corpus"] = None
+            EmbeddingMatrix.save(matrix_dir, vectors, ids, meta, dtype=dtype)
+            matrix = EmbeddingMatrix.load(matrix_dir)
+            if stale:
+                # nunca serve uma matriz cujos ids não batem com nodes
+                self._matrix = matrix
+                if diff is None or not self._try_delta(matrix, diff, nodes):
+                    self.realign(nodes)
+                return
+
+        nodes_by_id = {n.node_id: n for n in nodes}
+        self._matrix = matrix
+        self._matrix_nodes = [nodes_by_id.get(cid) for cid in matrix.ids]
+
+    def _try_delta(self, matrix: EmbeddingMatrix, diff: ChunkDiff, nodes: list[TextNode]) -> bool:
+        self._matrix = matrix
+        try:
+            self.apply_delta(diff, nodes)
+            return True
+        except ValueError as e:
+            print(f"[DenseRetriever] aviso: {e}; realinhando a matriz pelos chunk_ids", file=sys.stderr)
+            return False
+
+    def realign(self, nodes: list[TextNode]) -> dict:
+        """
+        Leva a matriz para nodes sem diff: reaproveita o vetor de cada chunk_id que já
+        está na matriz (o id deriva do text_raw) e embedda os demais (pelo cache, se
+        houver). Usado quando chunks_diff.json não descreve a versão da matriz.
+        """
+        if self._matrix is None:
+            raise ValueError("realign requer use_mmap=True")
+        return self._align(nodes, renamed={}, changed=set())
+
+    def apply_delta(self, diff: ChunkDiff, nodes: list[TextNode], text_field: str = "text_raw") -> dict:
+        """
+        Leva a matriz de embeddings para a nova versão do corpus (nodes, na ordem final).
+        Reaproveita o vetor de chunks mantidos e renomeados; só embedda chunks novos
+        ou cujo text_field mudou. Requer use_mmap=True.
+        """
+        if self._matrix is None:
+            raise ValueError("apply_delta requer use_mmap=True")
+        old = self._matrix
+        node_ids = {n.node_id for n in nodes}
+        unknown = [cid for cid in old.ids if cid not in node_ids and cid not in diff.renamed and cid not in diff.removed]
+        if unknown:
+            raise ValueError(f"diff não corresponde à matriz ({len(unknown)} ids da matriz fora do diff)")
+        changed = {cid for cid, fields in diff.changed.items() if text_field in fields}
+        return self._align(nodes, renamed=diff.renamed, changed=changed)
+
+    def _align(self, nodes: list[TextNode], renamed: dict[str, str], changed: set[str]) -> dict:
+        """Nova matriz na ordem de nodes: vetores reaproveitados da atual (por id ou renomeação) ou embeddados."""
+        old = self._matrix
+        row_of = {cid: i for i, cid in enumerate(old.ids)}
+        source = {new_id: old_id for old_id, new_id in renamed.items()}
+        ids, rows, to_embed = [], [], []
+        for node in nodes:
+            text = node.get_content(metadata_mode=MetadataMode.EMBED)
+            # a llama-index também ignora nós sem conteúdo ao indexar
+            if text == "":
+                continue
+            cid = node.node_id
+            row = row_of.get(source.get(cid, cid))
+            ids.append(cid)
+            if row is None or cid in changed:
+                rows.append(None)
+                to_embed.append((len(ids) - 1, text))
+            else:
+                rows.append(row)
+
+        vectors = np.empty((len(ids), old.vectors.shape[1]), dtype=np.float32)
+        for i, row in enumerate(rows):
+            if row is not None:
+                vectors[i] = old.vectors[row]
+        if to_embed:
+            embeddings = self.embed_texts([t for _, t in to_embed])
+            for (i, _), emb in zip(to_embed, embeddings):
+                vectors[i] = emb
+
+        dtype = old.manifest.get("dtype", "float32")
+        meta = {"model": self.embedding_model, "dimensions": self.dimensions, "corpus": nodes_fingerprint(nodes)}
+        EmbeddingMatrix.save(self._matrix_dir, vectors, ids, meta, dtype=dtype)
+        self._matrix = EmbeddingMatrix.load(self._matrix_dir)
+        nodes_by_id = {n.node_id: n for n in nodes}
+        self._matrix_nodes = [nodes_by_id.get(cid) for cid in self._matrix.ids]
+        if self._matrix_index is not None:
+            self._build_matrix_index()
+
+        reused = len(ids) - len(to_embed)
+        stats = {"reused": reused, "embedded": len(to_embed), "dropped": len(old.ids) - reused}
+        print(f"[DenseRetriever] matriz atualizada: {stats}", file=sys.stderr)
+        return stats
 
-        self._retriever = self._index.as_retriever(similarity_top_k=top_k)
+    def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        """Embeddings de textos de chunks; com cache, só os que não estão nele vão à API (em lote)."""
+        if self.cache is None:
+            return self._embed_model.get_text_embedding_batch(texts)
+        keys = [self._embedding_key(text) for text in texts]
+        embeddings = [self.cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(text for text, e in zip(texts, embeddings) if e is None))
+        if missing:
+            fetched = dict(zip(missing, self._embed_model.get_text_embedding_batch(missing)))
+            for text, embedding in fetched.items():
+                self.cache.set(self._embedding_key(text), embedding)
+            embeddings = [e if e is not None else fetched[text] for text, e in zip(texts, embeddings)]
+        return embeddings
+
+    @property
+    def faiss_index(self):
+        return self._vector_store.client
+
+    @property
+    def node_ids(self) -> list[str]:
+        """node_id (chunk_id) de cada id FAISS, na ordem dos vetores."""
+        if self._matrix is not None:
+            return list(self._matrix.ids)
+        nodes_dict = self._index.index_struct.nodes_dict
+        return [nodes_dict[str(i)] for i in range(self.faiss_index.ntotal)]
+
+    def _rows(self) -> dict[str, int]:
+        source = self._matrix if self._matrix is not None else self._index
+        if self._row_cache is None or self._row_cache[0] is not source:
+            self._row_cache = (source, {cid: i for i, cid in enumerate(self.node_ids)})
+        return self._row_cache[1]
+
+    def vectors_of(self, chunk_ids: list[str]) -> np.ndarray:
+        """Vetores do corpus (n, dim) dos chunk_ids pedidos; ids fora do índice são ignorados."""
+        rows = self._rows()
+        idx = [rows[cid] for cid in chunk_ids if cid in rows]
+        if not idx:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if self._matrix is not None:
+            return np.asarray(self._matrix.vectors[idx], dtype=np.float32)
+        return np.stack([self.faiss_index.reconstruct(i) for i in idx]).astype(np.float32)
+
+    def search_vector(self, vector: np.ndarray) -> list[NodeWithScore]:
+        """Top-k do índice para um vetor já pronto (sem embeddar nada)."""
+        queries = np.asarray(vector, dtype=np.float32)[np.newaxis, :]
+        search = self._search_matrix_many if self._matrix is not None else self._search_faiss_many
+        with timing.stage("dense_search"):
+            return search(queries)[0]
+
+    def _embedding_key(self, text: str) -> str:
+        return fingerprint({"model": self.embedding_model, "dimensions": self.dimensions, "text": text})
+
+    def embed_query(self, query: str) -> list[float]:
+        query = normalize_text(query)
+        if self.cache is None:
+            return self._embed_model.get_query_embedding(query)
+
+        key = self._embedding_key(query)
+        embedding, cost_ms = self.cache.get_with_cost(key)
+        if embedding is None:
+            t0 = time.perf_counter()
+            embedding = self._embed_model.get_query_embedding(query)
+            self.cache.set(key, embedding, cost_ms=(time.perf_counter() - t0) * 1000)
+        else:
+            # custo da chamada original (a etapa "embed" de quem leu do cache)
+            timing.charge("embed", cost_ms)
+        return embedding
+
+    def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        """
+        embed_query para várias queries. As que não estão no cache vão juntas em
+        get_text_embedding_batch (uma requisição a cada embed_batch_size textos).
+        Hits cobram o custo gravado; o tempo de um lote é dividido entre os seus textos.
+        """
+        texts = [normalize_text(q) for q in queries]
+        embeddings: list[list[float] | None] = [None] * len(texts)
+        missing: dict[str, list[int]] = {}
+        for i, text in enumerate(texts):
+            embedding, cost_ms = (
+                self.cache.get_with_cost(self._embedding_key(text)) if self.cache is not None else (None, None)
+            )
+            if embedding is None:
+                missing.setdefault(text, []).append(i)
+            else:
+                embeddings[i] = embedding
+                timing.charge("embed", cost_ms)
+        if not missing:
+            return embeddings
+
+        model = self._embed_model
+        t0 = time.perf_counter()
+        if getattr(model, "_query_engine", None) == getattr(model, "_text_engine", None):
+            # text-embedding-3-*: query e documento usam o mesmo modelo, então dá para mandar em lote
+            batch = model.get_text_embedding_batch(list(missing))
+        else:
+            batch = [model.get_query_embedding(text) for text in missing]
+        cost_ms = (time.perf_counter() - t0) * 1000 / len(missing)
+        for text, embedding in zip(missing, batch):
+            if self.cache is not None:
+                self.cache.set(self._embedding_key(text), embedding, cost_ms=cost_ms)
+            for i in missing[text]:
+                embeddings[i] = embedding
+        return embeddings
+
+    def _matrix_results(self, scores, idx) -> list[NodeWithScore]:
+        results = []
+        for score, i in zip(scores, idx):
+            node = self._matrix_nodes[i] if i >= 0 else None
+            if node is None:
+                continue
+            # cópia: quem chama (Hybrid/FusionAgent) altera score e metadata
+            results.append(copy_result(NodeWithScore(node=node, score=float(score))))
+        return results
+
+    def _search_matrix(self, embedding: list[float]) -> list[NodeWithScore]:
+        return self._search_matrix_many(np.asarray(embedding, dtype=np.float32)[np.newaxis, :])[0]
+
+    def _search_matrix_many(self, queries: np.ndarray) -> list[list[NodeWithScore]]:
+        if self._matrix_index is not None:
+            scores, idx = self._matrix_index.search(queries, self.top_k)
+            return [self._matrix_results(s, i) for s, i in zip(scores, idx)]
+        return [self._matrix_results(s, i) for s, i in self._matrix.search_many(queries, self.top_k)]
+
+    def _search_faiss_many(self, queries: np.ndarray) -> list[list[NodeWithScore]]:
+        """Mesmo resultado do retriever da llama-index (score = valor do FAISS), com uma busca só."""
+        dists, indices = self.faiss_index.search(queries, self.top_k)
+        nodes_dict = self._index.index_struct.nodes_dict
+        docstore = self._index.docstore
+        results = []
+        for row_dists, row_idx in zip(dists, indices):
+            ranked = []
+            for dist, i in zip(row_dists, row_idx):
+                node = docstore.get_node(nodes_dict[str(i)], raise_error=False) if i >= 0 else None
+                if node is not None:
+                    ranked.append(NodeWithScore(node=node, score=float(dist)))
+            results.append(ranked)
+        return results
+
+    @property
+    def dim(self) -> int:
+        return self._matrix.vectors.shape[1] if self._matrix is not None else self.faiss_index.d
 
     def retrieve(self, query: str):
         try:
-            return self._retriever.retrieve(query)[: self.top_k]
+            with timing.stage("embed"):
+                embedding = self.embed_query(query)
+            with timing.stage("dense_search"):
+                if self._matrix is not None:
+                    return self._search_matrix(embedding)
+                bundle = QueryBundle(query_str=query, embedding=embedding)
+                return self._retriever.retrieve(bundle)[: self.top_k]
         except IndexError as e:
             if "0-dimensional" in str(e) or "too many indices" in str(e):
                 print(
@@ -57,4 +427,25 @@ class DenseRetriever:
                     file=sys.stderr,
                 )
                 return []
-            raise
\ No newline at end of file
+            raise
+
+    def retrieve_many(self, queries: list[str]) -> list[list[NodeWithScore]]:
+        """retrieve para várias queries: embeddings em lote e uma busca só para todas."""
+        with timing.stage("embed"):
+            embeddings = self.embed_queries(queries)
+        results: list[list[NodeWithScore]] = [[] for _ in queries]
+        valid = [i for i, e in enumerate(embeddings) if np.ndim(e) == 1 and len(e) == self.dim]
+        if len(valid) < len(queries):
+            print(
+                f"[DenseRetriever] aviso: {len(queries) - len(valid)} embedding(s) malformado(s), retornando lista vazia",
+                file=sys.stderr,
+            )
+        if not valid:
+            return results
+
+        matrix = np.asarray([embeddings[i] for i in valid], dtype=np.float32)
+        search = self._search_matrix_many if self._matrix is not None else self._search_faiss_many
+        with timing.stage("dense_search"):
+            for i, ranked in zip(valid, search(matrix)):
+                results[i] = ranked
+        return results
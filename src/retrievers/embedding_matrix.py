@@ -0,0 +1,92 @@
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+from utils.cache import read_manifest, write_manifest
+
+VECTORS_NAME = "vectors.npy"
+IDS_NAME = "ids.json"
+MANIFEST_NAME = "manifest.json"
+
+
+def nodes_fingerprint(nodes) -> str:
+    """Hash de (node_id, texto) de todos os nós, na ordem recebida."""
+    h = hashlib.sha256()
+    for node in nodes:
+        h.update(node.node_id.encode("utf-8"))
+        h.update(b"\0")
+        h.update(node.get_content().encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class EmbeddingMatrix:
+    """
+    Matriz de embeddings do corpus em formato compacto:
+    - vectors.npy: (n, dim) float32 ou float16, aberto com mmap (somente leitura)
+    - ids.json: chunk_id de cada linha
+    - manifest.json: modelo, dimensions, dtype e fingerprint do corpus
+
+    Com mmap, vários processos no mesmo host compartilham os vetores pelo page cache.
+    A busca é exata por produto interno (= cosseno para embeddings normalizados).
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: list[str], manifest: dict):
+        self.vectors = vectors
+        self.ids = ids
+        self.manifest = manifest
+
+    @staticmethod
+    def save(path: Path, vectors: np.ndarray, ids: list[str], manifest: dict, dtype: str = "float32"):
+        path.mkdir(parents=True, exist_ok=True)
+        # o manifest é gravado por último: sem ele a matriz é considerada inexistente
+        (path / MANIFEST_NAME).unlink(missing_ok=True)
+        # grava em arquivo temporário e troca: processos com o arquivo antigo em mmap não são afetados
+        tmp = path / (VECTORS_NAME + ".tmp")
+        with tmp.open("wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=dtype))
+        tmp.replace(path / VECTORS_NAME)
+        with (path / IDS_NAME).open("w", encoding="utf-8") as f:
+            json.dump(list(ids), f, ensure_ascii=False)
+        write_manifest(
+            path / MANIFEST_NAME,
+            {**manifest, "dtype": dtype, "n": int(vectors.shape[0]), "dim": int(vectors.shape[1])},
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "EmbeddingMatrix | None":
+        manifest = read_manifest(path / MANIFEST_NAME)
+        if manifest is None:
+            return None
+        vectors = np.load(path / VECTORS_NAME, mmap_mode="r")
+        with (path / IDS_NAME).open("r", encoding="utf-8") as f:
+            ids = json.load(f)
+        return cls(vectors, ids, manifest)
+
+    def search(self, query: np.ndarray, k: int, block_size: int = 65536) -> tuple[np.ndarray, np.ndarray]:
+        """Top-k por produto interno. Retorna (scores, índices de linha), do maior para o menor."""
+        return self.search_many(np.asarray(query, dtype=np.float32)[np.newaxis, :], k, block_size)[0]
+
+    def search_many(self, queries: np.ndarray, k: int, block_size: int = 65536) -> list[tuple[np.ndarray, np.ndarray]]:
+        """search para uma matriz (n_queries, dim) de queries, com um produto de matrizes por bloco de linhas."""
+        queries = np.asarray(queries, dtype=np.float32)
+        n = self.vectors.shape[0]
+        k = min(k, n)
+        if k <= 0:
+            return [(np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)) for _ in queries]
+
+        # em blocos para float16 não precisar virar float32 inteiro na memória
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        for start in range(0, n, block_size):
+            block = self.vectors[start : start + block_size]
+            scores[:, start : start + len(block)] = queries @ block.astype(np.float32, copy=False).T
+
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            # desempate pelo índice da linha para o ranking ser determinístico
+            top = top[np.lexsort((top, -row[top]))]
+            results.append((row[top], top))
+        return results
@@ -0,0 +1,86 @@
+import math
+
+import faiss
+import numpy as np
+
+# índices exatos (persistidos) e aproximados (construídos a partir dos vetores exatos)
+EXACT_TYPES = ("flat_l2", "flat_ip")
+INDEX_TYPES = EXACT_TYPES + ("hnsw", "ivf_flat", "ivf_pq")
+
+
+def default_nlist(n_vectors: int) -> int:
+    """~4*sqrt(n) listas, mantendo >= 39 vetores de treino por lista (recomendação do FAISS)."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def build_faiss_index(
+    index_type: str,
+    dim: int,
+    vectors: np.ndarray | None = None,
+    hnsw_m: int = 32,
+    ef_construction: int = 200,
+    nlist: int | None = None,
+    pq_m: int = 16,
+    pq_bits: int = 8,
+) -> faiss.Index:
+    """
+    Fábrica de índices FAISS. Os aproximados usam produto interno, que para
+    embeddings normalizados (caso da OpenAI) dá o mesmo ranking do cosseno/L2.
+    Se vectors for passado, treina (IVF) e adiciona na ordem recebida, então
+    o id FAISS i continua sendo a linha i da matriz.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"index_type inválido: {index_type!r} (use um de {INDEX_TYPES})")
+
+    if index_type == "flat_l2":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "flat_ip":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+    else:
+        if vectors is None:
+            raise ValueError(f"{index_type} precisa de vetores para treino")
+        nlist = nlist or default_nlist(len(vectors))
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_bits, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+
+    if vectors is not None:
+        index.add(vectors)
+    return index
+
+
+def set_search_params(index: faiss.Index, ef_search: int | None = None, nprobe: int | None = None):
+    """Ajusta os parâmetros de busca (efSearch para HNSW, nprobe para IVF). Ignora o que não se aplica."""
+    params = faiss.ParameterSpace()
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", ef_search)
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        params.set_index_parameter(index, "nprobe", nprobe)
+
+
+def index_type_of(index: faiss.Index) -> str | None:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexFlat):
+        return "flat_ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "flat_l2"
+    return None
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """Matriz (ntotal, dim) float32 com os vetores de um índice exato, na ordem dos ids."""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def index_nbytes(index: faiss.Index) -> int:
+    """Tamanho serializado do índice (aproximação da memória ocupada)."""
+    return int(faiss.serialize_index(index).nbytes)
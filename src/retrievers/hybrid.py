@@ -1,4 +1,8 @@
+import sys
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils import timing
 
 class Hybrid:
     """
@@ -6,24 +10,81 @@ class Hybrid:
 
     - Recebe uma lista de retrievers (ex.: [bm25, dense])
     - Para uma query:
-        1) roda retrieve em cada retriever
+        1) roda retrieve em cada retriever, em paralelo (threads)
         2) aplica RRF para fundir rankings
         3) retorna Top-K
+    - retrieve_many(queries) faz uma chamada retrieve_many por retriever para o lote
+      inteiro e funde cada query separadamente.
+
+    deadline_ms (opcional) limita a espera por query: quem não respondeu a tempo fica
+    de fora do RRF e o resultado sai degradado (metadata["degraded"] nos itens e
+    timing.mark_degraded com o nome dos retrievers que faltaram). Se nenhum respondeu
+    no prazo, espera o primeiro. O retriever atrasado continua rodando em segundo plano
+    (com o memo, o resultado dele fica para a próxima vez).
+    parallel=False volta à execução sequencial (e ignora o deadline).
 
     RRF score:
         score(doc) = sum_{retriever} 1 / (rrf_k + rank(doc))
     """
 
-    def __init__(self, retrievers: list, top_k: int = 5, rrf_k: int = 10):
+    def __init__(
+        self,
+        retrievers: list,
+        top_k: int = 5,
+        rrf_k: int = 10,
+        deadline_ms: float | None = None,
+        parallel: bool = True,
+        max_workers: int | None = None,
+    ):
         self.retrievers = retrievers
         self.top_k = top_k
         self.rrf_k = rrf_k
-    
+        self.deadline_ms = deadline_ms
+        self.parallel = parallel
+        # threads compartilhadas entre as queries (várias queries podem estar em voo no main.py)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hybrid") if parallel else None
+        self.degraded_count = 0
+
+    def _fan_out(self, method: str, arg) -> list:
+        """getattr(r, method)(arg) em cada retriever; None para quem perdeu o deadline."""
+        if self._pool is None:
+            return [getattr(r, method)(arg) for r in self.retrievers]
+
+        # cada retriever em um ramo do coletor: a latência cobra o mais lento, não a soma
+        futures = [timing.submit(self._pool, getattr(r, method), arg) for r in self.retrievers]
+        timeout = self.deadline_ms / 1000 if self.deadline_ms is not None else None
+        done, _ = wait(futures, timeout=timeout)
+        if not done:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+        missed = [r for r, f in zip(self.retrievers, futures) if f not in done]
+        if missed:
+            names = [getattr(r, "name", r.__class__.__name__) for r in missed]
+            self.degraded_count += 1
+            timing.mark_degraded(*names)
+            print(f"[Hybrid] aviso: deadline de {self.deadline_ms} ms perdido por {names}", file=sys.stderr)
+        for f in done:
+            timing.join(f)
+        return [f.result() if f in done else None for f in futures]
+
     def retrieve(self, query: str):
-        rankings = []
-        for r in self.retrievers:
-            results = r.retrieve(query)[: self.top_k]
-            rankings.append(results)
+        rankings = [results[: self.top_k] for results in self._fan_out("retrieve", query) if results is not None]
+        return self._fuse(rankings, degraded=len(rankings) < len(self.retrievers))
+
+    def retrieve_many(self, queries: list[str]):
+        # por retriever: uma lista de rankings, um por query (None se perdeu o deadline)
+        per_retriever = [r for r in self._fan_out("retrieve_many", queries) if r is not None]
+        degraded = len(per_retriever) < len(self.retrievers)
+        return [
+            self._fuse([rankings[i][: self.top_k] for rankings in per_retriever], degraded=degraded)
+            for i in range(len(queries))
+        ]
+
+    def _fuse(self, rankings: list, degraded: bool = False):
+        with timing.stage("rrf"):
+            return self._rrf(rankings, degraded)
+
+    def _rrf(self, rankings: list, degraded: bool = False):
         scores = defaultdict(float)
         by_id = {}
 
@@ -32,7 +93,7 @@ class Hybrid:
                 node_id = item.node.node_id
                 scores[node_id] += 1.0/(self.rrf_k + rank)
                 by_id[node_id] = item
-        
+
         fused = []
         for node_id, s in scores.items():
             base = by_id[node_id]
@@ -40,10 +101,12 @@ class Hybrid:
             # guarda o score RRF
             base.node.metadata = base.node.metadata or {}
             base.node.metadata["rrf_score"] = float(s)
+            if degraded:
+                base.node.metadata["degraded"] = True
 
             # score final do item vira o score do RRF
             base.score = float(s)
             fused.append(base)
 
         fused.sort(key=lambda x: x.score, reverse=True)
-        return fused[: self.top_k]
\ No newline at end of file
+        return fused[: self.top_k]
@@ -0,0 +1,139 @@
+import threading
+import time
+
+from llama_index.core.schema import NodeWithScore
+
+from utils import timing
+
+
+def copy_result(item: NodeWithScore) -> NodeWithScore:
+    """
+    Cópia defensiva de um resultado: Hybrid e FusionAgent alteram item.score e
+    node.metadata["rrf_score"], então quem recebe do memo não pode tocar no original.
+    """
+    node = item.node.model_copy(update={"metadata": dict(item.node.metadata or {})})
+    return NodeWithScore(node=node, score=item.score)
+
+
+class RetrievalMemo:
+    """
+    Memo de resultados de retrieval dentro de uma execução.
+
+    Chave: (identidade do retriever, query, profundidade/top_k).
+    hits = buscas no backend que foram economizadas.
+
+    Junto com o resultado fica o tempo por etapa (utils.timing) gasto para obtê-lo e
+    o custo dele no caminho crítico (parede + reaproveitado; no Hybrid, o retriever
+    mais lento, não a soma das etapas). Um hit soma as etapas e anda esse custo no
+    coletor ativo, então a latência de cada sistema é a que ele teria sozinho, mesmo
+    reaproveitando buscas de outro.
+    """
+
+    def __init__(self):
+        self._results: dict[tuple, list[NodeWithScore]] = {}
+        # chave -> (ms por etapa, custo no caminho crítico)
+        self._costs: dict[tuple, tuple[dict[str, float], float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def wrap(self, retriever) -> "MemoRetriever":
+        return MemoRetriever(retriever, memo=self)
+
+    def lookup(self, key: tuple) -> list[NodeWithScore] | None:
+        with self._lock:
+            results = self._results.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            cost = self._costs.get(key)
+        if cost is not None:
+            times = timing.current()
+            if times is not None:
+                times.replay(*cost)
+        return [copy_result(r) for r in results]
+
+    def store(
+        self, key: tuple, results: list[NodeWithScore], stage_ms: dict[str, float] | None = None, cost_ms: float = 0.0
+    ):
+        results = [copy_result(r) for r in results]
+        with self._lock:
+            self._results[key] = results
+            if stage_ms or cost_ms:
+                self._costs[key] = (stage_ms or {}, cost_ms)
+
+    def clear(self):
+        """Esvazia o memo (os contadores continuam)."""
+        with self._lock:
+            self._results.clear()
+            self._costs.clear()
+
+    def stats(self) -> dict:
+        return {"saved_searches": self.hits, "backend_searches": self.misses, "entries": len(self._results)}
+
+
+class MemoRetriever:
+    """
+    Envolve qualquer objeto com retrieve(query) e consulta o RetrievalMemo antes do backend.
+    retrieve_many(queries) manda ao backend só as queries que não estão no memo, em um lote.
+    Os demais atributos (top_k, etc.) são repassados ao retriever original.
+    """
+
+    def __init__(self, retriever, memo: RetrievalMemo):
+        self.retriever = retriever
+        self.memo = memo
+        # nome usado nos relatórios (o do retriever original)
+        self.name = getattr(retriever, "name", retriever.__class__.__name__)
+
+    def __getattr__(self, attr):
+        return getattr(self.retriever, attr)
+
+    def _key(self, query: str) -> tuple:
+        return (id(self.retriever), query, getattr(self.retriever, "top_k", None))
+
+    def _call(self, fn, arg) -> tuple[list, timing.StageTimes, float]:
+        """
+        fn(arg) medindo as etapas em um coletor próprio, que depois é somado ao de fora
+        (se houver). Retorna também o custo no caminho crítico (parede + reaproveitado).
+        """
+        outer = timing.current()
+        with timing.collect() as inner:
+            t0 = time.perf_counter()
+            results = fn(arg)
+            cost_ms = (time.perf_counter() - t0) * 1000 + inner.replayed_ms
+        if outer is not None:
+            outer.absorb(inner)
+        return results, inner, cost_ms
+
+    def retrieve(self, query: str):
+        key = self._key(query)
+        cached = self.memo.lookup(key)
+        if cached is not None:
+            return cached
+        results, times, cost_ms = self._call(self.retriever.retrieve, query)
+        # resultado degradado (ex.: deadline do Hybrid) não fica no memo
+        if not times.degraded:
+            # o memo guarda a sua própria cópia; results pode ser alterado por quem chamou
+            self.memo.store(key, results, times.ms, cost_ms)
+        return results
+
+    def retrieve_many(self, queries: list[str]):
+        results = [self.memo.lookup(self._key(q)) for q in queries]
+        # queries repetidas no lote vão uma vez só ao backend
+        missing = list(dict.fromkeys(q for q, r in zip(queries, results) if r is None))
+        if missing:
+            batch, times, cost_ms = self._call(self.retriever.retrieve_many, missing)
+            fetched = dict(zip(missing, batch))
+            # custo do lote dividido igualmente entre as queries que foram ao backend
+            share = {stage: ms / len(missing) for stage, ms in times.ms.items()}
+            if not times.degraded:
+                for q, r in fetched.items():
+                    self.memo.store(self._key(q), r, share, cost_ms / len(missing))
+            seen = set()
+            for i, q in enumerate(queries):
+                if results[i] is None:
+                    # a primeira ocorrência recebe o resultado do backend; as outras, cópias
+                    results[i] = fetched[q] if q not in seen else [copy_result(r) for r in fetched[q]]
+                    seen.add(q)
+        return results
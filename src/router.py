@@ -0,0 +1,134 @@
+import threading
+
+from agents import FusionAgent, StandardAgent
+from code_index import codes_in
+from query_rewrite import PRFRewriter, QueryRewriter
+
+# pipelines, do mais barato para o mais caro
+ROUTES = ("bm25", "hybrid", "fusion")
+
+# chamadas externas por query em cada pipeline (sem cache): reescritas no LLM e
+# textos embeddados (no Fusion, a original + n variações vão em um lote só)
+ROUTE_COST = {
+    "bm25": {"llm_calls": 0, "embedded_queries": 0},
+    "hybrid": {"llm_calls": 0, "embedded_queries": 1},
+    "fusion": {"llm_calls": 1, "embedded_queries": None},  # 1 + rewriter.n
+}
+
+
+def query_features(query: str, bm25_results: list, tokenize) -> dict:
+    """
+    Sinais baratos de uma query, tirados do texto e do ranking do BM25:
+    - codes: códigos da BNCC citados;
+    - n_terms: termos da query depois de stopwords e stemming;
+    - margin: (score do 1º - score do 2º) / score do 1º no BM25 (0 = empate);
+    - overlap: fração dos termos distintos da query presentes no 1º resultado do BM25.
+    """
+    tokens = tokenize(query)
+    terms = set(tokens)
+    scores = [r.score or 0.0 for r in bm25_results[:2]]
+    margin = (scores[0] - scores[1]) / scores[0] if len(scores) == 2 and scores[0] > 0 else 0.0
+    top_terms = set(tokenize(bm25_results[0].node.get_content())) if bm25_results else set()
+    return {
+        "codes": codes_in(query),
+        "n_terms": len(tokens),
+        "margin": float(margin),
+        "overlap": len(terms & top_terms) / len(terms) if terms else 0.0,
+    }
+
+
+class RouterAgent:
+    """
+    Escolhe, por query, o pipeline mais barato que deve bastar:
+    - bm25 (StandardAgent sobre o BM25): a query cita um código da BNCC, ou o BM25
+      está confiante (top-1 cobre ao menos min_overlap dos termos e se destaca do
+      2º por ao menos min_margin);
+    - fusion (FusionAgent sobre o Hybrid, com reescrita no LLM): pouca sobreposição
+      lexical (overlap < fusion_overlap) ou query curta demais (n_terms <= short_terms),
+      os casos em que as palavras da query não batem com as do documento;
+    - hybrid (StandardAgent sobre o Hybrid): o resto.
+
+    O BM25 roda sempre (é o que dá os sinais); se a rota for bm25, o ranking dele é
+    a resposta. Para as outras rotas não buscarem no BM25 de novo, bm25 e o BM25 de
+    dentro do hybrid devem passar pelo mesmo RetrievalMemo (ver bench_router.py).
+    routes conta quantas queries foram para cada pipeline (reset_routes zera).
+    """
+
+    def __init__(
+        self,
+        bm25,
+        hybrid,
+        rewriter: QueryRewriter | PRFRewriter,
+        top_k: int = 5,
+        min_margin: float = 0.10,
+        min_overlap: float = 0.8,
+        fusion_overlap: float = 0.6,
+        short_terms: int = 2,
+        **fusion_kwargs,
+    ):
+        self.bm25 = bm25
+        self.top_k = top_k
+        self.min_margin = min_margin
+        self.min_overlap = min_overlap
+        self.fusion_overlap = fusion_overlap
+        self.short_terms = short_terms
+        self.agents = {
+            "bm25": StandardAgent(retriever=bm25, top_k=top_k),
+            "hybrid": StandardAgent(retriever=hybrid, top_k=top_k),
+            "fusion": FusionAgent(retriever=hybrid, rewriter=rewriter, top_k=top_k, **fusion_kwargs),
+        }
+        self._lock = threading.Lock()
+        self.routes = {route: 0 for route in ROUTES}
+
+    def reset_routes(self):
+        with self._lock:
+            self.routes = {route: 0 for route in ROUTES}
+
+    def features(self, query: str, bm25_results: list) -> dict:
+        return query_features(query, bm25_results, self.bm25.tokenize)
+
+    def route(self, features: dict) -> str:
+        if features["codes"]:
+            return "bm25"
+        if features["overlap"] >= self.min_overlap and features["margin"] >= self.min_margin:
+            return "bm25"
+        if features["overlap"] < self.fusion_overlap or features["n_terms"] <= self.short_terms:
+            return "fusion"
+        return "hybrid"
+
+    def route_query(self, query: str) -> tuple[str, list, dict]:
+        """(rota, ranking do BM25, sinais) de uma query."""
+        bm25_results = self.bm25.retrieve(query)
+        features = self.features(query, bm25_results)
+        route = self.route(features)
+        with self._lock:
+            self.routes[route] += 1
+        return route, bm25_results, features
+
+    def retrieve(self, query: str):
+        route, bm25_results, _ = self.route_query(query)
+        if route == "bm25":
+            return bm25_results[: self.top_k]
+        return self.agents[route].retrieve(query)
+
+    def retrieve_many(self, queries: list[str]):
+        routed = [self.route_query(q) for q in queries]
+        results = [bm25_results[: self.top_k] if route == "bm25" else None for route, bm25_results, _ in routed]
+        # um lote por pipeline
+        for route in ("hybrid", "fusion"):
+            idx = [i for i, (r, _, _) in enumerate(routed) if r == route]
+            if idx:
+                for i, ranking in zip(idx, self.agents[route].retrieve_many([queries[i] for i in idx])):
+                    results[i] = ranking
+        return results
+
+    def cost(self, route: str) -> dict:
+        """Chamadas externas (sem cache) que a rota faz para uma query."""
+        cost = dict(ROUTE_COST[route])
+        rewriter = self.agents["fusion"].rewriter
+        if cost["embedded_queries"] is None:
+            cost["embedded_queries"] = 1 + rewriter.n
+        if route == "fusion" and isinstance(rewriter, PRFRewriter):
+            # expansão local: nenhuma chamada ao LLM
+            cost["llm_calls"] = 0
+        return cost
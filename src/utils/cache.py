@@ -0,0 +1,147 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+
+def sha256_file(path: Path, block_size: int = 1 << 20) -> str:
+    """Hash sha256 do conteúdo de um arquivo (lido em blocos)."""
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def fingerprint(payload: dict) -> str:
+    """
+    Hash estável de um dicionário de parâmetros.
+    Usado como chave de cache: se qualquer parâmetro mudar, a chave muda.
+    """
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def read_manifest(path: Path) -> dict | None:
+    if not path.exists():
+        return None
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def write_manifest(path: Path, payload: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    # troca atômica: um manifest só existe se o índice foi salvo por completo
+    tmp.replace(path)
+
+
+def normalize_text(text: str) -> str:
+    """Normalização usada nas chaves de cache: unicode NFC e espaços colapsados."""
+    text = unicodedata.normalize("NFC", text or "")
+    return " ".join(text.split())
+
+
+class DiskCache:
+    """
+    Cache chave -> valor (JSON) persistido em SQLite, com despejo LRU.
+
+    - O arquivo pode ser compartilhado entre processos (o SQLite cuida do lock).
+    - max_entries limita as entradas não fixadas; as usadas há mais tempo saem primeiro.
+    - hits/misses contam os acessos desta instância.
+    - entradas gravadas com pinned=True nunca são despejadas.
+    - cost_ms (opcional) guarda quanto custou produzir o valor (ex.: a chamada à API),
+      para quem lê do cache poder cobrar esse custo (ver utils.timing.charge).
+    """
+
+    def __init__(self, path: Path, max_entries: int | None = 20_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL, pinned INTEGER NOT NULL DEFAULT 0, "
+            "cost_ms REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cache)")}
+        if "pinned" not in columns:
+            # arquivos criados antes da coluna pinned
+            self._conn.execute("ALTER TABLE cache ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+        if "cost_ms" not in columns:
+            # arquivos criados antes da coluna cost_ms (entradas antigas ficam sem custo)
+            self._conn.execute("ALTER TABLE cache ADD COLUMN cost_ms REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+
+    def get(self, key: str, default=None):
+        value, _ = self.get_with_cost(key, default)
+        return value
+
+    def get_with_cost(self, key: str, default=None) -> tuple:
+        """(valor, cost_ms) da entrada; (default, None) se não existe. cost_ms é None se não foi gravado."""
+        with self._lock:
+            row = self._conn.execute("SELECT value, cost_ms FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default, None
+            self.hits += 1
+            self._conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value, pinned: bool = False, cost_ms: float | None = None):
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, last_used, pinned, cost_ms) VALUES (?, ?, ?, ?, ?)",
+                (key, raw, time.time(), int(pinned), cost_ms),
+            )
+            self._evict()
+
+    def pin(self, key: str, pinned: bool = True):
+        with self._lock:
+            self._conn.execute("UPDATE cache SET pinned = ? WHERE key = ?", (int(pinned), key))
+
+    def _evict(self):
+        if self.max_entries is None:
+            return
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM cache WHERE pinned = 0").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache WHERE pinned = 0 ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM cache WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,115 @@
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, TypeVar
+
+import openai
+
+# erros transitórios da API: rate limit, timeout/conexão e 5xx. Os demais (auth,
+# request inválido, parse do schema) não melhoram com nova tentativa.
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa barata de tokens (~4 caracteres por token em português)."""
+    return len(text or "") // 4 + 1
+
+
+def pack_batches(
+    items: list[T], item_tokens: Callable[[T], int], base_tokens: int, budget: int, max_items: int
+) -> list[list[T]]:
+    """
+    Agrupa items, na ordem, em lotes de até max_items cujo total estimado
+    (base_tokens do prompt + item_tokens de cada item) cabe em budget.
+    Um item que sozinho passa do orçamento vai em um lote só dele.
+    """
+    batches: list[list[T]] = []
+    current: list[T] = []
+    current_tokens = 0
+    for item in items:
+        tokens = item_tokens(item)
+        if current and (base_tokens + current_tokens + tokens > budget or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class RateLimiter:
+    """
+    Limitador por janela deslizante de requests/minuto e tokens/minuto.
+    Thread-safe: várias threads chamam acquire() antes de cada request.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        period: float = 60.0,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.period = period
+        self._events: deque[tuple[float, int]] = deque()
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= self.period:
+                    _, old_tokens = self._events.popleft()
+                    self._tokens_in_window -= old_tokens
+
+                requests_ok = self.requests_per_minute is None or len(self._events) < self.requests_per_minute
+                # um request maior que o limite inteiro passa sozinho (janela vazia)
+                tokens_ok = (
+                    self.tokens_per_minute is None
+                    or not self._events
+                    or self._tokens_in_window + tokens <= self.tokens_per_minute
+                )
+                if requests_ok and tokens_ok:
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                wait = self.period - (now - self._events[0][0])
+            time.sleep(max(wait, 0.01))
+
+
+def call_with_retries(
+    fn,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 30.0,
+    label: str = "",
+    retry_on: tuple[type[BaseException], ...] = RETRYABLE_ERRORS,
+):
+    """
+    Chama fn() com backoff exponencial (com jitter) nos erros de retry_on.
+    Outros erros sobem na hora; depois de max_retries tentativas extras, relança a última exceção.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt == max_retries:
+                raise
+            delay = min(max_delay, base_delay * 2**attempt) * (0.5 + random.random() / 2)
+            print(
+                f"[retry] {label} falhou ({type(e).__name__}: {e}); tentativa {attempt + 2}/{max_retries + 1} em {delay:.1f}s",
+                file=sys.stderr,
+            )
+            time.sleep(delay)
@@ -2,6 +2,7 @@ from pathlib import Path
 import re
 
 import csv
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -13,6 +14,20 @@ def mean(xs):
     return sum(xs) / len(xs) if xs else 0.0
 
 
+# percentis de latência reportados por sistema
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+def percentile(xs, q):
+    xs = [float(x) for x in xs if x is not None]
+    return float(np.percentile(xs, q)) if xs else 0.0
+
+
+def _stage_keys(rows: list[dict]) -> list[str]:
+    """Colunas <etapa>_ms do per_query (sem a latência total)."""
+    return [key for key in rows[0] if key.endswith("_ms") and key != "latency_ms"] if rows else []
+
+
 def _format_system_label(system: str) -> str:
     """Converte 'FusionAgent_BM25Retriever' em 'Fusion Agent\n- BM25' (quebra de linha e espaços)."""
     parts = system.split("_")
@@ -47,9 +62,13 @@ def save_per_query_csv(path: Path, rows: list[dict]):
         w.writerows(rows)
 
 
-def aggregate_summary(per_query_rows: list[dict], k: int) -> list[dict]:
+def aggregate_summary(per_query_rows: list[dict], k: int, cutoffs: list[int] | None = None) -> list[dict]:
     """
     Agrupa por (agent, retriever) e calcula médias das métricas.
+    mean_recall/mean_mrr/mean_ndcg são do cutoff principal k; com cutoffs,
+    também há colunas mean_<métrica>@<c> para cada cutoff. Se o per_query tiver
+    latency_ms, há latency_p50_ms/p95/p99 e a média de cada etapa (mean_<etapa>_ms);
+    com degraded, a fração de resultados degradados (degraded_rate).
     Retorna lista pronta pra tabela/gráfico.
     """
     key_recall = f"recall@{k}"
@@ -63,17 +82,26 @@ def aggregate_summary(per_query_rows: list[dict], k: int) -> list[dict]:
 
     summary = []
     for (agent, retriever), rs in grouped.items():
-        summary.append(
-            {
-                "system": f"{agent}_{retriever}",
-                "agent": agent,
-                "retriever": retriever,
-                "mean_recall": mean([x[key_recall] for x in rs]),
-                "mean_mrr": mean([x[key_mrr] for x in rs]),
-                "mean_ndcg": mean([x[key_ndcg] for x in rs]),
-                "n_queries": len(rs),
-            }
-        )
+        row = {
+            "system": f"{agent}_{retriever}",
+            "agent": agent,
+            "retriever": retriever,
+            "mean_recall": mean([x[key_recall] for x in rs]),
+            "mean_mrr": mean([x[key_mrr] for x in rs]),
+            "mean_ndcg": mean([x[key_ndcg] for x in rs]),
+        }
+        for c in cutoffs or []:
+            for metric in ("recall", "mrr", "ndcg"):
+                row[f"mean_{metric}@{c}"] = mean([x[f"{metric}@{c}"] for x in rs])
+        if "latency_ms" in rs[0]:
+            for q in LATENCY_PERCENTILES:
+                row[f"latency_p{q}_ms"] = percentile([x["latency_ms"] for x in rs], q)
+            for key in _stage_keys(rs):
+                row[f"mean_{key}"] = mean([x[key] for x in rs])
+        if "degraded" in rs[0]:
+            row["degraded_rate"] = mean([x["degraded"] for x in rs])
+        row["n_queries"] = len(rs)
+        summary.append(row)
 
     summary.sort(key=lambda x: x["mean_ndcg"], reverse=True)
     return summary
@@ -89,14 +117,41 @@ def save_summary_csv(path: Path, summary_rows: list[dict]):
         w.writerows(summary_rows)
 
 
-def save_table_md(path: Path, summary_rows: list[dict], k: int):
+def save_table_md(path: Path, summary_rows: list[dict], k: int, cutoffs: list[int] | None = None):
     lines = []
-    lines.append(f"| System | nDCG@{k} | MRR@{k} | Recall@{k} | #Queries |")
-    lines.append("|---|---:|---:|---:|---:|")
+    has_latency = bool(summary_rows) and "latency_p50_ms" in summary_rows[0]
+    latency_header = "".join(f" p{q} ms |" for q in LATENCY_PERCENTILES) if has_latency else ""
+    lines.append(f"| System | nDCG@{k} | MRR@{k} | Recall@{k} |{latency_header} #Queries |")
+    lines.append("|---|---:|---:|---:|" + ("---:|" * len(LATENCY_PERCENTILES) if has_latency else "") + "---:|")
     for r in summary_rows:
+        latency = "".join(f" {r[f'latency_p{q}_ms']:.1f} |" for q in LATENCY_PERCENTILES) if has_latency else ""
         lines.append(
-            f"| {r['system']} | {r['mean_ndcg']:.3f} | {r['mean_mrr']:.3f} | {r['mean_recall']:.3f} | {r['n_queries']} |"
+            f"| {r['system']} | {r['mean_ndcg']:.3f} | {r['mean_mrr']:.3f} | {r['mean_recall']:.3f} |{latency} {r['n_queries']} |"
         )
+
+    # uma tabela por métrica com todos os cutoffs
+    if cutoffs and list(cutoffs) != [k]:
+        for metric, label in (("ndcg", "nDCG"), ("mrr", "MRR"), ("recall", "Recall")):
+            lines.append("")
+            lines.append("| System | " + " | ".join(f"{label}@{c}" for c in cutoffs) + " |")
+            lines.append("|---|" + "---:|" * len(cutoffs))
+            for r in summary_rows:
+                values = " | ".join(f"{r[f'mean_{metric}@{c}']:.3f}" for c in cutoffs)
+                lines.append(f"| {r['system']} | {values} |")
+
+    # tempo médio por etapa (ms), para ver onde cada sistema gasta a latência
+    stage_keys = [key[len("mean_"):] for key in summary_rows[0] if key.startswith("mean_") and key.endswith("_ms")] if has_latency else []
+    if stage_keys:
+        has_degraded = "degraded_rate" in summary_rows[0]
+        lines.append("")
+        lines.append("| System | " + " | ".join(f"{key[:-3]} ms" for key in stage_keys) + (" | degraded" if has_degraded else "") + " |")
+        lines.append("|---|" + "---:|" * (len(stage_keys) + has_degraded))
+        for r in summary_rows:
+            values = " | ".join(f"{r[f'mean_{key}']:.2f}" for key in stage_keys)
+            if has_degraded:
+                values += f" | {r['degraded_rate']:.1%}"
+            lines.append(f"| {r['system']} | {values} |")
+
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text("\n".join(lines), encoding="utf-8")
 
@@ -113,6 +168,7 @@ def save_table_as_figure(path: Path, summary_rows: list[dict], k: int):
                 f"nDCG@{k}": f"{r['mean_ndcg']:.3f}",
                 f"MRR@{k}": f"{r['mean_mrr']:.3f}",
                 f"Recall@{k}": f"{r['mean_recall']:.3f}",
+                **({"p95 ms": f"{r['latency_p95_ms']:.1f}"} if "latency_p95_ms" in r else {}),
                 "#Queries": r["n_queries"],
             }
             for r in summary_rows
@@ -164,7 +220,25 @@ def save_barplot(path: Path, summary_rows: list[dict], metric_key: str, ylabel:
     plt.close()
 
 
-def generate_results(out_dir: Path, per_query_rows: list[dict], k: int):
+def save_cutoff_plot(path: Path, summary_rows: list[dict], metric: str, cutoffs: list[int], ylabel: str):
+    """Uma linha por sistema: métrica média em função do cutoff."""
+    plt.rcParams["font.family"] = "Segoe UI"
+    fig, ax = plt.subplots(figsize=(12, 6))
+    colors = sns.color_palette("Purples", n_colors=len(summary_rows) + 2)[2:][::-1]
+    for color, r in zip(colors, summary_rows):
+        values = [r[f"mean_{metric}@{c}"] for c in cutoffs]
+        ax.plot(cutoffs, values, marker="o", color=color, label=_format_system_label(r["system"]).replace("\n", " "))
+    ax.set_xticks(cutoffs)
+    ax.set_xlabel("k", fontsize=20)
+    ax.set_ylabel(ylabel, fontsize=20)
+    ax.legend(fontsize=11, frameon=False)
+    _apply_plot_style(ax)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    plt.savefig(path, dpi=300, bbox_inches="tight")
+    plt.close()
+
+
+def generate_results(out_dir: Path, per_query_rows: list[dict], k: int, cutoffs: list[int] | None = None):
     """
     Gera todos os artefatos de avaliação:
     - per_query.csv
@@ -173,6 +247,8 @@ def generate_results(out_dir: Path, per_query_rows: list[dict], k: int):
     - table_summary.png (tabela como imagem)
     - plot_ndcg.png
     - plot_mrr.png
+    - plot_<métrica>_by_k.png (se houver mais de um cutoff)
+    k é o cutoff principal; cutoffs lista todos os cutoffs presentes no per_query.
     Retorna (summary_rows, paths) para você poder logar na main.
     """
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -186,9 +262,9 @@ def generate_results(out_dir: Path, per_query_rows: list[dict], k: int):
 
     save_per_query_csv(per_query_csv, per_query_rows)
 
-    summary_rows = aggregate_summary(per_query_rows, k=k)
+    summary_rows = aggregate_summary(per_query_rows, k=k, cutoffs=cutoffs)
     save_summary_csv(summary_csv, summary_rows)
-    save_table_md(table_md, summary_rows, k=k)
+    save_table_md(table_md, summary_rows, k=k, cutoffs=cutoffs)
     save_table_as_figure(table_png, summary_rows, k=k)
 
     save_barplot(plot_ndcg, summary_rows, metric_key="mean_ndcg", ylabel=f"mean nDCG@{k}")
@@ -203,4 +279,10 @@ def generate_results(out_dir: Path, per_query_rows: list[dict], k: int):
         "plot_mrr": plot_mrr,
     }
 
+    if cutoffs and len(cutoffs) > 1:
+        for metric, label in (("ndcg", "nDCG"), ("mrr", "MRR"), ("recall", "Recall")):
+            plot_path = out_dir / f"plot_{metric}_by_k.png"
+            save_cutoff_plot(plot_path, summary_rows, metric, cutoffs, ylabel=f"mean {label}@k")
+            paths[f"plot_{metric}_by_k"] = plot_path
+
     return summary_rows, paths
@@ -0,0 +1,157 @@
+"""
+Tempo por etapa do retrieval de uma query (rewrite, embedding, busca densa, BM25, RRF).
+
+Quem avalia abre um coletor com collect(); o código instrumentado marca as etapas
+com stage("nome"). Sem coletor ativo (ex.: judge.py), stage() não mede nada.
+O coletor fica em uma ContextVar, então cada thread do main.py tem o seu; quem
+dispara trabalho em outras threads (ex.: o fan-out do Hybrid) usa submit, que roda
+cada ramo em um coletor filho, e join ao consumir o resultado, que soma as etapas
+do ramo no coletor de quem chamou.
+
+Resultados reaproveitados (memo, cache de reescritas e embeddings) custam ~0 ms;
+replay/charge somam o custo gravado quando eles foram produzidos, para a latência
+de cada sistema ser a que ele teria sem memo nem cache. Esse custo anda pelo caminho
+crítico: ramos paralelos cobram o mais caro, não a soma (ver join).
+
+O coletor também registra se o resultado saiu degradado (ex.: um retriever do
+Hybrid perdeu o deadline), via mark_degraded.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# etapas instrumentadas, na ordem das colunas <etapa>_ms do per_query.csv
+STAGES = ("rewrite", "embed", "dense_search", "bm25", "rrf")
+
+
+class StageTimes:
+    """
+    Milissegundos acumulados por etapa (somados, inclusive entre ramos paralelos).
+    replayed_ms: quanto o caminho crítico anda além do relógio por causa de custos
+    reaproveitados (memo, caches); a latência é o tempo de parede + replayed_ms.
+    degraded: nomes dos componentes que ficaram de fora do resultado.
+    """
+
+    def __init__(self, replayed_ms: float = 0.0):
+        self.ms: dict[str, float] = {}
+        self.replayed_ms = replayed_ms
+        self.degraded: list[str] = []
+        # fim do ramo (perf_counter), para join; ver submit
+        self.ended: float | None = None
+        # etapas podem vir de várias threads (fan-out do Hybrid)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, ms: float):
+        with self._lock:
+            self.ms[stage] = self.ms.get(stage, 0.0) + ms
+
+    def merge(self, ms: dict[str, float]):
+        for stage, value in ms.items():
+            self.add(stage, value)
+
+    def replay(self, ms: dict[str, float], cost_ms: float):
+        """Resultado reaproveitado: soma as etapas dele e anda cost_ms no caminho crítico."""
+        self.merge(ms)
+        with self._lock:
+            self.replayed_ms += cost_ms
+
+    def absorb(self, other: "StageTimes"):
+        """Soma um coletor aninhado (mesma thread, em sequência) neste."""
+        self.merge(other.ms)
+        with self._lock:
+            self.replayed_ms += other.replayed_ms
+            self.degraded.extend(other.degraded)
+
+    def row(self) -> dict[str, float]:
+        return {f"{stage}_ms": self.ms.get(stage, 0.0) for stage in STAGES}
+
+
+_current: ContextVar[StageTimes | None] = ContextVar("stage_times", default=None)
+
+
+def current() -> StageTimes | None:
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    """Coletor para o bloco; um coletor aninhado só soma no de fora via StageTimes.absorb."""
+    times = StageTimes()
+    token = _current.set(times)
+    try:
+        yield times
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    times = _current.get()
+    if times is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        times.add(name, (time.perf_counter() - t0) * 1000)
+
+
+def charge(name: str, ms: float | None):
+    """Cobra na etapa o custo de um resultado reaproveitado (ex.: cache hit)."""
+    times = _current.get()
+    if times is not None and ms:
+        times.replay({name: ms}, ms)
+
+
+def mark_degraded(*names: str):
+    times = _current.get()
+    if times is not None:
+        with times._lock:
+            times.degraded.extend(names)
+
+
+def submit(pool, fn, *args):
+    """
+    pool.submit(fn, *args) com o contexto de quem chamou e um coletor filho, que parte
+    do replayed_ms atual do pai. O pai chama join(future) ao usar o resultado.
+    """
+    parent = _current.get()
+    ctx = contextvars.copy_context()
+    if parent is None:
+        return pool.submit(ctx.run, fn, *args)
+    child = StageTimes(replayed_ms=parent.replayed_ms)
+
+    def run():
+        token = _current.set(child)
+        try:
+            return fn(*args)
+        finally:
+            child.ended = time.perf_counter()
+            _current.reset(token)
+
+    future = pool.submit(ctx.run, run)
+    future.stage_times = child
+    return future
+
+
+def join(future):
+    """
+    Soma no coletor atual as etapas de um ramo de submit que já terminou. O caminho
+    crítico fica no máximo entre o do pai e o fim do ramo: ramos paralelos não somam
+    os custos reaproveitados. Ramos que não são juntados (ex.: perderam o deadline)
+    ficam de fora.
+    """
+    child = getattr(future, "stage_times", None)
+    parent = _current.get()
+    if child is None or parent is None or child.ended is None:
+        return
+    future.stage_times = None
+    # o pai pode ter esperado além do fim do ramo: essa folga já está no relógio dele
+    slack_ms = (time.perf_counter() - child.ended) * 1000
+    parent.merge(child.ms)
+    with parent._lock:
+        parent.degraded.extend(child.degraded)
+        parent.replayed_ms = max(parent.replayed_ms, child.replayed_ms - slack_ms)